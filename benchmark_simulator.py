@@ -0,0 +1,160 @@
+import hashlib
+import json
+import os
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from energy_engine import MEASURES, peak_memory
+from energy_ledger import TradeLedger
+from energy_market import OrderBook
+from energy_simulatorV1 import EnergyDataSimulator
+
+
+def legacy_generate_data(simulator, start_date):
+    """Previous result assembly: one DataFrame per user from lists of rounded floats, then pd.concat"""
+    total_intervals = int((simulator.days * 24 * 60) / simulator.interval_minutes)
+    timestamps = pd.date_range(start_date, periods=total_intervals, freq=f'{simulator.interval_minutes}min')
+    columns = simulator._simulate_users(simulator.user_profiles, simulator._timeline(start_date))
+
+    all_user_data = []
+    for i, profile in enumerate(simulator.user_profiles):
+        rows = slice(i * total_intervals, (i + 1) * total_intervals)
+        user_df = pd.DataFrame({
+            'timestamp': timestamps.to_pydatetime().tolist(),
+            'user_id': profile["user_id"],
+            'user_type': profile["user_type"],
+            **{name: [round(value, 2) for value in columns[name][rows].tolist()] for name in MEASURES}
+        })
+        all_user_data.append(user_df)
+
+    return pd.concat(all_user_data, ignore_index=True)
+
+
+def benchmark_memory(num_users=500, days=30, interval_minutes=15):
+    """Compare peak memory and time of the legacy assembly against the preallocated columnar result"""
+    start_date = datetime(2024, 1, 1)
+    legacy = EnergyDataSimulator(num_users=num_users, days=days, interval_minutes=interval_minutes)
+    columnar = {}
+    for dtype in (np.float64, np.float32):
+        columnar[dtype] = EnergyDataSimulator(num_users=0, days=days, interval_minutes=interval_minutes, dtype=dtype)
+        columnar[dtype].user_profiles = legacy.user_profiles
+
+    runs = [
+        ("legacy (per-user frames + concat)", lambda: legacy_generate_data(legacy, start_date)),
+        ("columnar float64", lambda: columnar[np.float64].generate_data(start_date)),
+        ("columnar float32", lambda: columnar[np.float32].generate_data(start_date))
+    ]
+
+    peaks = {}
+    for name, generate in runs:
+        started = time.perf_counter()
+        with peak_memory() as usage:
+            data = generate()
+        elapsed = time.perf_counter() - started
+        peaks[name] = usage['peak_bytes']
+        print(f"{name:36s} rows={len(data):>10,d}  time={elapsed:7.2f}s  "
+              f"peak={usage['peak_bytes'] / 2**20:9.1f} MB  "
+              f"frame={data.memory_usage(deep=True).sum() / 2**20:9.1f} MB")
+        del data
+
+    baseline = peaks[runs[0][0]]
+    for name, peak in peaks.items():
+        print(f"{name:36s} peak reduction vs legacy: {baseline / peak:5.1f}x")
+    return peaks
+
+
+def legacy_seal_blocks(trades, block_size):
+    """Per-trade hashing: every trade serialized to JSON and hashed on its own, Merkle pairs hashed one by one"""
+    rows = trades.to_dict('records')
+    prev_hash = bytes(32)
+    for start in range(0, len(rows), block_size):
+        level = [hashlib.sha256(b'\x00' + json.dumps(row, default=str).encode()).digest()
+                 for row in rows[start:start + block_size]]
+        while len(level) > 1:
+            if len(level) % 2:
+                level.append(level[-1])
+            level = [hashlib.sha256(b'\x01' + level[i] + level[i + 1]).digest() for i in range(0, len(level), 2)]
+        prev_hash = hashlib.sha256(prev_hash + level[0]).digest()
+    return prev_hash
+
+
+def benchmark_ledger(participants=100_000, intervals=10, block_size=1024):
+    """Throughput of sealing market trades into ledger blocks, in trades/s and blocks/s"""
+    rng = np.random.default_rng(0)
+    ids = np.array([f"user_{i:06d}" for i in range(participants)])
+    batches = []
+    for hour in range(intervals):
+        net = rng.normal(0, 2, participants).round(2)
+        book = OrderBook()
+        book.add_asks(ids, net, rng.uniform(0.08, 0.14, participants).round(3))
+        book.add_bids(ids, -net, rng.uniform(0.10, 0.18, participants).round(3))
+        batches.append(book.clear(timestamp=pd.Timestamp(2024, 1, 1) + pd.Timedelta(hours=hour)))
+    trades = pd.concat(batches, ignore_index=True)
+    blocks = -(-len(trades) // block_size)
+
+    def bulk_in_memory():
+        ledger = TradeLedger(block_size=block_size)
+        for batch in batches:
+            ledger.append(batch)
+        ledger.close()
+
+    def bulk_to_file():
+        with tempfile.TemporaryDirectory() as directory:
+            with TradeLedger(os.path.join(directory, "ledger"), block_size=block_size) as ledger:
+                for batch in batches:
+                    ledger.append(batch)
+
+    runs = [
+        ("per-trade JSON + SHA-256", lambda: legacy_seal_blocks(trades, block_size)),
+        ("TradeLedger (in memory)", bulk_in_memory),
+        ("TradeLedger (ledger directory)", bulk_to_file)
+    ]
+
+    print(f"{len(trades):,d} trades from {intervals} intervals of {participants:,d} participants, "
+          f"{blocks:,d} blocks of {block_size}")
+    rates = {}
+    for name, seal in runs:
+        started = time.perf_counter()
+        seal()
+        elapsed = time.perf_counter() - started
+        rates[name] = len(trades) / elapsed
+        print(f"{name:30s} time={elapsed:6.2f}s  {len(trades) / elapsed:>12,.0f} trades/s  "
+              f"{blocks / elapsed:>9,.0f} blocks/s")
+    return rates
+
+
+def benchmark_ledger_startup(block_counts=(1_000, 10_000, 100_000), block_size=4, users=1_000):
+    """Time to reopen a ledger directory and serve a user's trade history, for growing numbers of blocks"""
+    ids = np.array([f"user_{i:06d}" for i in range(users)])
+    timings = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for count in block_counts:
+            path = os.path.join(directory, f"ledger_{count}")
+            sellers = np.resize(ids, count * block_size)
+            trades = pd.DataFrame({'seller_id': sellers, 'buyer_id': np.roll(sellers, 1),
+                                   'quantity_kwh': 1.0, 'price': 0.1})
+            with TradeLedger(path, block_size=block_size) as ledger:
+                for start in range(0, len(trades), 100_000):
+                    ledger.append(trades.iloc[start:start + 100_000])
+
+            started = time.perf_counter()
+            ledger = TradeLedger(path, block_size=block_size)
+            head = ledger.head
+            opened = time.perf_counter()
+            proofs = ledger.user_proofs(ids[0], limit=50)
+            history = time.perf_counter()
+            ledger.close()
+            timings[count] = (opened - started, history - opened)
+            print(f"{count:>9,d} blocks  open={(opened - started) * 1e3:7.2f}ms  "
+                  f"{len(proofs)} proofs of {ids[0]}={(history - opened) * 1e3:7.2f}ms  head={head.hex()[:16]}")
+    return timings
+
+
+if __name__ == "__main__":
+    benchmark_memory()
+    benchmark_ledger()
+    benchmark_ledger_startup()
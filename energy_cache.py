@@ -0,0 +1,101 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+
+class SimulationCache:
+    def __init__(self, max_entries=32, max_bytes=256 * 2**20, ttl_seconds=300):
+        """
+        Keyed cache for simulation results with LRU + TTL eviction.
+
+        Parameters:
+        - max_entries: Maximum number of cached results
+        - max_bytes: Maximum total size of the cached results in bytes
+        - ttl_seconds: Seconds a result stays valid after it was computed
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.current_bytes = 0
+        self._entries = OrderedDict()  # key -> (expires_at, size_bytes, value), least recently used first
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached value for key (None on a miss or if it expired)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                self._remove(key)
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, key, value):
+        """Cache value under key, evicting least recently used results to respect the caps"""
+        size = _size_of(value)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, size, value)
+            self.current_bytes += size
+
+            while len(self._entries) > self.max_entries or self.current_bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def get_or_compute(self, key, compute):
+        """Return the cached value for key, calling compute() and caching its result on a miss (None is not cached)"""
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            if value is not None:
+                self.put(key, value)
+        return value
+
+    def clear(self):
+        """Drop all cached results (the counters are kept)"""
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        """Hit/miss counters and current usage of the cache"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self.current_bytes -= size
+
+
+def _size_of(value):
+    """Approximate size of a cached value in bytes"""
+    if hasattr(value, 'memory_usage'):
+        return int(value.memory_usage(deep=True).sum())
+    if hasattr(value, 'nbytes'):
+        return int(value.nbytes)
+    return sys.getsizeof(value)
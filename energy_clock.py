@@ -0,0 +1,61 @@
+import argparse
+import time
+from datetime import timedelta
+
+# Clock modes: simulated time at wall-clock speed, sped up by a factor, or not paced at all
+CLOCK_MODES = ('realtime', 'accelerated', 'fast')
+
+
+class SimulationClock:
+    def __init__(self, mode='accelerated', speedup=3600.0):
+        """
+        Paces a simulation loop against the wall clock.
+
+        Parameters:
+        - mode: 'realtime' (a simulated hour takes an hour), 'accelerated'
+          (speedup simulated seconds per second) or 'fast' (no waiting, for
+          batch and regression runs)
+        - speedup: Simulated seconds per wall-clock second in accelerated mode
+          (3600 plays a simulated hour per second)
+
+        Steps are scheduled from the start of the run rather than slept one by
+        one, so the time a step takes to compute is not added to the pacing.
+        """
+        if mode not in CLOCK_MODES:
+            raise ValueError(f"Unknown clock mode: {mode} (expected one of {', '.join(CLOCK_MODES)})")
+        if mode == 'accelerated' and speedup <= 0:
+            raise ValueError("speedup must be positive")
+        self.mode = mode
+        self.speedup = 1.0 if mode == 'realtime' else float(speedup)
+        self.start()
+
+    def start(self):
+        """(Re)start the run: simulated time 0 is now"""
+        self.elapsed = timedelta(0)
+        self._origin = time.monotonic()
+
+    def tick(self, step=timedelta(hours=1)):
+        """Advance simulated time by one step, waiting until the wall clock catches up with it"""
+        self.elapsed += step
+        if self.mode == 'fast':
+            return
+        delay = self._origin + self.elapsed.total_seconds() / self.speedup - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+
+def add_clock_arguments(parser, speedup=3600.0):
+    """Add the --clock and --speedup options to an argparse parser"""
+    parser.add_argument('--clock', choices=CLOCK_MODES, default='accelerated',
+                        help="Pacing of the simulation: real time, accelerated by --speedup, "
+                             "or as fast as possible (default: %(default)s)")
+    parser.add_argument('--speedup', type=float, default=speedup,
+                        help="Simulated seconds per second in accelerated mode (default: %(default)s)")
+
+
+def clock_from_args(speedup=3600.0, description=None, argv=None):
+    """SimulationClock configured from the command line (--clock, --speedup)"""
+    parser = argparse.ArgumentParser(description=description)
+    add_clock_arguments(parser, speedup)
+    args = parser.parse_args(argv)
+    return SimulationClock(args.clock, args.speedup)
@@ -0,0 +1,129 @@
+import time
+
+import matplotlib.pyplot as plt
+import numpy as np
+
+from energy_plotting import axes_pixel_width, downsample
+
+
+class LiveDashboard:
+    def __init__(self, panels, x='hour', fps=10, xlim=None, figsize=(12, 8), downsample_method='minmax'):
+        """
+        Live line plots that are created once and redrawn with blitting.
+
+        Every frame only the lines are redrawn over a saved background of the
+        axes, so the cost of a frame does not include rebuilding axes, ticks
+        or legends. Axis limits grow in steps with headroom, so the full
+        redraws needed when the data outgrows them stay rare, and lines longer
+        than the axes are wide are downsampled to their width in pixels, so a
+        frame takes about the same time however long the history gets.
+
+        Parameters:
+        - panels: One dict per subplot with "title", "xlabel", "ylabel" and
+          "lines", a list of (series name, format string, label)
+        - x: Name of the series holding the x values
+        - fps: Frames per second run() renders at
+        - xlim: Fixed x limits (grown with the data if None)
+        - figsize: Size of the figure in inches
+        - downsample_method: 'minmax' or 'lttb' (see energy_plotting.downsample), None to draw every point
+        """
+        self.x = x
+        self.fps = fps
+        self.downsample_method = downsample_method
+        self.fig, axes = plt.subplots(len(panels), 1, figsize=figsize, squeeze=False)
+        self.axes = list(axes[:, 0])
+        self.lines = {}  # series name -> (axes, Line2D)
+        self._background = None
+
+        for ax, panel in zip(self.axes, panels):
+            for name, fmt, label in panel["lines"]:
+                # Animated lines are left out of full draws and drawn on top of the saved background
+                line, = ax.plot([], [], fmt, label=label, animated=True)
+                self.lines[name] = (ax, line)
+            ax.set_title(panel["title"])
+            ax.set_xlabel(panel["xlabel"])
+            ax.set_ylabel(panel["ylabel"])
+            ax.legend(loc='upper left')
+            ax.grid(True)
+            ax.set_xlim(*(xlim or (0, 1)))
+            ax.set_ylim(0, 1)
+        self._fixed_xlim = xlim is not None
+
+        self.fig.tight_layout()
+        # Every full draw (first show, resize, new limits) saves a fresh background
+        self._draw_handler = self.fig.canvas.mpl_connect('draw_event', self._on_draw)
+        plt.show(block=False)
+        self.fig.canvas.draw()
+
+    def update(self, series):
+        """Show the current data: a dict of series name -> values (with the x series)"""
+        x = series[self.x]
+        for name, (ax, line) in self.lines.items():
+            if self.downsample_method is None:
+                line.set_data(x, series[name])
+            else:
+                line.set_data(*downsample(x, series[name], axes_pixel_width(ax), self.downsample_method))
+
+        if self._grow_limits(series) or self._background is None:
+            # Ticks change with the limits, so the axes have to be drawn in full once
+            self.fig.canvas.draw()
+        else:
+            self.fig.canvas.restore_region(self._background)
+            self._draw_lines()
+        self.fig.canvas.blit(self.fig.bbox)
+        self.fig.canvas.flush_events()
+
+    def run(self, snapshot, finished):
+        """
+        Render frames at the configured frame rate until finished() returns True.
+
+        snapshot() returns the data to show (see update); it runs once per
+        frame, so a simulation producing the data in another thread is never
+        slowed down by rendering. The last frame is drawn after finished().
+        """
+        frame = 1.0 / self.fps
+        next_frame = time.perf_counter()
+        while True:
+            done = finished()
+            self.update(snapshot())
+            if done:
+                break
+            next_frame += frame
+            # Keep the GUI responsive until the next frame; frames are skipped, not queued, when late
+            self.fig.canvas.start_event_loop(max(next_frame - time.perf_counter(), 0.001))
+            next_frame = max(next_frame, time.perf_counter())
+
+    def finish(self):
+        """Turn the lines into regular artists so the final figure can be shown, saved or resized"""
+        self.fig.canvas.mpl_disconnect(self._draw_handler)
+        for _, line in self.lines.values():
+            line.set_animated(False)
+        self.fig.canvas.draw()
+
+    def _on_draw(self, event):
+        self._background = self.fig.canvas.copy_from_bbox(self.fig.bbox)
+        self._draw_lines()
+
+    def _draw_lines(self):
+        for ax, line in self.lines.values():
+            ax.draw_artist(line)
+
+    def _grow_limits(self, series):
+        """Widen the axis limits the data outgrew, with 25% headroom; True if any changed"""
+        changed = False
+        x = np.asarray(series[self.x], dtype=float)
+        for ax in self.axes:
+            if len(x) and not self._fixed_xlim and x.max() > ax.get_xlim()[1]:
+                ax.set_xlim(x.min(), x.max() * 1.25)
+                changed = True
+
+            values = [np.asarray(line.get_ydata(), dtype=float) for line_ax, line in self.lines.values()
+                      if line_ax is ax and len(line.get_ydata())]
+            if not values:
+                continue
+            low, high = min(v.min() for v in values), max(v.max() for v in values)
+            bottom, top = ax.get_ylim()
+            if low < bottom or high > top:
+                ax.set_ylim(min(bottom, low * 1.25), max(top, high * 1.25))
+                changed = True
+        return changed
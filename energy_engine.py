@@ -0,0 +1,582 @@
+import itertools
+import re
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+from energy_cache import SimulationCache
+
+# Measure columns produced by the engine, in output order
+MEASURES = ['consumption_kwh', 'production_kwh', 'battery_level_kwh', 'grid_import_kwh', 'grid_export_kwh']
+
+# Consumption patterns in code order (index into the pattern factor table)
+CONSUMPTION_PATTERNS = ["Day Worker", "Night Worker", "Home Office", "Weekend Active"]
+
+# Levels of the rollup pyramid, finest first: name -> bucket width
+ROLLUP_LEVELS = {
+    '15min': pd.Timedelta(minutes=15),
+    'hour': pd.Timedelta(hours=1),
+    'day': pd.Timedelta(days=1),
+    'week': pd.Timedelta(weeks=1)
+}
+
+# Random streams; every (seed, stream, user) triple is an independent sequence
+STREAM_PROFILE = 1
+STREAM_BATTERY = 2
+STREAM_CONSUMPTION = 3
+STREAM_WEATHER = 4
+
+_MASK64 = (1 << 64) - 1
+_GOLDEN = np.uint64(0x9E3779B97F4A7C15)
+
+
+def _mix64(x, scratch=None):
+    """SplitMix64 finalizer, applied in place to a uint64 array"""
+    if scratch is None:
+        scratch = np.empty_like(x)
+    for shift, multiplier in ((30, 0xBF58476D1CE4E5B9), (27, 0x94D049BB133111EB)):
+        np.right_shift(x, np.uint64(shift), out=scratch)
+        x ^= scratch
+        x *= np.uint64(multiplier)
+    np.right_shift(x, np.uint64(31), out=scratch)
+    x ^= scratch
+    return x
+
+
+def random_streams(seed, stream, user_keys, counters):
+    """
+    Counter-based uniform draws in [0, 1).
+
+    Every (seed, stream, user key) triple is an independent random sequence
+    indexed by counter (e.g. the interval number). A user's values therefore
+    do not depend on which other users are simulated alongside it, how the
+    run is sharded or how the timeline is split into blocks.
+
+    Returns an array of shape (len(counters), len(user_keys)).
+    """
+    stream_key = _mix64(np.array([(seed + stream * int(_GOLDEN)) & _MASK64], dtype=np.uint64))
+    keys = np.asarray(user_keys, dtype=np.uint64) * _GOLDEN
+    keys += stream_key
+    _mix64(keys)
+
+    # One counter at a time keeps the working arrays in cache
+    draws = np.empty((len(counters), len(keys)))
+    x = np.empty_like(keys)
+    scratch = np.empty_like(keys)
+    for row, counter in enumerate(counters):
+        np.add(keys, np.uint64((int(counter) * int(_GOLDEN)) & _MASK64), out=x)
+        _mix64(x, scratch)
+        np.right_shift(x, np.uint64(11), out=x)
+        np.multiply(x, 2.0 ** -53, out=draws[row])
+    return draws
+
+
+_USER_NUMBER = re.compile(r'(\d+)$')
+
+
+def user_key(user_id):
+    """Random stream key of a user: the number in its user_id (user_007 -> 7)"""
+    return int(_USER_NUMBER.search(user_id).group(1))
+
+
+def sun_intensity(hours):
+    """Solar intensity for each hour of day (peak at noon, zero outside 06:00-18:00)"""
+    hours = np.asarray(hours, dtype=float)
+    intensity = np.maximum(0, np.sin(np.pi * (hours - 6) / 12))
+    return np.where((hours >= 6) & (hours <= 18), intensity, 0.0)
+
+
+def battery_step(battery, battery_capacity, net_energy, grid_import, grid_export, scratch=None):
+    """
+    Apply one interval of battery dynamics to every user at once.
+
+    Surplus energy charges the battery and the rest is exported; a deficit
+    discharges the battery and the rest is imported from the grid.
+
+    battery is updated in place and the grid flows are written into
+    grid_import and grid_export, so the hot loop allocates nothing.
+    """
+    if scratch is None:
+        scratch = np.empty_like(battery)
+
+    # Surplus and deficit (at most one of them is non-zero)
+    np.maximum(net_energy, 0, out=grid_export)
+    np.subtract(grid_export, net_energy, out=grid_import)
+
+    # Charge with the surplus, export the rest
+    np.subtract(battery_capacity, battery, out=scratch)
+    np.minimum(grid_export, scratch, out=scratch)
+    grid_export -= scratch
+    battery += scratch
+
+    # Discharge for the deficit, import the rest
+    np.minimum(grid_import, battery, out=scratch)
+    grid_import -= scratch
+    battery -= scratch
+
+    # Ensure battery level is within bounds
+    np.clip(battery, 0, battery_capacity, out=battery)
+    return battery
+
+
+def allocate_measures(num_users, total_intervals, dtype=np.float32, names=MEASURES):
+    """Preallocate one flat column per measure (or only the given measures), laid out user by user"""
+    return {name: np.empty(num_users * total_intervals, dtype=dtype) for name in names}
+
+
+def iter_fleet(energy_block, battery_capacity, initial_battery, total_intervals,
+               block_intervals=96, decimals=None):
+    """
+    Simulate all users block by block, carrying the battery state forward.
+
+    Parameters:
+    - energy_block: callable (start, stop) -> (consumption, production), each an
+      array of shape (stop - start, num_users) for the given interval range
+    - battery_capacity: array of battery capacities, one per user
+    - initial_battery: array of starting battery levels, one per user
+    - total_intervals: Number of intervals to simulate (None to keep going until
+      the caller stops iterating)
+    - block_intervals: Number of intervals computed (and random numbers drawn) per block
+    - decimals: Round recorded values to this many decimals
+
+    Yields (start, stop, block) where block maps each name in MEASURES to an
+    array of shape (stop - start, num_users). The arrays are reused for the
+    next block, so copy them if they need to outlive it.
+    """
+    battery_capacity = np.asarray(battery_capacity, dtype=float)
+    battery = np.asarray(initial_battery, dtype=float).copy()
+    num_users = len(battery_capacity)
+
+    # Block buffers are reused so the hot loop does not keep faulting in fresh memory
+    buffers = np.empty((3, block_intervals, num_users))
+    scratch = np.empty(num_users)
+
+    if total_intervals is None:
+        starts = itertools.count(0, block_intervals)
+    else:
+        starts = range(0, total_intervals, block_intervals)
+
+    for start in starts:
+        stop = start + block_intervals if total_intervals is None else min(start + block_intervals, total_intervals)
+        consumption, production = energy_block(start, stop)
+        net_energy = production - consumption
+        battery_level, grid_import, grid_export = buffers[:, :stop - start]
+
+        # Only the battery recursion has to walk the block interval by interval
+        for i in range(stop - start):
+            battery_step(battery, battery_capacity, net_energy[i], grid_import[i], grid_export[i], scratch)
+            battery_level[i] = battery
+
+        block = dict(zip(MEASURES, (consumption, production, battery_level, grid_import, grid_export)))
+        if decimals is not None:
+            for values in block.values():
+                np.round(values, decimals, out=values)
+        yield start, stop, block
+
+
+class Timeline:
+    def __init__(self, start_date, days, interval_minutes, pattern_factors=None):
+        """
+        Calendar and solar values of a simulated timeline, shared by every user.
+
+        Parameters:
+        - start_date: First timestamp of the timeline
+        - days: Number of days (None for an open-ended timeline, whose values
+          are computed block by block instead of up front)
+        - interval_minutes: Minutes between timestamps
+        - pattern_factors: function (hours, is_weekend) -> consumption multipliers
+          of every consumption pattern, shape (patterns, intervals)
+
+        Slicing (timeline[start:stop]) gives the timestamps of those intervals.
+        """
+        self.start_date = pd.Timestamp(start_date)
+        self.freq = pd.Timedelta(minutes=interval_minutes)
+        self.pattern_factors = pattern_factors
+        self.total_intervals = None if days is None else int((days * 24 * 60) / interval_minutes)
+        self.timestamps = None
+        if self.total_intervals is not None:
+            self.timestamps = pd.date_range(self.start_date, periods=self.total_intervals, freq=self.freq)
+            self.hours, self.weekdays, self.is_weekend, self.sun, self.factors = self._calendar(self.timestamps)
+
+    def __len__(self):
+        if self.total_intervals is None:
+            raise TypeError("An open-ended timeline has no length")
+        return self.total_intervals
+
+    @property
+    def nbytes(self):
+        """Memory held by the timeline's arrays (0 for an open-ended timeline), so caches can cap it"""
+        if self.timestamps is None:
+            return 0
+        arrays = (self.timestamps, self.hours, self.weekdays, self.is_weekend, self.sun, self.factors)
+        return sum(int(array.nbytes) for array in arrays if array is not None)
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice) or key.step not in (None, 1):
+            raise TypeError("Timeline only supports [start:stop] slices")
+        if self.timestamps is not None:
+            return self.timestamps[key]
+        if key.stop is None:
+            raise TypeError("An open-ended timeline needs a stop")
+        start = key.start or 0
+        return pd.date_range(self.start_date + start * self.freq, periods=max(key.stop - start, 0), freq=self.freq)
+
+    def block(self, start, stop):
+        """(hours, is_weekend, sun, pattern factors) of intervals start:stop"""
+        if self.timestamps is None:
+            hours, _, is_weekend, sun, factors = self._calendar(self[start:stop])
+            return hours, is_weekend, sun, factors
+        return self.hours[start:stop], self.is_weekend[start:stop], self.sun[start:stop], self.factors[:, start:stop]
+
+    def _calendar(self, timestamps):
+        """Hour of day (0-23), day of week (0=Monday), weekend flag, sun intensity and pattern factors"""
+        hours = timestamps.hour.to_numpy()
+        weekdays = timestamps.weekday.to_numpy()
+        is_weekend = weekdays >= 5
+        factors = None if self.pattern_factors is None else self.pattern_factors(hours, is_weekend)
+        return hours, weekdays, is_weekend, sun_intensity(hours), factors
+
+
+# Timelines are the same for every run with the same parameters, so they are built once
+# (the byte cap keeps long, fine-grained timelines from piling up)
+_timelines = SimulationCache(max_entries=64, max_bytes=256 * 2**20, ttl_seconds=float('inf'))
+
+
+def shared_timeline(start_date, days, interval_minutes, pattern_factors=None):
+    """Timeline for the given parameters, reused across users and runs (see Timeline)"""
+    key = (pd.Timestamp(start_date), days, interval_minutes, pattern_factors)
+    return _timelines.get_or_compute(key, lambda: Timeline(start_date, days, interval_minutes, pattern_factors))
+
+
+class RunningTotals:
+    def __init__(self, total_intervals, names=MEASURES):
+        """
+        Fleet totals of the measures per interval, accumulated while the fleet is simulated.
+
+        Parameters:
+        - total_intervals: Number of simulated intervals
+        - names: Measures to total
+        """
+        self.sums = {name: np.zeros(total_intervals) for name in names}
+
+    def add(self, start, stop, block):
+        """Add the users of one block yielded by iter_fleet (groups of users can be added in turn)"""
+        for name, values in self.sums.items():
+            values[start:stop] += block[name].sum(axis=1)
+
+    def to_frame(self, timestamps):
+        """Totals as a DataFrame with one row per timestamp"""
+        return pd.DataFrame(self.sums, index=pd.Index(timestamps, name='timestamp'))
+
+
+class Rollups:
+    def __init__(self, timestamps, user_ids, names=MEASURES, levels=ROLLUP_LEVELS, per_user=True, dtype=np.float32):
+        """
+        Multi-resolution rollup pyramid of a run, accumulated while the fleet is simulated.
+
+        Every level keeps per-bucket sums of the measures, fleet-wide and
+        (with per_user) for every user. Buckets follow the calendar (weeks start
+        on Monday); levels finer than the simulation interval are skipped, and
+        per-user sums are only kept for levels coarser than the interval, where
+        they are smaller than the rows themselves.
+        Reading a level is a slice of its sums, so a zoomed-out query or plot
+        costs one value per bucket however many rows the run has.
+
+        Parameters:
+        - timestamps: DatetimeIndex of the simulated intervals
+        - user_ids: Users in the order of the blocks that will be added
+        - names: Measures to roll up
+        - levels: dict of level name -> bucket width, finest first
+        - per_user: Also keep the sums of every user (fleet-wide sums are always kept)
+        - dtype: dtype of the per-user sums (fleet-wide sums are float64); buckets
+          are summed in float64 before they are added
+        """
+        timestamps = pd.DatetimeIndex(timestamps)
+        step = timestamps[1] - timestamps[0] if len(timestamps) > 1 else pd.Timedelta(0)
+        self.user_ids = list(user_ids)
+        self.names = list(names)
+        self.widths = {}   # level -> bucket width
+        self.buckets = {}  # level -> DatetimeIndex of bucket starts
+        self.counts = {}   # level -> number of intervals in every bucket
+        self.fleet = {}    # level -> {measure: sums of shape (buckets,)}
+        self.users = {}    # level -> {measure: sums of shape (buckets, users)}
+        self._codes = {}   # level -> bucket of every interval
+        self._parents = {}  # level -> its bucket of every bucket of the previous level, if they nest
+
+        # Aligning buckets to a Monday makes weeks start on Monday (the epoch was a Thursday)
+        monday = pd.Timedelta(days=4)
+        previous = None
+        for level, width in levels.items():
+            if width < step:
+                continue
+            codes, starts = pd.factorize((timestamps - monday).floor(width) + monday)
+            if previous is not None and width % self.widths[previous] == pd.Timedelta(0):
+                # Buckets of a multiple of the previous width are unions of its buckets
+                self._parents[level] = np.zeros(len(self.buckets[previous]), dtype=np.int64)
+                self._parents[level][self._codes[previous]] = codes
+            previous = level
+            self.widths[level] = width
+            self.buckets[level] = pd.DatetimeIndex(starts, name='timestamp')
+            self.counts[level] = np.bincount(codes, minlength=len(starts))
+            self.fleet[level] = {name: np.zeros(len(starts)) for name in self.names}
+            if per_user and width > step:
+                self.users[level] = {name: np.zeros((len(starts), len(self.user_ids)), dtype=dtype)
+                                     for name in self.names}
+            self._codes[level] = codes
+
+    @property
+    def levels(self):
+        """Names of the levels kept, finest first"""
+        return list(self.widths)
+
+    @property
+    def nbytes(self):
+        """Memory held by the sums"""
+        return sum(values.nbytes for sums in [*self.fleet.values(), *self.users.values()] for values in sums.values())
+
+    def add(self, start, stop, block):
+        """Add intervals start:stop of one block yielded by iter_fleet (all users)"""
+        self._add(start, stop, block, axis=0)
+
+    def add_columns(self, columns):
+        """Add a whole run held as flat measure columns (as returned by simulate_fleet)"""
+        num_users = len(self.user_ids)
+        views = {name: columns[name].reshape(num_users, -1) for name in self.names}
+        self._add(0, views[self.names[0]].shape[1], views, axis=1)
+
+    def choose_level(self, resolution=None, max_points=None, start=None, end=None, per_user=False):
+        """
+        Coarsest level that satisfies a query.
+
+        With resolution (a level name or bucket width), the coarsest level no
+        wider than it, or None when only the raw rows are fine enough. With
+        max_points, the finest level that covers [start, end) in at most
+        max_points buckets (the coarsest level if none does). per_user only
+        considers levels with per-user sums.
+        """
+        levels = [level for level in self.levels if not per_user or level in self.users]
+        if resolution is not None:
+            width = pd.Timedelta(ROLLUP_LEVELS.get(resolution, resolution))
+            fine_enough = [level for level in levels if self.widths[level] <= width]
+            return fine_enough[-1] if fine_enough else None
+        if max_points is not None:
+            for level in levels:
+                window = self._window(level, start, end)
+                if window.stop - window.start <= max_points:
+                    return level
+        return levels[-1] if levels else None
+
+    def to_frame(self, level, user_id=None, start=None, end=None, how='sum'):
+        """
+        One level as a DataFrame indexed by bucket start, for the fleet or one user.
+
+        Buckets overlapping [start, end) are included. how='mean' divides by the
+        intervals in each bucket, which keeps the values in kWh per interval
+        like the raw rows (and the per-timestamp fleet totals).
+        """
+        rows = self._window(level, start, end)
+        if user_id is None:
+            sums = {name: values[rows] for name, values in self.fleet[level].items()}
+        else:
+            column = self.user_ids.index(user_id)
+            sums = {name: values[rows, column] for name, values in self.users[level].items()}
+        frame = pd.DataFrame(sums, index=self.buckets[level][rows])
+        if how == 'mean':
+            frame = frame.div(self.counts[level][rows], axis=0)
+        return frame
+
+    def save(self, path):
+        """Write the pyramid to a .npz file (see Rollups.load)"""
+        arrays = {'user_ids': np.array(self.user_ids, dtype=str), 'names': np.array(self.names, dtype=str),
+                  'levels': np.array(self.levels, dtype=str)}
+        for level in self.levels:
+            arrays[f"{level}/width"] = np.array(self.widths[level].value)
+            arrays[f"{level}/buckets"] = self.buckets[level].to_numpy()
+            arrays[f"{level}/counts"] = self.counts[level]
+            for name in self.names:
+                arrays[f"fleet/{level}/{name}"] = self.fleet[level][name]
+                if level in self.users:
+                    arrays[f"users/{level}/{name}"] = self.users[level][name]
+        with open(path, 'wb') as f:
+            np.savez(f, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        """Read a pyramid written by save (it can be read but not added to)"""
+        with np.load(path) as arrays:
+            rollups = cls(pd.DatetimeIndex([]), arrays['user_ids'].tolist(), arrays['names'].tolist(), levels={})
+            for level in arrays['levels'].tolist():
+                rollups.widths[level] = pd.Timedelta(int(arrays[f"{level}/width"]))
+                rollups.buckets[level] = pd.DatetimeIndex(arrays[f"{level}/buckets"], name='timestamp')
+                rollups.counts[level] = arrays[f"{level}/counts"]
+                rollups.fleet[level] = {name: arrays[f"fleet/{level}/{name}"] for name in rollups.names}
+                if f"users/{level}/{rollups.names[0]}" in arrays:
+                    rollups.users[level] = {name: arrays[f"users/{level}/{name}"] for name in rollups.names}
+        return rollups
+
+    def _add(self, start, stop, block, axis):
+        """Sum measures whose intervals start:stop run along axis into every level"""
+        rows, codes = block, None
+        for level in self.levels:
+            # Each level is summed from the previous level's sums where the buckets
+            # nest, so only the finest level reads every row
+            if level in self._parents:
+                codes = self._parents[level][codes]
+            else:
+                rows, codes = block, self._codes[level][start:stop]
+            first = np.flatnonzero(np.diff(codes, prepend=-1))
+            if len(first) < len(codes):
+                rows = {name: np.add.reduceat(rows[name], first, axis=axis, dtype=float) for name in self.names}
+            codes = codes[first]
+            for name in self.names:
+                sums = rows[name]
+                self.fleet[level][name][codes] += sums.sum(axis=1 - axis, dtype=float)
+                if level in self.users:
+                    self.users[level][name][codes] += sums if axis == 0 else sums.T
+
+    def _window(self, level, start=None, end=None):
+        """Slice of the buckets of a level that overlap [start, end)"""
+        buckets = self.buckets[level]
+        first = 0 if start is None else max(int(buckets.searchsorted(pd.Timestamp(start), side='right')) - 1, 0)
+        stop = len(buckets) if end is None else int(buckets.searchsorted(pd.Timestamp(end)))
+        return slice(first, max(first, stop))
+
+
+def simulate_fleet(energy_block, battery_capacity, initial_battery, total_intervals,
+                   block_intervals=96, out=None, decimals=None, first=0):
+    """
+    Simulate all users over the whole timeline in one pass.
+
+    Takes the same parameters as iter_fleet, plus:
+    - out: flat measure columns from allocate_measures to write into (float64 if
+      omitted); measures missing from out are simulated but not recorded
+    - first: First interval to record; earlier intervals are only simulated to
+      carry the battery state forward
+
+    Returns the dict of flat measure columns, each holding
+    num_users * (total_intervals - first) values laid out user by user.
+    """
+    num_users = len(battery_capacity)
+    recorded = total_intervals - first
+    if out is None:
+        out = allocate_measures(num_users, recorded, dtype=float)
+    views = {name: values.reshape(num_users, recorded) for name, values in out.items()}
+
+    blocks = iter_fleet(energy_block, battery_capacity, initial_battery, total_intervals,
+                        block_intervals=block_intervals, decimals=decimals)
+    for start, stop, block in blocks:
+        if stop <= first:
+            continue
+        skip = max(first - start, 0)
+        for name, view in views.items():
+            values = block[name][skip:]
+            # Transpose into the user-by-user layout a few thousand users at a time to stay in cache
+            for user in range(0, num_users, 4096):
+                view[user:user + 4096, start + skip - first:stop - first] = values[:, user:user + 4096].T
+
+    return out
+
+
+def simulate_sharded(simulate_shard, profiles, args, out, total_intervals, workers=1):
+    """
+    Simulate users in contiguous shards across a process pool.
+
+    simulate_shard(profiles, *args, out=None) must be a picklable module-level
+    function returning the shard's flat measure columns. Each shard's rows are
+    copied into out at the shard's offset; with one worker the shard is
+    simulated in-process straight into out.
+    """
+    if workers <= 1 or len(profiles) < 2:
+        return simulate_shard(profiles, *args, out=out)
+
+    bounds = np.linspace(0, len(profiles), min(workers, len(profiles)) + 1).astype(int)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [(start, stop, pool.submit(simulate_shard, profiles[start:stop], *args))
+                   for start, stop in zip(bounds[:-1], bounds[1:])]
+        for start, stop, future in futures:
+            rows = slice(start * total_intervals, stop * total_intervals)
+            for name, values in future.result().items():
+                out[name][rows] = values
+    return out
+
+
+def categorical_column(labels, repeats=1, tiles=1):
+    """
+    Categorical column built from one label per user.
+
+    Each label is repeated over that user's consecutive rows (repeats) and the
+    whole sequence tiled for time-ordered blocks (tiles). labels may already be
+    a pd.Categorical to avoid re-encoding the users for every block.
+    """
+    labels = labels if isinstance(labels, pd.Categorical) else pd.Categorical(labels)
+    codes = np.tile(np.repeat(labels.codes, repeats), tiles)
+    return pd.Categorical.from_codes(codes, categories=labels.categories)
+
+
+def build_frame(timestamps, labels, columns):
+    """
+    Assemble a fleet result into one DataFrame without copying the measure columns.
+
+    Parameters:
+    - timestamps: DatetimeIndex of the simulated intervals
+    - labels: dict of column name -> one label per user (e.g. user_id, user_type),
+      stored as categoricals
+    - columns: flat measure columns returned by simulate_fleet
+    """
+    num_users = len(next(iter(labels.values())))
+    frame = {'timestamp': np.tile(timestamps.to_numpy(), num_users)}
+    for name, values in labels.items():
+        frame[name] = categorical_column(values, repeats=len(timestamps))
+    frame.update(columns)
+    return pd.DataFrame(frame, copy=False)
+
+
+def build_block_frame(timestamps, labels, block, dtype=np.float64):
+    """
+    Assemble one block yielded by iter_fleet into a DataFrame ordered by time
+    (all users for the first interval, then the next interval, ...).
+
+    Takes the same labels as build_frame; timestamps are the block's intervals.
+    """
+    num_users = len(next(iter(labels.values())))
+    frame = {'timestamp': np.repeat(timestamps.to_numpy(), num_users)}
+    for name, values in labels.items():
+        frame[name] = categorical_column(values, tiles=len(timestamps))
+    for name in MEASURES:
+        frame[name] = block[name].astype(dtype).ravel()
+    return pd.DataFrame(frame, copy=False)
+
+
+def as_frame(result):
+    """DataFrame of a simulation result: the DataFrame itself or any result handle with to_frame()"""
+    if isinstance(result, pd.DataFrame):
+        return result
+    return result.to_frame()
+
+
+@contextmanager
+def peak_memory(enabled=True):
+    """
+    Track the peak memory traced while the block runs.
+
+    Yields a dict whose 'peak_bytes' entry is filled in on exit (None when disabled).
+    """
+    usage = {'peak_bytes': None}
+    if not enabled:
+        yield usage
+        return
+
+    already_tracing = tracemalloc.is_tracing()
+    if not already_tracing:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    baseline = tracemalloc.get_traced_memory()[0]
+    try:
+        yield usage
+    finally:
+        usage['peak_bytes'] = tracemalloc.get_traced_memory()[1] - baseline
+        if not already_tracing:
+            tracemalloc.stop()
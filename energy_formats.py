@@ -0,0 +1,122 @@
+import io
+
+import pandas as pd
+from flask import Response
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Arrow IPC and Parquet responses need pyarrow
+    pa = pq = None
+
+JSON_MIMETYPE = 'application/json'
+COLUMNS_MIMETYPE = 'application/vnd.energy.columns+json'
+NDJSON_MIMETYPE = 'application/x-ndjson'
+ARROW_MIMETYPE = 'application/vnd.apache.arrow.stream'
+PARQUET_MIMETYPE = 'application/vnd.apache.parquet'
+
+# Response formats by name, the current row-oriented JSON first so it stays the default
+FORMATS = {
+    'json': JSON_MIMETYPE,
+    'columns': COLUMNS_MIMETYPE,
+    'ndjson': NDJSON_MIMETYPE,
+    'arrow': ARROW_MIMETYPE,
+    'parquet': PARQUET_MIMETYPE
+}
+
+# Rows serialized per NDJSON write, which bounds the size of each response chunk
+NDJSON_BATCH_ROWS = 10000
+
+
+def available_formats():
+    """Names of the response formats this server can produce"""
+    if pa is None:
+        return [name for name in FORMATS if name not in ('arrow', 'parquet')]
+    return list(FORMATS)
+
+
+def negotiate_format(request):
+    """
+    Response format for a request: ?format=<name>, ?stream=1 (ndjson) or the Accept header.
+
+    Returns the format name ('json' when the Accept header matches nothing
+    else) or None if ?format= names a format that is not available.
+    """
+    formats = available_formats()
+    requested = request.args.get('format')
+    if requested:
+        return requested if requested in formats else None
+    if request.args.get('stream', '').lower() in ('1', 'true', 'ndjson'):
+        return 'ndjson'
+
+    best = request.accept_mimetypes.best_match([FORMATS[name] for name in formats], default=JSON_MIMETYPE)
+    return next(name for name in formats if FORMATS[name] == best)
+
+
+def frame_response(frame, fmt):
+    """
+    Flask response holding frame in a non-default format: 'ndjson', 'columns', 'arrow' or 'parquet'.
+
+    The compact formats ('columns', 'arrow', 'parquet') send timestamps as
+    epoch seconds and keep categorical columns dictionary-encoded.
+    """
+    if fmt == 'ndjson':
+        return Response(ndjson_lines([frame]), mimetype=NDJSON_MIMETYPE)
+
+    frame = frame.assign(timestamp=epoch_seconds(frame['timestamp']))
+
+    if fmt == 'columns':
+        return Response(columns_json(frame), mimetype=COLUMNS_MIMETYPE)
+
+    table = pa.Table.from_pandas(frame, preserve_index=False)
+    sink = pa.BufferOutputStream()
+    if fmt == 'arrow':
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return Response(sink.getvalue().to_pybytes(), mimetype=ARROW_MIMETYPE)
+    if fmt == 'parquet':
+        pq.write_table(table, sink, compression='zstd')
+        return Response(sink.getvalue().to_pybytes(), mimetype=PARQUET_MIMETYPE)
+
+    raise ValueError(f"Unknown response format: {fmt}")
+
+
+def epoch_seconds(timestamps):
+    """Datetime column as integer seconds since the Unix epoch"""
+    return timestamps.dt.as_unit('s').astype('int64')
+
+
+def columns_json(frame):
+    """
+    Column-oriented JSON: {"rows": n, "columns": {name: [values...]}}.
+
+    Categorical columns are sent as {"categories": [...], "codes": [...]}
+    instead of repeating every label.
+    """
+    out = io.StringIO()
+    out.write('{"rows":%d,"columns":{' % len(frame))
+    for i, name in enumerate(frame.columns):
+        column = frame[name]
+        out.write(',' if i else '')
+        out.write(pd.Series([name]).to_json(orient='values')[1:-1] + ':')
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            out.write('{"categories":' + pd.Series(column.cat.categories).to_json(orient='values'))
+            out.write(',"codes":' + pd.Series(column.cat.codes).to_json(orient='values') + '}')
+        else:
+            out.write(column.to_json(orient='values'))
+    out.write('}}')
+    return out.getvalue()
+
+
+def ndjson_lines(chunks, batch_rows=NDJSON_BATCH_ROWS):
+    """
+    Serialize DataFrame chunks to newline-delimited JSON, one batch of rows at a time.
+
+    Only the current batch is ever held as text, so memory stays constant no
+    matter how many chunks the simulation produces.
+    """
+    for chunk in chunks:
+        for first in range(0, len(chunk), batch_rows):
+            batch = chunk.iloc[first:first + batch_rows]
+            lines = batch.to_json(orient='records', lines=True, date_format='iso', date_unit='s')
+            yield lines if lines.endswith('\n') else lines + '\n'
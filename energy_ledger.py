@@ -0,0 +1,818 @@
+import hashlib
+import os
+import struct
+import time
+
+import numpy as np
+import pandas as pd
+
+from energy_cache import SimulationCache
+
+# One trade as hashed and stored: a leaf tag byte, then the fields of a trades table row
+ID_BYTES = 32
+TRADE_DTYPE = np.dtype([
+    ('tag', 'u1'),
+    ('timestamp', '<i8'),  # ns since the epoch, 0 if the trade had no timestamp
+    ('seller_id', f'S{ID_BYTES}'),
+    ('buyer_id', f'S{ID_BYTES}'),
+    ('quantity_kwh', '<f8'),
+    ('price', '<f8')
+])
+# Block header: magic, block index, sequence number of its first trade, trade count, sealing time,
+# hash of the previous block and Merkle root of its trades
+BLOCK_HEADER = struct.Struct('<4sQQId32s32s')
+BLOCK_MAGIC = b'TLB1'
+GENESIS_HASH = bytes(32)
+
+# Leaves and inner nodes are hashed with different prefixes (as in RFC 6962),
+# so a pair of child hashes can never pass for a trade
+LEAF_TAG = 0
+NODE_TAG = 1
+
+# Ledger directories: blocks go to segment files that roll over at SEGMENT_BYTES, and blocks.idx
+# holds one fixed-width entry per block height saying where the block is
+SEGMENT_BYTES = 64 * 2**20
+BLOCK_ENTRY_DTYPE = np.dtype([('segment', '<u4'), ('count', '<u4'), ('offset', '<u8'), ('first_trade', '<u8')])
+# User index entries kept in memory before they are written to a run file
+USER_RUN_ENTRIES = 2**16
+
+
+def encode_trades(trades):
+    """
+    Trades as an array of fixed-width records (TRADE_DTYPE), ready to hash and store.
+
+    Parameters:
+    - trades: Trades table (DataFrame or dict of columns) with seller_id,
+      buyer_id, quantity_kwh, price and optionally timestamp, like OrderBook.clear() returns
+    """
+    count = len(trades['quantity_kwh'])
+    records = np.zeros(count, dtype=TRADE_DTYPE)
+    records['tag'] = LEAF_TAG
+    if 'timestamp' in trades:
+        timestamps = pd.DatetimeIndex(np.asarray(trades['timestamp']))
+        records['timestamp'] = timestamps.as_unit('ns').asi8
+    for name in ('seller_id', 'buyer_id'):
+        ids = np.asarray(trades[name], dtype=object)
+        try:
+            ids = ids.astype('S')  # ASCII ids (user_007) convert in one pass
+        except UnicodeEncodeError:
+            ids = np.char.encode(ids.astype(str), 'utf-8')
+        if ids.dtype.itemsize > ID_BYTES:
+            raise ValueError(f"{name} values must be at most {ID_BYTES} bytes")
+        records[name] = ids
+    records['quantity_kwh'] = trades['quantity_kwh']
+    records['price'] = trades['price']
+    return records
+
+
+def decode_trades(records):
+    """Trades table of stored records (the inverse of encode_trades)"""
+    return pd.DataFrame({
+        'timestamp': pd.to_datetime(records['timestamp'], unit='ns'),
+        'seller_id': np.char.decode(records['seller_id'], 'utf-8'),
+        'buyer_id': np.char.decode(records['buyer_id'], 'utf-8'),
+        'quantity_kwh': records['quantity_kwh'],
+        'price': records['price']
+    })
+
+
+def _sha256_rows(rows):
+    """SHA-256 of every row of a 2-D uint8 array, as an (n, 32) uint8 array"""
+    data = memoryview(np.ascontiguousarray(rows)).cast('B')
+    width = rows.shape[1]
+    sha256 = hashlib.sha256
+    digests = b''.join([sha256(data[i:i + width]).digest() for i in range(0, len(data), width)])
+    return np.frombuffer(digests, dtype=np.uint8).reshape(-1, 32)
+
+
+def leaf_hashes(records):
+    """Merkle leaves of encoded trades, as an (n, 32) uint8 array"""
+    return _sha256_rows(records.view(np.uint8).reshape(len(records), TRADE_DTYPE.itemsize))
+
+
+def merkle_levels(leaves):
+    """
+    Every level of the Merkle tree over leaves, from the leaves up to the root.
+
+    A level with an odd number of nodes pairs its last node with itself. Each
+    level is hashed in one pass over a buffer of (tag, left, right) rows.
+    """
+    levels = [leaves]
+    while len(levels[-1]) > 1:
+        level = levels[-1]
+        if len(level) % 2:
+            level = np.concatenate([level, level[-1:]])
+        pairs = np.empty((len(level) // 2, 65), dtype=np.uint8)
+        pairs[:, 0] = NODE_TAG
+        pairs[:, 1:] = level.reshape(-1, 64)
+        levels.append(_sha256_rows(pairs))
+    return levels
+
+
+def merkle_root(leaves):
+    """Merkle root of leaves (the hash of nothing for no leaves)"""
+    if len(leaves) == 0:
+        return hashlib.sha256(b'').digest()
+    return merkle_levels(leaves)[-1][0].tobytes()
+
+
+def inclusion_proof(levels, leaf):
+    """
+    Sibling hashes on the path from a leaf to the root of a Merkle tree (see merkle_levels).
+
+    The last node of an odd level is its own sibling, matching how the tree pairs it.
+    """
+    siblings = []
+    for level in levels[:-1]:
+        siblings.append(level[min(leaf ^ 1, len(level) - 1)].tobytes())
+        leaf //= 2
+    return siblings
+
+
+def root_from_proof(leaf_hash, leaf, siblings):
+    """Merkle root implied by a leaf hash, its position and its sibling hashes: O(log n) hashes"""
+    node = leaf_hash
+    for sibling in siblings:
+        pair = node + sibling if leaf % 2 == 0 else sibling + node
+        node = hashlib.sha256(bytes([NODE_TAG]) + pair).digest()
+        leaf //= 2
+    return node
+
+
+def verify_proof(proof, block_hash=None):
+    """
+    Check a trade's inclusion proof (see Block.proof) without the rest of the chain.
+
+    The trade is re-encoded and hashed, folded with the siblings up to a root,
+    and that root must be the one in the block header, whose hash must be the
+    proof's block hash. Pass a block_hash obtained independently (e.g. from the
+    ledger head or a published list of block hashes) to also tie the header to
+    a trusted chain; otherwise the proof is only checked to be consistent.
+    Returns True or False.
+    """
+    header = bytes.fromhex(proof['header'])
+    if len(header) != BLOCK_HEADER.size:
+        return False
+    magic, index, _, count, _, _, root = BLOCK_HEADER.unpack(header)
+    if magic != BLOCK_MAGIC or index != proof['block'] or not 0 <= proof['leaf'] < count:
+        return False
+    header_hash = hashlib.sha256(header).digest()
+    if header_hash.hex() != proof['block_hash'] or (block_hash is not None and header_hash != block_hash):
+        return False
+    if len(proof['siblings']) != max(count - 1, 0).bit_length():
+        return False
+
+    trade = {name: [value] for name, value in proof['trade'].items()}
+    leaf_hash = leaf_hashes(encode_trades(trade))[0].tobytes()
+    siblings = [bytes.fromhex(sibling) for sibling in proof['siblings']]
+    return root_from_proof(leaf_hash, proof['leaf'], siblings) == root
+
+
+class Block:
+    def __init__(self, index, first_trade, sealed_at, prev_hash, records, root=None):
+        """
+        A sealed batch of trades, linked to the previous block by its hash.
+
+        Parameters:
+        - index: Position of the block in the chain
+        - first_trade: Sequence number of its first trade in the ledger
+        - sealed_at: Time the block was sealed (epoch seconds)
+        - prev_hash: Hash of the previous block (GENESIS_HASH for the first)
+        - records: Encoded trades of the block (TRADE_DTYPE)
+        - root: Merkle root over the trades (computed if None)
+        """
+        self.index = index
+        self.first_trade = first_trade
+        self.sealed_at = sealed_at
+        self.prev_hash = prev_hash
+        self.records = records
+        self.merkle_root = root if root is not None else merkle_root(leaf_hashes(records))
+        self.header = BLOCK_HEADER.pack(BLOCK_MAGIC, index, first_trade, len(records), sealed_at,
+                                        prev_hash, self.merkle_root)
+        self.hash = hashlib.sha256(self.header).digest()
+        self._levels = None
+
+    def __len__(self):
+        return len(self.records)
+
+    @property
+    def levels(self):
+        """Merkle tree levels of the block's trades, built on the first proof and kept for the next ones"""
+        if self._levels is None:
+            self._levels = merkle_levels(leaf_hashes(self.records))
+        return self._levels
+
+    def trades(self):
+        """Trades of the block as a trades table"""
+        return decode_trades(self.records)
+
+    def proof(self, leaf):
+        """
+        Inclusion proof of the trade at position leaf, as a JSON-ready dict.
+
+        Holds the trade, the block header and hash, and the sibling hashes from
+        the trade's leaf up to the Merkle root; verify_proof() checks it with
+        O(log n) hashes and nothing else from the ledger.
+        """
+        if not 0 <= leaf < len(self):
+            raise IndexError(f"Block {self.index} has no trade {leaf}")
+        trade = self.records[leaf]
+        return {
+            "block": self.index,
+            "block_hash": self.hash.hex(),
+            "header": self.header.hex(),
+            "leaf": int(leaf),
+            "trade": {
+                "timestamp": pd.Timestamp(int(trade["timestamp"]), unit='ns').isoformat(),
+                "seller_id": trade["seller_id"].decode('utf-8'),
+                "buyer_id": trade["buyer_id"].decode('utf-8'),
+                "quantity_kwh": float(trade["quantity_kwh"]),
+                "price": float(trade["price"])
+            },
+            "siblings": [sibling.hex() for sibling in inclusion_proof(self.levels, leaf)]
+        }
+
+    def to_bytes(self):
+        """Header, block hash and records, as the block is appended to a ledger file"""
+        return self.header + self.hash + self.records.tobytes()
+
+
+class TradeLedger:
+    def __init__(self, path=None, block_size=1024, block_interval=None, segment_bytes=SEGMENT_BYTES):
+        """
+        Append-only ledger of P2P trades, batched into hash-chained blocks.
+
+        Trades are buffered until block_size of them are pending (or the oldest
+        pending trade has waited block_interval seconds) and then sealed into a
+        block: a Merkle root over the trades and a header linking to the
+        previous block's hash. Trades are encoded and hashed a whole batch at a
+        time, and blocks are appended to the ledger directory as they are sealed
+        (see LedgerStore), with the user index kept next to them.
+
+        Parameters:
+        - path: Ledger directory blocks are appended to (None keeps the ledger in memory);
+          an existing ledger is opened and extended
+        - block_size: Trades per block
+        - block_interval: Seconds after which pending trades are sealed into a
+          block even if it is not full (None: only full blocks, and flush())
+        - segment_bytes: Size at which the ledger's segment files roll over
+        """
+        if block_size < 1:
+            raise ValueError("block_size must be at least 1")
+        self.path = path
+        self.block_size = block_size
+        self.block_interval = block_interval
+        self.blocks = []
+        self._user_index = None
+        self._pending = np.zeros(0, dtype=TRADE_DTYPE)  # Encoded trades not sealed yet
+        self._pending_since = None
+        if path is not None:
+            # Opening maps the block and user indexes instead of reading the blocks
+            self.blocks = LedgerStore(path, segment_bytes)
+            self._user_index = UserIndex(self.blocks, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        The sealed blocks of a ledger directory, read-only (e.g. while another process appends to it).
+
+        Blocks the writer seals later are picked up as they are looked up: the
+        chain length, head, proofs and user index follow the directory.
+        """
+        ledger = cls()
+        ledger.path = path
+        ledger.blocks = LedgerStore(path, mode='r')
+        return ledger
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        """Number of trades in the ledger, sealed or pending"""
+        return self.sealed_trades + len(self._pending)
+
+    @property
+    def sealed_trades(self):
+        return self.blocks[-1].first_trade + len(self.blocks[-1]) if self.blocks else 0
+
+    @property
+    def head(self):
+        """Hash of the last block (GENESIS_HASH for an empty chain)"""
+        return self.blocks[-1].hash if self.blocks else GENESIS_HASH
+
+    def append(self, trades):
+        """
+        Add a trades table (see OrderBook.clear) and seal every block that is due.
+
+        Returns the blocks sealed by this call.
+        """
+        records = encode_trades(trades)
+        if len(records):
+            if len(self._pending) == 0:
+                self._pending_since = time.monotonic()
+            self._pending = np.concatenate([self._pending, records])
+
+        sealed = []
+        while len(self._pending) >= self.block_size:
+            sealed.append(self._seal(self.block_size))
+        if self._interval_elapsed():
+            sealed.append(self._seal(len(self._pending)))
+        return sealed
+
+    def poll(self):
+        """Seal the pending trades if block_interval has passed; the sealed block or None"""
+        return self._seal(len(self._pending)) if self._interval_elapsed() else None
+
+    def flush(self):
+        """Seal all pending trades into a (possibly partial) block; the block or None"""
+        return self._seal(len(self._pending)) if len(self._pending) else None
+
+    def close(self):
+        """Seal the pending trades, store the user index and close the ledger directory"""
+        self.flush()
+        if isinstance(self.blocks, LedgerStore):
+            self.user_index.save()
+            self.blocks.close()
+
+    def trades(self):
+        """All sealed trades as one trades table"""
+        if not self.blocks:
+            return decode_trades(np.zeros(0, dtype=TRADE_DTYPE))
+        return decode_trades(np.concatenate([block.records for block in self.blocks]))
+
+    @property
+    def user_index(self):
+        """UserIndex of the sealed trades, built on first use and kept up to date as blocks are sealed"""
+        if self._user_index is None:
+            self._user_index = UserIndex(self.blocks, self.path, mode='r' if self.path is not None else 'a')
+        return self._user_index
+
+    def prove(self, block, leaf):
+        """Inclusion proof of trade leaf of block block (see Block.proof)"""
+        return self.blocks[block].proof(leaf)
+
+    def user_proofs(self, user_id, limit=None):
+        """
+        Inclusion proofs of a user's sealed trades (as seller or buyer), oldest first.
+
+        Parameters:
+        - user_id: Id of the user
+        - limit: Only the most recent limit trades (all if None)
+        """
+        blocks, leaves = self.user_index.positions(user_id)
+        if limit is not None:
+            keep = slice(max(len(blocks) - limit, 0), None)
+            blocks, leaves = blocks[keep], leaves[keep]
+        return [self.blocks[block].proof(leaf) for block, leaf in zip(blocks.tolist(), leaves.tolist())]
+
+    def verify(self):
+        """
+        Check the whole chain: every Merkle root against its trades and every
+        block against the hash of the one before. Raises ValueError naming the
+        first block that does not match; returns the number of blocks checked.
+        """
+        return verify_blocks(self.blocks)
+
+    def _interval_elapsed(self):
+        return (self.block_interval is not None and len(self._pending) > 0
+                and time.monotonic() - self._pending_since >= self.block_interval)
+
+    def _seal(self, count):
+        """Seal the first count pending trades into the next block"""
+        # Sealing slices the pending trades, so a large batch is split into blocks without copying the rest
+        records, self._pending = self._pending[:count], self._pending[count:]
+        self._pending_since = time.monotonic() if len(self._pending) else None
+
+        block = Block(len(self.blocks), self.sealed_trades, time.time(), self.head, records.copy())
+        self.blocks.append(block)
+        if self._user_index is not None:
+            self._user_index.add(block)
+        return block
+
+
+class LedgerStore:
+    def __init__(self, path, segment_bytes=SEGMENT_BYTES, mode='a'):
+        """
+        Sealed blocks of a ledger directory, as a sequence indexed by block height.
+
+        Layout of the path directory:
+        - segment-NNNNNN.ledger: blocks appended one after the other (header,
+          block hash, trades), as read_blocks() reads them; a new segment is
+          started when the next block would take the current one past
+          segment_bytes, so no block spans two segments
+        - blocks.idx: one BLOCK_ENTRY_DTYPE entry per block height (segment,
+          trade count, byte offset, first trade)
+        - users-FIRST-LAST.npy: runs of the user index (see UserIndex)
+
+        The index and the segments are memory-mapped, so opening takes the
+        same few milliseconds for any number of blocks, and fetching a block is
+        one index lookup and a zero-copy view of its segment. A block is
+        written to its segment before its index entry, so after a crash the
+        blocks without an entry are cut off when the directory is reopened.
+
+        Parameters:
+        - path: Ledger directory (created if missing in append mode)
+        - segment_bytes: Size at which segments roll over
+        - mode: 'a' to append blocks, 'r' to read them (e.g. while another
+          process appends to the directory; its new blocks show up as the
+          length of blocks.idx grows)
+        """
+        if mode not in ('a', 'r'):
+            raise ValueError(f"Unknown mode: {mode} (expected 'a' or 'r')")
+        self.path = path
+        self.segment_bytes = segment_bytes
+        self.mode = mode
+        self._index_path = os.path.join(path, 'blocks.idx')
+        self._segments = {}  # segment number -> memory map, remapped when a read goes past its end
+        self._cache = SimulationCache(max_entries=64, ttl_seconds=float('inf'))
+        self._last = None
+        self._index_file = None
+        self._segment_file = None
+        if mode == 'a':
+            os.makedirs(path, exist_ok=True)
+            self._recover()
+            self._map_entries()
+            self._index_file = open(self._index_path, 'ab')
+            self._segment_file = open(self._segment_path(self._segment), 'ab')
+        else:
+            self._map_entries()
+            self._count = len(self._entries)
+
+    def __len__(self):
+        self._refresh()
+        return self._count
+
+    def __getitem__(self, height):
+        """Block at a height (negative heights count from the head)"""
+        if height < 0:
+            height += len(self)
+        elif height >= self._count:
+            self._refresh()
+        if not 0 <= height < self._count:
+            raise IndexError(f"No block at height {height} (the ledger has {self._count})")
+        if height == self._count - 1:
+            if self._last is None:
+                self._last = self._read(height)
+            return self._last
+        return self._cache.get_or_compute(height, lambda: self._read(height))
+
+    def __iter__(self):
+        # Sequential scans (verify, trades) go around the cache, so they do not flush the recently used blocks out
+        for height in range(len(self)):
+            yield self._read(height)
+
+    def append(self, block):
+        """Write the next block to the current segment (or a new one) and index it"""
+        if self.mode != 'a':
+            raise ValueError(f"Ledger directory {self.path} is open read-only")
+        if block.index != self._count:
+            raise ValueError(f"Block {block.index} does not follow height {self._count - 1}")
+        data = block.to_bytes()
+        if self._end and self._end + len(data) > self.segment_bytes:
+            self._segment_file.close()
+            self._segment += 1
+            self._end = 0
+            self._segment_file = open(self._segment_path(self._segment), 'ab')
+        self._segment_file.write(data)
+        self._segment_file.flush()
+
+        entry = np.array([(self._segment, len(block), self._end, block.first_trade)], dtype=BLOCK_ENTRY_DTYPE)
+        self._index_file.write(entry.tobytes())
+        self._index_file.flush()
+        self._end += len(data)
+        self._count += 1
+        self._last = block
+
+    def records_at(self, heights, leaves):
+        """Trades (TRADE_DTYPE) at (block height, leaf) positions, gathered from the segments without reading blocks"""
+        heights, leaves = np.asarray(heights, dtype=np.int64), np.asarray(leaves, dtype=np.int64)
+        records = np.zeros(len(heights), dtype=TRADE_DTYPE)
+        if len(heights) == 0:
+            return records
+        if heights.max() >= len(self._entries):
+            self._map_entries()
+        entries = self._entries[heights]
+        starts = entries['offset'].astype(np.int64) + BLOCK_HEADER.size + 32 + leaves * TRADE_DTYPE.itemsize
+        rows = records.view(np.uint8).reshape(len(records), TRADE_DTYPE.itemsize)
+        for segment in np.unique(entries['segment']).tolist():
+            found = np.flatnonzero(entries['segment'] == segment)
+            data = self._segment_map(segment, int(starts[found].max()) + TRADE_DTYPE.itemsize)
+            rows[found] = data[starts[found, None] + np.arange(TRADE_DTYPE.itemsize)]
+        return records
+
+    def close(self):
+        """Close the files blocks are appended to"""
+        for f in (self._segment_file, self._index_file):
+            if f is not None:
+                f.close()
+        self._segment_file = self._index_file = None
+
+    def _refresh(self):
+        """Take in the blocks another process appended since the index was last checked (read mode)"""
+        if self.mode != 'r':
+            return
+        # A directory the writer has not created yet reads as an empty ledger
+        size = os.path.getsize(self._index_path) if os.path.exists(self._index_path) else 0
+        count = size // BLOCK_ENTRY_DTYPE.itemsize
+        if count > self._count:
+            # The head moved; the index itself is remapped when a new block is read
+            self._count = count
+            self._last = None
+
+    def _segment_path(self, segment):
+        return os.path.join(self.path, f"segment-{segment:06d}.ledger")
+
+    def _recover(self):
+        """Cut off what a crash left half-written: a partial index entry, and blocks or bytes without an entry"""
+        self._map_entries()
+        count, entries = len(self._entries), self._entries
+        # Writes are flushed, not synced: after a power loss an entry can outlive the end of its block
+        while count:
+            segment, end = _block_end(entries[count - 1])
+            path = self._segment_path(segment)
+            if os.path.exists(path) and os.path.getsize(path) >= end:
+                break
+            count -= 1
+        self._segment, self._end = _block_end(entries[count - 1]) if count else (0, 0)
+        del entries
+        self._entries = None  # Unmapped before the index is truncated
+        with open(self._index_path, 'ab') as f:
+            f.truncate(count * BLOCK_ENTRY_DTYPE.itemsize)
+        if os.path.exists(self._segment_path(self._segment)):
+            os.truncate(self._segment_path(self._segment), self._end)
+        later = self._segment + 1
+        while os.path.exists(self._segment_path(later)):
+            os.remove(self._segment_path(later))
+            later += 1
+        self._count = count
+
+    def _map_entries(self):
+        size = os.path.getsize(self._index_path) if os.path.exists(self._index_path) else 0
+        count = size // BLOCK_ENTRY_DTYPE.itemsize
+        if count:
+            self._entries = np.memmap(self._index_path, dtype=BLOCK_ENTRY_DTYPE, mode='r', shape=(count,))
+        else:
+            self._entries = np.zeros(0, dtype=BLOCK_ENTRY_DTYPE)
+
+    def _segment_map(self, segment, end):
+        """Memory map of a segment that reaches at least to byte end"""
+        data = self._segments.get(segment)
+        if data is None or len(data) < end:
+            data = self._segments[segment] = np.memmap(self._segment_path(segment), dtype=np.uint8, mode='r')
+        return data
+
+    def _read(self, height):
+        """Block at a height, read from its segment"""
+        if height >= len(self._entries):
+            self._map_entries()  # Blocks appended since the index was mapped
+        entry = self._entries[height]
+        segment, end = _block_end(entry)
+        data = self._segment_map(segment, end)
+        start = int(entry['offset'])
+        magic, index, first_trade, count, sealed_at, prev_hash, root = BLOCK_HEADER.unpack_from(data, start)
+        if magic != BLOCK_MAGIC or index != height:
+            raise ValueError(f"Index entry of block {height} does not point to a block header "
+                             f"in {self._segment_path(segment)}")
+        body = start + BLOCK_HEADER.size + 32
+        records = np.frombuffer(data, dtype=TRADE_DTYPE, count=count, offset=body)
+        block = Block(index, first_trade, sealed_at, prev_hash, records, root)
+        if block.hash != data[body - 32:body].tobytes():
+            raise ValueError(f"Header of block {height} does not match its stored hash")
+        return block
+
+
+class UserIndex:
+    def __init__(self, blocks, directory=None, mode='a', flush_entries=USER_RUN_ENTRIES):
+        """
+        Positions of every user's trades in the ledger: user_id -> (block, leaf) pairs.
+
+        Every sealed block adds a run of (user id hash, block, leaf) entries
+        sorted by hash, and runs of similar size are merged, like a
+        log-structured merge tree: adding a block costs a sort of that block's
+        entries (amortized O(log n) merges per entry), and a lookup is one
+        binary search per run, of which there are O(log n). Hash collisions are
+        resolved against the trades themselves.
+
+        With a directory, the runs are also kept on disk: once flush_entries
+        entries are in memory (and on save()) they are merged into a
+        users-FIRST-LAST.npy file for blocks FIRST to LAST, and the files are
+        merged by the same rule. Files are memory-mapped when the index is
+        opened, and only the blocks after the last file are indexed again.
+
+        Parameters:
+        - blocks: The ledger's blocks (a list or LedgerStore, read when a lookup checks candidates)
+        - directory: Ledger directory the runs are stored in (None keeps them in memory)
+        - mode: 'a' to write run files, 'r' to only read them
+        - flush_entries: Entries kept in memory before they are written to a run file
+        """
+        self.blocks = blocks
+        self.directory = directory
+        self.mode = mode
+        self.flush_entries = flush_entries
+        self._runs = []  # (sorted id hashes, block indexes, leaf positions), oldest and largest first
+        self._files = []  # (first block, last block, memory-mapped run) stored runs, oldest and largest first
+        self._indexed = 0
+        if directory is not None:
+            self._open_files()
+        # The blocks sealed after the last run file (or all of them in memory) are indexed as one run
+        self._add_run([blocks[height] for height in range(self._indexed, len(blocks))])
+
+    def __len__(self):
+        """Number of indexed (user, trade) entries"""
+        return sum(len(run[0]) for run in self._runs) + sum(run.shape[1] for _, _, run in self._files)
+
+    def __contains__(self, user_id):
+        return len(self.positions(user_id)[0]) > 0
+
+    def add(self, block):
+        """Index the trades of a block (as seller and as buyer)"""
+        self._add_run([block])
+
+    def save(self):
+        """Write the entries held in memory to a run file (merging run files of similar size)"""
+        if self.directory is None or self.mode != 'a' or not self._runs:
+            return
+        run = self._runs[0]
+        for newer in self._runs[1:]:
+            run = _merge_runs(run, newer)
+        first = self._files[-1][1] + 1 if self._files else 0
+        self._files.append((first, self._indexed - 1, self._write_file(first, self._indexed - 1, run)))
+        self._runs = []
+        while len(self._files) > 1 and self._files[-2][2].shape[1] <= 2 * self._files[-1][2].shape[1]:
+            newer = self._files.pop()
+            older = self._files.pop()
+            merged = _merge_runs(_file_run(older[2]), _file_run(newer[2]))
+            self._files.append((older[0], newer[1], self._write_file(older[0], newer[1], merged)))
+            for first, last, _ in (older, newer):
+                os.remove(self._file_path(first, last))
+
+    def positions(self, user_id):
+        """(block indexes, leaf positions) of a user's trades in ledger order (empty arrays for unknown users)"""
+        # Blocks another process sealed since the index was opened (read mode) are indexed first
+        self._add_run([self.blocks[height] for height in range(self._indexed, len(self.blocks))])
+        key = user_id.encode('utf-8')
+        target = _id_hashes(np.array([key], dtype=f'S{ID_BYTES}'))[0]
+        blocks, leaves = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)]
+        for hashes, run_blocks, run_leaves in [_file_run(run) for _, _, run in self._files] + self._runs:
+            lo, hi = np.searchsorted(hashes, target, side='left'), np.searchsorted(hashes, target, side='right')
+            blocks.append(run_blocks[lo:hi])
+            leaves.append(run_leaves[lo:hi])
+        blocks, leaves = np.concatenate(blocks), np.concatenate(leaves)
+
+        # Keep the trades the user really is part of (hashes can collide), once each, in ledger order
+        trades = _records_at(self.blocks, blocks, leaves)
+        keep = (trades['seller_id'] == key) | (trades['buyer_id'] == key)
+        positions = np.unique(blocks[keep] * 2**32 + leaves[keep])
+        return positions >> 32, positions & (2**32 - 1)
+
+    def _add_run(self, blocks):
+        """Index the trades of consecutive blocks as one new run"""
+        if not blocks:
+            return
+        records = np.concatenate([block.records for block in blocks])
+        heights = np.repeat([block.index for block in blocks], [len(block) for block in blocks])
+        leaves = np.concatenate([np.arange(len(block), dtype=np.int64) for block in blocks])
+        hashes = _id_hashes(np.concatenate([records['seller_id'], records['buyer_id']]))
+        order = np.argsort(hashes, kind='stable')
+        self._runs.append((hashes[order], np.tile(heights.astype(np.int64), 2)[order], np.tile(leaves, 2)[order]))
+        self._indexed = blocks[-1].index + 1
+        while len(self._runs) > 1 and len(self._runs[-2][0]) <= 2 * len(self._runs[-1][0]):
+            newer = self._runs.pop()
+            older = self._runs.pop()
+            self._runs.append(_merge_runs(older, newer))
+        if self.directory is not None and sum(len(run[0]) for run in self._runs) >= self.flush_entries:
+            self.save()
+
+    def _file_path(self, first, last):
+        return os.path.join(self.directory, f"users-{first:012d}-{last:012d}.npy")
+
+    def _write_file(self, first, last, run):
+        """Store a run as a (3, n) int64 array (hashes, blocks, leaves) and map it back"""
+        path = self._file_path(first, last)
+        with open(path + '.tmp', 'wb') as f:
+            np.save(f, np.stack([run[0].view(np.int64), run[1], run[2]]))
+        os.replace(path + '.tmp', path)
+        return np.load(path, mmap_mode='r')
+
+    def _open_files(self):
+        """
+        Map the run files that cover the ledger from block 0 without gaps.
+
+        A crash during a merge leaves the merged file next to the ones it
+        replaces; the widest file starting at each block is used and, when
+        appending, the others are removed.
+        """
+        ranges = {}
+        for name in os.listdir(self.directory) if os.path.isdir(self.directory) else []:
+            if name.startswith('users-') and name.endswith('.npy'):
+                first, last = (int(part) for part in name[len('users-'):-len('.npy')].split('-'))
+                if last < len(self.blocks):
+                    ranges[first] = max(ranges.get(first, last), last)
+            elif name.startswith('users-') and name.endswith('.tmp') and self.mode == 'a':
+                os.remove(os.path.join(self.directory, name))
+
+        while self._indexed in ranges:
+            first, last = self._indexed, ranges[self._indexed]
+            self._files.append((first, last, np.load(self._file_path(first, last), mmap_mode='r')))
+            self._indexed = last + 1
+
+        if self.mode == 'a':
+            used = {self._file_path(first, last) for first, last, _ in self._files}
+            for name in os.listdir(self.directory) if os.path.isdir(self.directory) else []:
+                path = os.path.join(self.directory, name)
+                if name.startswith('users-') and name.endswith('.npy') and path not in used:
+                    os.remove(path)
+
+
+def _merge_runs(older, newer):
+    """One run from two (hashes, blocks, leaves) runs, sorted by hash with the older entries first on ties"""
+    merged = [np.concatenate([a, b]) for a, b in zip(older, newer)]
+    order = np.argsort(merged[0], kind='stable')
+    return tuple(column[order] for column in merged)
+
+
+def _file_run(run):
+    """(hashes, blocks, leaves) views of a stored run"""
+    return run[0].view(np.uint64), run[1], run[2]
+
+
+def _records_at(blocks, heights, leaves):
+    """Trades at (block height, leaf) positions of a list of blocks or a LedgerStore"""
+    if isinstance(blocks, LedgerStore):
+        return blocks.records_at(heights, leaves)
+    return np.array([blocks[block].records[leaf] for block, leaf in zip(heights.tolist(), leaves.tolist())],
+                    dtype=TRADE_DTYPE)
+
+
+def _block_end(entry):
+    """(segment, end offset) of the block a BLOCK_ENTRY_DTYPE entry points to"""
+    size = BLOCK_HEADER.size + 32 + int(entry['count']) * TRADE_DTYPE.itemsize
+    return int(entry['segment']), int(entry['offset']) + size
+
+
+def _id_hashes(ids):
+    """64-bit hashes of fixed-width ids, mixed from their 8-byte words"""
+    words = np.ascontiguousarray(ids, dtype=f'S{ID_BYTES}').view('<u8').reshape(len(ids), ID_BYTES // 8)
+    hashes = np.zeros(len(ids), dtype=np.uint64)
+    for column in range(words.shape[1]):
+        hashes ^= words[:, column]
+        hashes *= np.uint64(0x9E3779B97F4A7C15)
+        hashes ^= hashes >> np.uint64(29)
+    return hashes
+
+
+def read_blocks(path):
+    """Blocks of a ledger segment file, in chain order (a partially written last block is ignored)"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    blocks = []
+    offset = 0
+    while offset + BLOCK_HEADER.size + 32 <= len(data):
+        magic, index, first_trade, count, sealed_at, prev_hash, root = BLOCK_HEADER.unpack_from(data, offset)
+        if magic != BLOCK_MAGIC:
+            raise ValueError(f"Not a ledger block at byte {offset} of {path}")
+        start = offset + BLOCK_HEADER.size + 32
+        end = start + count * TRADE_DTYPE.itemsize
+        if end > len(data):
+            break
+        records = np.frombuffer(data, dtype=TRADE_DTYPE, count=count, offset=start)
+        block = Block(index, first_trade, sealed_at, prev_hash, records, root)
+        if block.hash != data[start - 32:start]:
+            raise ValueError(f"Header of block {index} does not match its stored hash")
+        blocks.append(block)
+        offset = end
+    return blocks
+
+
+def verify_blocks(blocks):
+    """See TradeLedger.verify"""
+    prev_hash = GENESIS_HASH
+    first_trade = 0
+    for position, block in enumerate(blocks):
+        if block.index != position or block.first_trade != first_trade:
+            raise ValueError(f"Block {position} is out of sequence")
+        if block.prev_hash != prev_hash:
+            raise ValueError(f"Block {position} does not link to the hash of block {position - 1}")
+        if merkle_root(leaf_hashes(block.records)) != block.merkle_root:
+            raise ValueError(f"Trades of block {position} do not match its Merkle root")
+        prev_hash = block.hash
+        first_trade += len(block)
+    return len(blocks)
+
+
+def add_ledger_arguments(parser):
+    """Add the --ledger and --block-* options to an argparse parser"""
+    parser.add_argument('--ledger', default=None,
+                        help="Directory the trade ledger's segment files are appended to (default: kept in memory)")
+    parser.add_argument('--block-size', type=int, default=1024,
+                        help="Trades per ledger block (default: %(default)s)")
+    parser.add_argument('--block-interval', type=float, default=None,
+                        help="Seconds after which pending trades are sealed into a block even if it is not full")
+
+
+def ledger_from_args(args):
+    """TradeLedger configured from parsed --ledger and --block-* options"""
+    return TradeLedger(args.ledger, args.block_size, args.block_interval)
@@ -0,0 +1,138 @@
+import numpy as np
+import pandas as pd
+
+# How the price of a trade is set: halfway between its ask and bid, or one price for the whole interval
+PRICING_RULES = ('midpoint', 'uniform')
+TRADE_COLUMNS = ['seller_id', 'buyer_id', 'quantity_kwh', 'price']
+MIN_TRADE_KWH = 1e-9
+
+
+def match_orders(ask_quantity, ask_price, bid_quantity, bid_price):
+    """
+    Match asks and bids that are already in priority order (asks cheapest first, bids highest first).
+
+    Both sides are laid out along the cumulative traded volume: every
+    boundary between two orders of either side starts a new trade, between the
+    ask and the bid covering that stretch of volume. Ask prices only go up and
+    bid prices only go down along it, so the crossed trades are a prefix and
+    matching costs one merge of the cumulative volumes, O(n log n) in the orders.
+
+    Returns (ask positions, bid positions, quantities) of the trades, in order.
+    """
+    empty = np.zeros(0, dtype=np.int64)
+    if len(ask_quantity) == 0 or len(bid_quantity) == 0:
+        return empty, empty, np.zeros(0)
+    cum_ask = np.cumsum(ask_quantity)
+    cum_bid = np.cumsum(bid_quantity)
+    volume = min(cum_ask[-1], cum_bid[-1])
+
+    ends = np.union1d(cum_ask, cum_bid)
+    ends = ends[ends <= volume]
+    starts = np.concatenate([[0.0], ends[:-1]])
+    asks = np.searchsorted(cum_ask, starts, side='right')
+    bids = np.searchsorted(cum_bid, starts, side='right')
+
+    crossed = bid_price[bids] >= ask_price[asks]
+    count = len(crossed) if crossed.all() else int(crossed.argmin())
+    quantity = (ends - starts)[:count]
+    # Rounding in the cumulative sums leaves slivers where two boundaries should coincide
+    keep = quantity > MIN_TRADE_KWH
+    return asks[:count][keep], bids[:count][keep], quantity[keep]
+
+
+class OrderBook:
+    def __init__(self):
+        """
+        Sell offers (asks) and purchase bids of one market interval, cleared as a double auction.
+
+        Orders are added in batches of arrays (one order per participant), so a
+        whole fleet's orders go in with two calls. Clearing gives the cheapest
+        asks to the highest bids for as long as the bid covers the ask; equal
+        prices keep the order the orders were added in. Any number of sellers
+        and buyers can take part, and an order can be split over several trades.
+        """
+        self._asks = []  # (ids, quantities, prices) batches in the order they were added
+        self._bids = []
+
+    def __len__(self):
+        return sum(len(batch[0]) for batch in self._asks + self._bids)
+
+    def add_asks(self, ids, quantities, prices):
+        """
+        Add sell offers.
+
+        Parameters:
+        - ids: Id of every seller
+        - quantities: kWh every seller offers (orders of 0 kWh or less are ignored)
+        - prices: Lowest price per kWh every seller accepts (a scalar applies to all)
+        """
+        self._asks.append(_orders(ids, quantities, prices))
+
+    def add_bids(self, ids, quantities, prices):
+        """
+        Add purchase bids.
+
+        Parameters:
+        - ids: Id of every buyer
+        - quantities: kWh every buyer wants (orders of 0 kWh or less are ignored)
+        - prices: Highest price per kWh every buyer pays (a scalar applies to all)
+        """
+        self._bids.append(_orders(ids, quantities, prices))
+
+    def clear(self, pricing='midpoint', timestamp=None):
+        """
+        Match the orders and return the trades table.
+
+        Parameters:
+        - pricing: 'midpoint' (each trade halfway between its ask and bid) or
+          'uniform' (every trade at the midpoint of the last matched ask and bid)
+        - timestamp: Interval of the trades, added as a first column if given
+
+        Returns a DataFrame with one row per trade: seller_id, buyer_id,
+        quantity_kwh and price (per kWh), in matching order. Unmatched volume is
+        left to the grid.
+        """
+        if pricing not in PRICING_RULES:
+            raise ValueError(f"Unknown pricing rule: {pricing} (expected one of {', '.join(PRICING_RULES)})")
+        ask_ids, ask_quantity, ask_price = _stack(self._asks)
+        bid_ids, bid_quantity, bid_price = _stack(self._bids)
+
+        # Priority: best price first, then the order the orders were added in
+        ask_order = np.argsort(ask_price, kind='stable')
+        bid_order = np.argsort(-bid_price, kind='stable')
+        asks, bids, quantity = match_orders(ask_quantity[ask_order], ask_price[ask_order],
+                                            bid_quantity[bid_order], bid_price[bid_order])
+        asks, bids = ask_order[asks], bid_order[bids]
+
+        if pricing == 'midpoint':
+            price = (ask_price[asks] + bid_price[bids]) / 2
+        else:
+            price = np.full(len(quantity), (ask_price[asks[-1]] + bid_price[bids[-1]]) / 2 if len(quantity) else 0.0)
+
+        trades = pd.DataFrame({
+            'seller_id': ask_ids[asks],
+            'buyer_id': bid_ids[bids],
+            'quantity_kwh': quantity,
+            'price': price
+        }, columns=TRADE_COLUMNS)
+        if timestamp is not None:
+            trades.insert(0, 'timestamp', pd.Timestamp(timestamp))
+        return trades
+
+
+def _orders(ids, quantities, prices):
+    """One batch of orders as arrays, without the orders of 0 kWh or less"""
+    ids = np.asarray(ids)
+    quantities = np.asarray(quantities, dtype=float).reshape(-1)
+    prices = np.broadcast_to(np.asarray(prices, dtype=float), quantities.shape)
+    if len(ids) != len(quantities):
+        raise ValueError(f"Got {len(ids)} ids for {len(quantities)} orders")
+    keep = quantities > 0
+    return ids[keep], quantities[keep], prices[keep]
+
+
+def _stack(batches):
+    """(ids, quantities, prices) of all batches of one side of the book"""
+    if not batches:
+        return np.zeros(0, dtype=object), np.zeros(0), np.zeros(0)
+    return tuple(np.concatenate([batch[i] for batch in batches]) for i in range(3))
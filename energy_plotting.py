@@ -0,0 +1,93 @@
+import numpy as np
+
+# Downsampling methods for plot lines, by name
+DOWNSAMPLE_METHODS = ('minmax', 'lttb')
+
+
+def axes_pixel_width(ax):
+    """Width of a matplotlib Axes in display pixels (at least 1)"""
+    return max(int(ax.get_window_extent().width), 1)
+
+
+def minmax_indices(y, buckets):
+    """
+    Indices of the points kept by min/max bucketing.
+
+    The series is split into buckets of equal size and the first and last
+    point plus the minimum and maximum of every bucket are kept, in order, so
+    every peak and dip of the full series is still drawn.
+    """
+    n = len(y)
+    if n <= 2 * buckets + 2:
+        return np.arange(n)
+    size = -(-n // buckets)
+    # Pad with the last value so every bucket has the same size
+    padded = np.concatenate([y, np.full(buckets * size - n, y[-1])]).reshape(buckets, size)
+    offsets = np.arange(buckets) * size
+    keep = np.concatenate([[0, n - 1], offsets + padded.argmin(axis=1), offsets + padded.argmax(axis=1)])
+    return np.unique(np.minimum(keep, n - 1))
+
+
+def lttb_indices(x, y, points):
+    """
+    Indices of the points kept by Largest-Triangle-Three-Buckets downsampling.
+
+    Keeps the first and last point and, from each of points - 2 buckets in
+    between, the point forming the largest triangle with the previously kept
+    point and the mean of the next bucket, which follows the visual shape of
+    the series.
+    """
+    n = len(y)
+    if points >= n or points < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, points - 1).astype(np.int64)
+    keep = np.empty(points, dtype=np.int64)
+    keep[0], keep[-1] = 0, n - 1
+
+    for i in range(points - 2):
+        start, stop = edges[i], edges[i + 1]
+        # Mean of the next bucket (the last point for the final bucket)
+        next_stop = edges[i + 2] if i + 2 < len(edges) else n
+        mean_x = x[stop:next_stop].mean()
+        mean_y = y[stop:next_stop].mean()
+        ax, ay = x[keep[i]], y[keep[i]]
+        area = np.abs((ax - mean_x) * (y[start:stop] - ay) - (ax - x[start:stop]) * (mean_y - ay))
+        keep[i + 1] = start + int(area.argmax())
+    return keep
+
+
+def downsample(x, y, points, method='minmax'):
+    """
+    Shape-preserving downsampling of a line to about points points.
+
+    Parameters:
+    - x, y: Coordinates of the line (x may be datetimes)
+    - points: Target number of points, e.g. the plot width in pixels
+    - method: 'minmax' (min/max bucketing, about 2 points per bucket, keeps every extreme)
+      or 'lttb' (Largest-Triangle-Three-Buckets, exactly points points)
+
+    Returns the kept (x, y) as NumPy arrays.
+    """
+    x, y = np.asarray(x), np.asarray(y)
+    if method == 'minmax':
+        keep = minmax_indices(y, max(points // 2, 1))
+    elif method == 'lttb':
+        # Datetimes take part in the triangle areas as integer ticks
+        x_values = x.view(np.int64) if x.dtype.kind == 'M' else x
+        keep = lttb_indices(x_values.astype(float), y.astype(float), points)
+    else:
+        raise ValueError(f"Unknown downsampling method: {method} (expected one of {', '.join(DOWNSAMPLE_METHODS)})")
+    return x[keep], y[keep]
+
+
+def plot_line(ax, x, y, *args, downsample_method='minmax', **kwargs):
+    """
+    ax.plot(x, y, ...) with the line downsampled to the width of the axes in pixels.
+
+    More points than pixels cannot be told apart on screen, so the rendering
+    cost stays flat however long the series is. downsample_method=None plots
+    every point.
+    """
+    if downsample_method is not None:
+        x, y = downsample(x, y, axes_pixel_width(ax), downsample_method)
+    return ax.plot(x, y, *args, **kwargs)
@@ -0,0 +1,145 @@
+import numpy as np
+import pandas as pd
+
+from energy_engine import user_key
+
+
+class ProfileTable:
+    def __init__(self, user_numbers, columns, categories=None, extras=None):
+        """
+        User profiles stored column by column (struct of arrays).
+
+        Parameters:
+        - user_numbers: Number of every user (user_007 -> 7), in row order
+        - columns: dict of field name -> NumPy array with one value per user;
+          categorical fields hold integer codes into categories[name]
+        - categories: dict of categorical field name -> list of labels
+        - extras: dict of row -> dict of additional fields of individual users
+          (explicit overrides such as V2's max_price), merged into their rows
+
+        Indexing with an int gives one profile as a dict, like the profile dicts
+        the simulators used to build; a slice gives a ProfileTable of those users.
+        """
+        self.user_numbers = np.asarray(user_numbers, dtype=np.int64)
+        self.columns = {name: np.asarray(values) for name, values in columns.items()}
+        self.categories = {name: list(labels) for name, labels in (categories or {}).items()}
+        self.extras = dict(extras or {})
+
+    def __len__(self):
+        return len(self.user_numbers)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            rows = range(len(self))[key]
+            extras = {rows.index(i): fields for i, fields in self.extras.items() if i in rows}
+            return ProfileTable(self.user_numbers[key], {name: values[key] for name, values in self.columns.items()},
+                                self.categories, extras)
+        row = range(len(self))[key]
+        profile = {"user_id": f"user_{self.user_numbers[row]:03d}"}
+        for name, values in self.columns.items():
+            profile[name] = self.categories[name][values[row]] if name in self.categories else values[row].item()
+        profile.update(self.extras.get(row, {}))
+        return profile
+
+    def __iter__(self):
+        for row in range(len(self)):
+            yield self[row]
+
+    @property
+    def user_ids(self):
+        """user_id of every user, in row order"""
+        return [f"user_{number:03d}" for number in self.user_numbers.tolist()]
+
+    def labels(self, name):
+        """Labels of a categorical field for every user, in row order"""
+        return [self.categories[name][code] for code in self.columns[name].tolist()]
+
+    def column(self, name, dtype=None):
+        """Values of a field for every user (integer codes for categorical fields)"""
+        values = self.columns[name]
+        return values if dtype is None else values.astype(dtype, copy=False)
+
+    def codes(self, name, labels):
+        """Codes of a categorical field relative to the given label order"""
+        lookup = np.array([labels.index(label) for label in self.categories[name]], dtype=np.int64)
+        return lookup[self.columns[name]]
+
+    def categorical(self, name):
+        """
+        A field (or user_id) as a pd.Categorical, without decoding a string per user.
+
+        Categories are the labels in use, sorted like pd.Categorical(labels)
+        would sort them, so frames come out the same as from a list of labels.
+        """
+        if name == 'user_id':
+            labels, codes = self.user_ids, np.arange(len(self))
+        else:
+            labels, codes = self.categories[name], self.columns[name]
+        used = np.zeros(len(labels), dtype=bool)
+        used[codes] = True
+        order = sorted(np.flatnonzero(used).tolist(), key=labels.__getitem__)
+        lookup = np.zeros(len(labels), dtype=np.int64)
+        lookup[order] = np.arange(len(order))
+        return pd.Categorical.from_codes(lookup[codes], [labels[i] for i in order])
+
+    @classmethod
+    def from_records(cls, records, categories=None):
+        """
+        Table of profile dicts.
+
+        Fields present in every record become columns (string fields as
+        categoricals, extending the given category lists); any other fields are
+        kept as per-user extras.
+        """
+        records = list(records)
+        categories = {name: list(labels) for name, labels in (categories or {}).items()}
+        fields = [name for name in (records[0] if records else {}) if name != "user_id"]
+
+        columns = {}
+        for name in fields:
+            if not all(name in record for record in records):
+                continue
+            values = [record[name] for record in records]
+            if isinstance(values[0], str):
+                labels = categories.setdefault(name, [])
+                positions = {label: i for i, label in enumerate(labels)}
+                for value in values:
+                    if value not in positions:
+                        positions[value] = len(labels)
+                        labels.append(value)
+                columns[name] = np.array([positions[value] for value in values], dtype=np.int16)
+            else:
+                columns[name] = np.array(values)
+
+        extras = {}
+        for row, record in enumerate(records):
+            fields = {name: value for name, value in record.items() if name != "user_id" and name not in columns}
+            if fields:
+                extras[row] = fields
+        return cls([user_key(record["user_id"]) for record in records], columns, categories, extras)
+
+    @classmethod
+    def concat(cls, tables):
+        """Stack tables with the same fields, merging their category lists (the first table's order wins)"""
+        first = tables[0]
+        categories = {name: list(labels) for name, labels in first.categories.items()}
+        columns = {name: [] for name in first.columns}
+        extras = {}
+        offset = 0
+
+        for table in tables:
+            for name in columns:
+                values = table.columns[name]
+                if name in categories:
+                    labels = categories[name]
+                    for label in table.categories[name]:
+                        if label not in labels:
+                            labels.append(label)
+                    lookup = np.array([labels.index(label) for label in table.categories[name]], dtype=np.int16)
+                    values = lookup[values] if len(values) else values.astype(np.int16)
+                columns[name].append(values)
+            extras.update({offset + row: fields for row, fields in table.extras.items()})
+            offset += len(table)
+
+        return cls(np.concatenate([table.user_numbers for table in tables]),
+                   {name: np.concatenate(values) for name, values in columns.items()}, categories, extras)
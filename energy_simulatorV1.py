@@ -1,33 +1,151 @@
+import argparse
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 from datetime import datetime, timedelta
 import random
+import re
 import json
-from flask import Flask, jsonify, request
+import os
+from flask import Flask, Response, jsonify, request, stream_with_context
+from energy_cache import SimulationCache
+from energy_engine import (CONSUMPTION_PATTERNS, MEASURES, STREAM_BATTERY, STREAM_CONSUMPTION, STREAM_PROFILE,
+                           STREAM_WEATHER, Rollups, RunningTotals, allocate_measures, as_frame, build_block_frame,
+                           build_frame, iter_fleet, peak_memory, random_streams, shared_timeline, simulate_fleet,
+                           simulate_sharded)
+from energy_formats import NDJSON_MIMETYPE, available_formats, frame_response, ndjson_lines, negotiate_format
+from energy_ledger import TradeLedger
+from energy_plotting import plot_line
+from energy_profiles import ProfileTable
+from energy_storage import ParquetStore, SimulationStore
 
 # Flask app setup
 app = Flask(__name__)
 
+# Simulation results shared by the API routes, keyed on the request parameters
+simulation_cache = SimulationCache(max_entries=32, max_bytes=256 * 2**20, ttl_seconds=300)
+DEFAULT_SEED = 42
+
+# Trade ledger /api/energy/user/<user_id> attaches settlement proofs from (set by --ledger; None: none).
+# The V5-V7 market simulators record trades under the same user_001-style ids
+trade_ledger = None
+
+LOCATIONS = ["Urban", "Suburban", "Rural"]
+
+# Weather site of every location (around Jaipur, like the V5-V7 forecasts), for WeatherStore(LOCATION_SITES, ...)
+LOCATION_SITES = {
+    "Urban": (26.9124, 75.7873),
+    "Suburban": (26.8500, 75.6500),
+    "Rural": (27.0500, 75.9500)
+}
+
 class EnergyDataSimulator:
-    def __init__(self, num_users=10, days=30, interval_minutes=60):
+    def __init__(self, num_users=10, days=30, interval_minutes=60, dtype=np.float32, seed=None, workers=1,
+                 weather=None):
         """
         Initialize the energy data simulator.
         
         Parameters:
         - num_users: Number of users in the simulation
-        - days: Number of days to simulate
+        - days: Number of days to simulate (None for an open-ended simulation that can only be iterated)
         - interval_minutes: Data recording interval in minutes
+        - dtype: NumPy dtype of the energy measure columns
+        - seed: Master seed every user's random stream is derived from (random if None)
+        - workers: Number of processes generate_data splits the users across
+        - weather: WeatherStore with a site per location (see LOCATION_SITES) whose
+          forecast cloud cover drives solar production; None draws random weather
         """
         self.num_users = num_users
         self.days = days
         self.interval_minutes = interval_minutes
-        self.user_profiles = self._generate_user_profiles()
+        self.dtype = dtype
+        self.seed = seed if seed is not None else random.getrandbits(63)
+        self.workers = workers
+        self.weather = weather
+        self.peak_memory_bytes = None
+        self._user_profiles = None
+        self._profiles_key = None
+        self._data = None
+        self._data_key = None
+        self._rollups = None
+        self._rollups_key = None
+    
+    @property
+    def user_profiles(self):
+        """Profiles of all users, generated on first access and again when num_users or seed change"""
+        if self._user_profiles is None or self._profiles_key != (self.num_users, self.seed):
+            self.user_profiles = self._generate_user_profiles()
+        return self._user_profiles
+    
+    @user_profiles.setter
+    def user_profiles(self, profiles):
+        self._user_profiles = None if profiles is None else self._profile_table(profiles)
+        self._profiles_key = (self.num_users, self.seed)
+        self._data = None
+        self._rollups = None
+    
+    @property
+    def data(self):
+        """
+        Result of generate_data() for the current parameters.
+        
+        Computed on first access and reused afterwards; changing a simulation
+        parameter (or the profiles) invalidates it.
+        """
+        start_date = self._default_start_date()
+        if self._data is None or self._data_key != self._data_cache_key(start_date):
+            self.generate_data(start_date)
+        return self._data
+    
+    def _timestamps(self, start_date):
+        """Timestamps of every simulated interval"""
+        if self.days is None:
+            raise ValueError("An open-ended simulation (days=None) can only be iterated")
+        return self._timeline(start_date).timestamps
+    
+    def _timeline(self, start_date):
+        """
+        Calendar, sun and pattern factors of the simulated intervals.
         
-    def _generate_user_profiles(self):
-        """Generate different user profiles with varying energy characteristics"""
-        profiles = []
+        They are the same for every user and for every run with the same
+        start date, days and interval, so one cached Timeline is shared.
+        """
+        return shared_timeline(start_date, self.days, self.interval_minutes, self._pattern_factors)
+    
+    def _default_start_date(self):
+        today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        # Open-ended simulations start today, fixed ones end today
+        return today if self.days is None else today - timedelta(days=self.days)
+    
+    def _data_cache_key(self, start_date):
+        """Everything the full-fleet result depends on"""
+        return (self.num_users, self.days, self.interval_minutes, np.dtype(self.dtype), self.seed, self.weather,
+                start_date)
+    
+    def get_user_profile(self, user_id):
+        """
+        Resolve the profile of a single user by id (None if the id is not in the fleet).
         
+        Profiles are derived from each user's own random stream, so this gives the
+        same profile as the full fleet without generating the other users.
+        """
+        number = self._user_number(user_id)
+        if number is None:
+            return None
+        return self._generate_user_profiles([number])[0]
+    
+    def _user_number(self, user_id):
+        """Number of a user in the fleet (user_007 -> 7), None if the id is not in the fleet"""
+        match = re.fullmatch(r'user_(\d+)', user_id)
+        if match is None:
+            return None
+        number = int(match.group(1))
+        if user_id != f"user_{number:03d}" or not 1 <= number <= self.num_users:
+            return None
+        return number
+        
+    def _generate_user_profiles(self, numbers=None):
+        """Generate different user profiles with varying energy characteristics (as a ProfileTable)"""
         # User types and their characteristics
         user_types = [
             {"type": "Residential Small", "base_consumption": 8, "solar_capacity": 3, "battery_capacity": 5},
@@ -38,148 +156,455 @@ class EnergyDataSimulator:
             {"type": "Large Business", "base_consumption": 150, "solar_capacity": 40, "battery_capacity": 80}
         ]
         
-        for i in range(self.num_users):
-            # Randomly assign a user type
-            user_type = random.choice(user_types)
-            
-            # Add some randomness to the profile
-            variation = random.uniform(0.8, 1.2)
-            
-            profile = {
-                "user_id": f"user_{i+1:03d}",
-                "user_type": user_type["type"],
-                "base_consumption": user_type["base_consumption"] * variation,
-                "solar_capacity": user_type["solar_capacity"] * variation,
-                "battery_capacity": user_type["battery_capacity"] * variation,
-                "consumption_pattern": random.choice(["Day Worker", "Night Worker", "Home Office", "Weekend Active"]),
-                "location": random.choice(["Urban", "Suburban", "Rural"]),
-                "weather_sensitivity": random.uniform(0.5, 1.5)
-            }
-            
-            profiles.append(profile)
-            
-        return profiles
+        # Each user's profile comes from its own random stream, so it only depends on the seed and its number
+        if numbers is None:
+            numbers = np.arange(1, self.num_users + 1)
+        type_draw, variation_draw, pattern_draw, location_draw, sensitivity_draw = random_streams(
+            self.seed, STREAM_PROFILE, numbers, range(5))
+        
+        # Randomly assign a user type
+        user_type = (type_draw * len(user_types)).astype(np.int16)
+        
+        # Add some randomness to the profile
+        variation = 0.8 + 0.4 * variation_draw
+        
+        def characteristic(name):
+            return np.array([t[name] for t in user_types], dtype=float)[user_type] * variation
+        
+        return ProfileTable(numbers, {
+            "user_type": user_type,
+            "base_consumption": characteristic("base_consumption"),
+            "solar_capacity": characteristic("solar_capacity"),
+            "battery_capacity": characteristic("battery_capacity"),
+            "consumption_pattern": (pattern_draw * len(CONSUMPTION_PATTERNS)).astype(np.int16),
+            "location": (location_draw * len(LOCATIONS)).astype(np.int16),
+            "weather_sensitivity": 0.5 + sensitivity_draw
+        }, categories={
+            "user_type": [t["type"] for t in user_types],
+            "consumption_pattern": CONSUMPTION_PATTERNS,
+            "location": LOCATIONS
+        })
     
-    def _simulate_single_user_data(self, user_profile, start_date):
-        """Simulate energy data for a single user"""
-        timestamps = []
-        consumption = []
-        production = []
-        battery_level = []
-        grid_import = []
-        grid_export = []
+    def _profile_table(self, profiles):
+        """Profiles as a ProfileTable: the fleet's for None, lists of profile dicts are converted"""
+        if profiles is None:
+            return self.user_profiles
+        if isinstance(profiles, ProfileTable):
+            return profiles
+        return ProfileTable.from_records(profiles, {"consumption_pattern": CONSUMPTION_PATTERNS})
+    
+    @staticmethod
+    def _pattern_factors(hours, is_weekend):
+        """Consumption multipliers for every consumption pattern, shape (patterns, intervals)"""
+        return np.vstack([
+            # Day Worker: higher consumption in morning and evening
+            1.0 + 0.5 * ((0.5 <= hours / 24) & (hours / 24 <= 0.8)),
+            # Night Worker: higher consumption during night
+            1.0 + 0.5 * ((hours < 8) | (hours > 20)),
+            # Home Office: steady consumption throughout day
+            1.0 + 0.3 * ((8 <= hours) & (hours <= 18)),
+            # Weekend Active: higher consumption on weekends
+            1.0 + 0.5 * is_weekend
+        ])
+    
+    def _simulate_users(self, profiles, timeline, out=None, first=0, stop=None, clouds=None):
+        """Simulate energy data for a group of users with the vectorized engine, recording intervals first:stop"""
+        stop = len(timeline) if stop is None else stop
+        return simulate_fleet(*self._fleet_model(profiles, timeline, clouds), stop, out=out, decimals=2, first=first)
+    
+    def _fleet_model(self, profiles, timeline, clouds=None):
+        """
+        Engine inputs for a group of users: (energy_block, battery_capacity, initial_battery).
+        
+        clouds is the cloud cover of every location from _cloud_cover (looked up
+        from the weather store if None).
+        """
+        keys = profiles.user_numbers.astype(np.uint64)
+        base_consumption = profiles.column("base_consumption", float)
+        solar_capacity = profiles.column("solar_capacity", float)
+        battery_capacity = profiles.column("battery_capacity", float)
+        weather_sensitivity = profiles.column("weather_sensitivity", float)
+        pattern = profiles.codes("consumption_pattern", CONSUMPTION_PATTERNS)
+        location = profiles.codes("location", LOCATIONS)
+        site_clouds = self._site_clouds(timeline, clouds)
         
         # Initial battery level (random between 20% and 80%)
-        current_battery = user_profile["battery_capacity"] * random.uniform(0.2, 0.8)
+        initial_battery = battery_capacity * (0.2 + 0.6 * random_streams(self.seed, STREAM_BATTERY, keys, [0])[0])
         
-        # Create timestamps
-        total_intervals = int((self.days * 24 * 60) / self.interval_minutes)
-        for i in range(total_intervals):
-            current_time = start_date + timedelta(minutes=i * self.interval_minutes)
-            timestamps.append(current_time)
-            
-            # Hour of day (0-23) affects consumption and production patterns
-            hour = current_time.hour
+        def energy_block(start, stop):
+            intervals = np.arange(start, stop)
             
-            # Day of week (0=Monday, 6=Sunday) affects patterns
-            day_of_week = current_time.weekday()
-            is_weekend = day_of_week >= 5
+            # Hour of day and day of week affect the patterns (precomputed once per timeline)
+            hours, is_weekend, sun, pattern_factors = timeline.block(start, stop)
             
-            # Base consumption with time-of-day variation
-            if user_profile["consumption_pattern"] == "Day Worker":
-                # Higher consumption in morning and evening
-                hour_factor = 1.0 + 0.5 * (0.5 <= hour/24 <= 0.8)
-            elif user_profile["consumption_pattern"] == "Night Worker":
-                # Higher consumption during night
-                hour_factor = 1.0 + 0.5 * (hour < 8 or hour > 20)
-            elif user_profile["consumption_pattern"] == "Home Office":
-                # Steady consumption throughout day
-                hour_factor = 1.0 + 0.3 * (8 <= hour <= 18)
-            else:  # Weekend Active
-                # Higher consumption on weekends
-                hour_factor = 1.0 + 0.5 * is_weekend
+            # Base consumption with time-of-day variation and randomness (0.8-1.2)
+            hour_factor = pattern_factors[pattern].T
+            noise = random_streams(self.seed, STREAM_CONSUMPTION, keys, intervals)
+            consumption = base_consumption * hour_factor * (0.8 + 0.4 * noise)
             
-            # Add randomness to consumption
-            random_factor = random.uniform(0.8, 1.2)
-            
-            # Calculate actual consumption
-            user_consumption = user_profile["base_consumption"] * hour_factor * random_factor
+            # Weather only matters while the sun is up, so it is only looked up for daylight intervals
+            production = np.zeros_like(consumption)
+            daylight = np.flatnonzero(sun > 0)
+            if site_clouds is None:
+                # 30% of intervals have weather reducing production to sensitivity * (0.7-1.0)
+                weather = random_streams(self.seed, STREAM_WEATHER, keys, intervals[daylight])
+                weather_factor = np.where(weather < 0.3, weather_sensitivity * (0.7 + weather), 1.0)
+            else:
+                # Forecast cloud cover of each user's site; full overcast takes 75% off at sensitivity 1
+                clouds = site_clouds(start, stop)[:, daylight].T[:, location]
+                weather_factor = np.clip(1 - 0.75 * weather_sensitivity * clouds / 100, 0, 1)
+            production[daylight] = solar_capacity * sun[daylight, None] * weather_factor
             
-            # Solar production based on time of day (peak at noon)
-            sun_intensity = max(0, np.sin(np.pi * (hour - 6) / 12)) if 6 <= hour <= 18 else 0
-            # Reduce production on weekends by 0-20% randomly to simulate weather variations
-            weather_factor = user_profile["weather_sensitivity"] * random.uniform(0.7, 1.0) if random.random() < 0.3 else 1.0
-            user_production = user_profile["solar_capacity"] * sun_intensity * weather_factor
+            return consumption, production
+        
+        return energy_block, battery_capacity, initial_battery
+    
+    def _cloud_cover(self, timeline):
+        """
+        Forecast cloud cover of every location over a whole timeline, shape
+        (locations, intervals), or None without a weather store.
+        
+        Sharded runs look it up once in the calling process and hand the array
+        to the shards, so the store is fetched (and filled) once and every
+        shard sees the same forecast whatever the number of workers.
+        """
+        if self.weather is None:
+            return None
+        return self.weather.cloud_cover(timeline.timestamps, LOCATIONS)
+    
+    def _site_clouds(self, timeline, clouds=None):
+        """
+        Function (start, stop) -> forecast cloud cover of every location, shape
+        (locations, intervals), or None without a weather store.
+        
+        The sites are interpolated onto the whole timeline once (block by block
+        for an open-ended one), however many users share them.
+        """
+        if clouds is None:
+            if self.weather is None:
+                return None
+            if timeline.timestamps is None:
+                return lambda start, stop: self.weather.cloud_cover(timeline[start:stop], LOCATIONS)
+            clouds = self._cloud_cover(timeline)
+        return lambda start, stop: clouds[:, start:stop]
+    
+    def generate_data(self, start_date=None, report_memory=False, profiles=None):
+        """
+        Generate energy data for all users (or only the given profiles).
+        
+        The result is assembled once into preallocated columns: categorical
+        user_id/user_type and measures of the configured dtype. With
+        report_memory the peak memory of the run is printed and kept in
+        self.peak_memory_bytes.
+        """
+        profiles = self._profile_table(profiles)
+        if start_date is None:
+            start_date = self._default_start_date()
+        
+        with peak_memory(enabled=report_memory) as usage:
+            timestamps = self._timestamps(start_date)
+            total_intervals = len(timestamps)
             
-            # Battery dynamics
-            net_energy = user_production - user_consumption
+            # Users are independent, so they can be split across processes without changing the result
+            columns = allocate_measures(len(profiles), total_intervals, self.dtype)
+            timeline = self._timeline(start_date)
+            simulate_sharded(_simulate_shard, profiles,
+                             (timeline, self.seed, self.dtype, self._cloud_cover(timeline)),
+                             columns, total_intervals, workers=self.workers)
             
-            # If producing more than consuming, charge battery
-            if net_energy > 0:
-                energy_to_battery = min(net_energy, user_profile["battery_capacity"] - current_battery)
-                current_battery += energy_to_battery
-                excess_energy = net_energy - energy_to_battery
-                user_grid_export = excess_energy
-                user_grid_import = 0
-            # If consuming more than producing, discharge battery
+            # Combine all user data (one block of rows per user)
+            combined_df = build_frame(timestamps, {
+                'user_id': profiles.categorical('user_id'),
+                'user_type': profiles.categorical('user_type')
+            }, columns)
+        
+        if report_memory:
+            self.peak_memory_bytes = usage['peak_bytes']
+            print(f"Peak memory: {usage['peak_bytes'] / 2**20:.1f} MB")
+        
+        # Keep full-fleet results so plots reuse them instead of simulating again
+        if profiles is self._user_profiles:
+            self._data, self._data_key = combined_df, self._data_cache_key(start_date)
+        
+        return combined_df
+    
+    def iter_chunks(self, start_date=None, block_intervals=24, profiles=None, rows=None):
+        """
+        Generate energy data one block of intervals at a time.
+        
+        Yields one DataFrame per block holding every user for those intervals,
+        ordered by time, so memory is bounded by the block size rather than the
+        length of the simulation. With rows, each block holds as many whole
+        intervals as fit in that many rows (at least one). With days=None the
+        blocks never run out; stop iterating when done.
+        """
+        profiles = self._profile_table(profiles)
+        if start_date is None:
+            start_date = self._default_start_date()
+        if rows is not None:
+            block_intervals = max(1, rows // max(len(profiles), 1))
+        
+        timeline = self._timeline(start_date)
+        labels = {
+            'user_id': profiles.categorical('user_id'),
+            'user_type': profiles.categorical('user_type')
+        }
+        blocks = iter_fleet(*self._fleet_model(profiles, timeline), timeline.total_intervals,
+                            block_intervals=block_intervals, decimals=2)
+        for start, stop, block in blocks:
+            yield build_block_frame(timeline[start:stop], labels, block, self.dtype)
+    
+    def iter_intervals(self, start_date=None, profiles=None, block_intervals=96):
+        """
+        Simulate one interval at a time, carrying the battery state forward.
+        
+        Yields (timestamp, values) where values maps each name in MEASURES to an
+        array with one value per user, in profile order. The arrays are reused,
+        so copy them if they need to outlive the next interval. With days=None
+        the simulation never ends; stop iterating when done.
+        """
+        profiles = self._profile_table(profiles)
+        if start_date is None:
+            start_date = self._default_start_date()
+        
+        timeline = self._timeline(start_date)
+        blocks = iter_fleet(*self._fleet_model(profiles, timeline), timeline.total_intervals,
+                            block_intervals=block_intervals, decimals=2)
+        for start, stop, block in blocks:
+            for i, timestamp in enumerate(timeline[start:stop]):
+                yield timestamp, {name: values[i] for name, values in block.items()}
+    
+    def generate_totals(self, start_date=None, profiles=None, block_intervals=96):
+        """
+        Fleet totals of every measure per timestamp, without materializing any rows.
+        
+        The engine sums each block over the users while it simulates, so memory is
+        bounded by the block size and the result has one row per timestamp.
+        """
+        profiles = self._profile_table(profiles)
+        if start_date is None:
+            start_date = self._default_start_date()
+        
+        timestamps = self._timestamps(start_date)
+        totals = RunningTotals(len(timestamps))
+        blocks = iter_fleet(*self._fleet_model(profiles, self._timeline(start_date)), len(timestamps),
+                            block_intervals=block_intervals, decimals=2)
+        for start, stop, block in blocks:
+            totals.add(start, stop, block)
+        return totals.to_frame(timestamps)
+    
+    def rollups(self, start_date=None, block_intervals=96):
+        """
+        Rollup pyramid of the full fleet (15-minute, hourly, daily and weekly sums; see Rollups).
+        
+        The pyramid is built on first use and kept until the parameters change:
+        from the rows of the last generate_data run if they match, otherwise by
+        streaming the fleet through it without keeping any rows. Per-user sums
+        use the simulator's dtype.
+        """
+        if start_date is None:
+            start_date = self._default_start_date()
+        
+        key = self._data_cache_key(start_date)
+        if self._rollups is None or self._rollups_key != key:
+            timestamps = self._timestamps(start_date)
+            profiles = self.user_profiles
+            rollups = Rollups(timestamps, profiles.user_ids, dtype=self.dtype)
+            if self._data is not None and self._data_key == key:
+                rollups.add_columns({name: self._data[name].to_numpy() for name in rollups.names})
             else:
-                energy_from_battery = min(abs(net_energy), current_battery)
-                current_battery -= energy_from_battery
-                energy_deficit = abs(net_energy) - energy_from_battery
-                user_grid_import = energy_deficit
-                user_grid_export = 0
-            
-            # Ensure battery level is within bounds
-            current_battery = max(0, min(current_battery, user_profile["battery_capacity"]))
-            
-            # Record data
-            consumption.append(round(user_consumption, 2))
-            production.append(round(user_production, 2))
-            battery_level.append(round(current_battery, 2))
-            grid_import.append(round(user_grid_import, 2))
-            grid_export.append(round(user_grid_export, 2))
-        
-        # Create DataFrame with all data
-        df = pd.DataFrame({
-            'timestamp': timestamps,
-            'user_id': user_profile["user_id"],
-            'user_type': user_profile["user_type"],
-            'consumption_kwh': consumption,
-            'production_kwh': production,
-            'battery_level_kwh': battery_level,
-            'grid_import_kwh': grid_import,
-            'grid_export_kwh': grid_export
-        })
+                blocks = iter_fleet(*self._fleet_model(profiles, self._timeline(start_date)), len(timestamps),
+                                    block_intervals=block_intervals, decimals=2)
+                for start, stop, block in blocks:
+                    rollups.add(start, stop, block)
+            self._rollups, self._rollups_key = rollups, key
+        return self._rollups
+    
+    def rollup(self, resolution=None, user_id=None, start=None, end=None, max_points=None, how='mean',
+               start_date=None):
+        """
+        Zoomed-out view of the run, read from the coarsest rollup level that satisfies it.
+        
+        Parameters:
+        - resolution: Widest acceptable bucket (a level name such as 'hour' or 'day', or a width like '6h')
+        - user_id: User to read (fleet-wide totals if None)
+        - start, end: Time window [start, end); buckets overlapping it are included
+        - max_points: Without resolution, the most buckets the window may take
+        - how: 'mean' for kWh per interval (comparable to the raw rows), 'sum' for bucket totals
         
-        return df
+        Returns (level, DataFrame with a timestamp column per bucket). Raises
+        ValueError when no level is fine enough, i.e. the raw rows are needed.
+        """
+        rollups = self.rollups(start_date)
+        if user_id is not None and user_id not in rollups.user_ids:
+            raise ValueError(f"Unknown user: {user_id}")
+        level = rollups.choose_level(resolution, max_points, start, end, per_user=user_id is not None)
+        if level is None:
+            raise ValueError(f"No rollup level is as fine as {resolution}, query the raw rows instead")
+        return level, rollups.to_frame(level, user_id, start, end, how=how).reset_index()
+    
+    def generate_user_data(self, user_id, start_date=None):
+        """Generate energy data for a single user, simulating only that user (None if unknown)"""
+        profile = self.get_user_profile(user_id)
+        if profile is None:
+            return None
+        return self.generate_data(start_date, profiles=[profile])
     
-    def generate_data(self, start_date=None):
-        """Generate energy data for all users"""
+    def query(self, user_ids=None, start=None, end=None, columns=None, cursor=0, limit=None, start_date=None):
+        """
+        Generate only the rows a query asks for.
+        
+        Only the users on the requested page are simulated, and only up to the
+        end of the time window. Intervals before the window are simulated just
+        to carry the battery state forward and are not recorded.
+        
+        Parameters:
+        - user_ids: Users to include, in the given order (all users if None); ids not in the fleet are skipped
+        - start: Start of the time window, inclusive (start of the simulation if None)
+        - end: End of the time window, exclusive (end of the simulation if None)
+        - columns: Measure columns to include (all of MEASURES if None)
+        - cursor: Row offset to continue from (next_cursor of the previous page)
+        - limit: Maximum number of rows to return (all remaining rows if None)
+        - start_date: Start of the simulation (as in generate_data)
+        
+        Returns (DataFrame, next_cursor), next_cursor being None on the last page.
+        Rows are ordered user by user like generate_data.
+        """
+        if columns is None:
+            columns = MEASURES
+        unknown = [name for name in columns if name not in MEASURES]
+        if unknown:
+            raise ValueError(f"Unknown columns: {', '.join(unknown)}")
+        if cursor < 0 or (limit is not None and limit < 1):
+            raise ValueError("cursor must be >= 0 and limit >= 1")
+        columns = [name for name in MEASURES if name in columns]
         if start_date is None:
-            start_date = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=self.days)
+            start_date = self._default_start_date()
         
-        all_user_data = []
+        # Intervals of the time window
+        timestamps = self._timestamps(start_date)
+        first = 0 if start is None else int(timestamps.searchsorted(pd.Timestamp(start)))
+        stop = len(timestamps) if end is None else int(timestamps.searchsorted(pd.Timestamp(end)))
+        window = max(stop - first, 0)
         
-        for profile in self.user_profiles:
-            user_df = self._simulate_single_user_data(profile, start_date)
-            all_user_data.append(user_df)
+        if user_ids is None:
+            numbers = range(1, self.num_users + 1)
+        else:
+            numbers = [n for n in dict.fromkeys(map(self._user_number, user_ids)) if n is not None]
+        total_rows = len(numbers) * window
+        last_row = total_rows if limit is None else min(total_rows, cursor + limit)
         
-        # Combine all user data
-        combined_df = pd.concat(all_user_data, ignore_index=True)
-        return combined_df
+        # Only the users with rows on this page are simulated
+        page_users = numbers[cursor // window:-(-last_row // window)] if window else []
+        profiles = self._generate_user_profiles(np.asarray(page_users, dtype=np.int64))
+        measures = allocate_measures(len(profiles), window, self.dtype, columns)
+        timeline = self._timeline(start_date)
+        clouds = self._cloud_cover(timeline) if len(profiles) else None
+        simulate_sharded(_simulate_shard, profiles,
+                         (timeline, self.seed, self.dtype, clouds, first, first + window, columns),
+                         measures, window, workers=self.workers)
+        
+        data = build_frame(timestamps[first:first + window], {
+            'user_id': profiles.categorical('user_id'),
+            'user_type': profiles.categorical('user_type')
+        }, measures)
+        offset = cursor % window if window else 0
+        page = data.iloc[offset:offset + max(last_row - cursor, 0)].reset_index(drop=True)
+        
+        return page, (last_row if last_row < total_rows else None)
     
     def save_to_csv(self, dataframe, filename="energy_data_simulation.csv"):
         """Save the simulated data to a CSV file"""
         dataframe.to_csv(filename, index=False)
         print(f"Data saved to {filename}")
+    
+    def save_to_parquet(self, root, data=None, start_date=None, rows=1_000_000, compression='zstd',
+                        row_group_size=128 * 1024, user_buckets=16):
+        """
+        Save simulated data to a Parquet dataset partitioned by day and user bucket.
+        
+        With data the given frame is written; otherwise the simulation is streamed
+        into the store rows at a time, so runs larger than memory can be saved.
+        Writing to an existing dataset appends to it. See ParquetStore for the
+        layout and the storage options.
+        """
+        if data is None and self.days is None:
+            raise ValueError("An open-ended simulation (days=None) cannot be saved in full")
+        chunks = [data] if data is not None else self.iter_chunks(start_date, rows=rows)
+        
+        with ParquetStore(root, compression=compression, row_group_size=row_group_size,
+                          user_buckets=user_buckets) as store:
+            for chunk in chunks:
+                store.append(chunk)
+        print(f"Data saved to {root} ({store.rows_written} rows)")
+        return store
+    
+    def save_to_store(self, path, start_date=None, block_intervals=96):
+        """
+        Simulate straight into a memory-mapped SimulationStore and return it opened for reading.
+        
+        Blocks are written into the mapped columns as they are simulated, so the
+        run never has to fit in memory.
+        """
+        if start_date is None:
+            start_date = self._default_start_date()
+        
+        timestamps = self._timestamps(start_date)
+        profiles = self.user_profiles
+        offsets = np.arange(len(profiles) + 1) * len(timestamps)
+        store = SimulationStore.create(path, profiles.user_ids, profiles.labels("user_type"),
+                                       offsets, timestamps.to_numpy().dtype, self.dtype)
+        rollups = Rollups(timestamps, profiles.user_ids, dtype=self.dtype)
+        blocks = iter_fleet(*self._fleet_model(profiles, self._timeline(start_date)), len(timestamps),
+                            block_intervals=block_intervals, decimals=2)
+        for start, stop, block in blocks:
+            store.write_block(start, stop, timestamps[start:stop], block)
+            rollups.add(start, stop, block)
+        store.flush()
+        
+        # The pyramid is stored with the run, so zoomed-out reads of the store never touch its rows
+        rollups.save(os.path.join(path, 'rollups.npz'))
+        self._rollups, self._rollups_key = rollups, self._data_cache_key(start_date)
+        
+        print(f"Data saved to {path} ({len(store)} rows)")
+        return SimulationStore(path)
+        
+    def _zoomed_out_rollups(self, data, max_points):
+        """
+        Rollup pyramid to plot from instead of the rows (None to plot the rows).
+        
+        Only used when the run has more than max_points intervals and a pyramid
+        comes with it: a SimulationStore's, or the simulator's own when data is None.
+        """
+        if isinstance(data, SimulationStore):
+            intervals = len(data) // max(len(data.users), 1)
+            return data.rollups if intervals > max_points else None
+        if data is None and len(self._timestamps(self._default_start_date())) > max_points:
+            return self.rollups()
+        return None
+    
+    def plot_user_data(self, user_id, data=None, max_points=20_000, downsample='minmax'):
+        """
+        Plot energy data for a specific user (from data if given, else the simulator's cached result).
         
-    def plot_user_data(self, user_id):
-        """Plot energy data for a specific user"""
-        # Generate data first if not already done
-        data = self.generate_data()
-        user_data = data[data['user_id'] == user_id]
+        Runs longer than max_points intervals are plotted from the rollup pyramid
+        when one is available: one point per bucket (mean kWh per interval) of
+        the finest level that fits. Every line is then downsampled to the plot
+        width in pixels with downsample ('minmax' keeps every peak, 'lttb'
+        follows the shape; None draws every point).
+        """
+        rollups = self._zoomed_out_rollups(data, max_points)
+        level = rollups.choose_level(max_points=max_points, per_user=True) if rollups is not None else None
+        if level is not None and user_id in rollups.user_ids:
+            user_data = rollups.to_frame(level, user_id, how='mean').reset_index()
+        elif isinstance(data, SimulationStore):
+            # The store's index gives the user's row range directly instead of scanning every row
+            user_data = data.read_user(user_id)
+        else:
+            data = self.data if data is None else as_frame(data)
+            user_data = data[data['user_id'] == user_id]
         
-        if user_data.empty:
+        if user_data is None or user_data.empty:
             print(f"No data found for user {user_id}")
             return
         
@@ -187,8 +612,10 @@ class EnergyDataSimulator:
         fig, (ax1, ax2) = plt.subplots(2, 1, figsize=(12, 10))
         
         # Consumption and Production
-        ax1.plot(user_data['timestamp'], user_data['consumption_kwh'], 'r-', label='Consumption (kWh)')
-        ax1.plot(user_data['timestamp'], user_data['production_kwh'], 'g-', label='Production (kWh)')
+        plot_line(ax1, user_data['timestamp'], user_data['consumption_kwh'], 'r-', label='Consumption (kWh)',
+                  downsample_method=downsample)
+        plot_line(ax1, user_data['timestamp'], user_data['production_kwh'], 'g-', label='Production (kWh)',
+                  downsample_method=downsample)
         ax1.set_title(f'Energy Consumption and Production for {user_id}')
         ax1.set_xlabel('Time')
         ax1.set_ylabel('Energy (kWh)')
@@ -196,9 +623,12 @@ class EnergyDataSimulator:
         ax1.grid(True)
         
         # Battery Level and Grid Interactions
-        ax2.plot(user_data['timestamp'], user_data['battery_level_kwh'], 'b-', label='Battery Level (kWh)')
-        ax2.plot(user_data['timestamp'], user_data['grid_import_kwh'], 'r--', label='Grid Import (kWh)')
-        ax2.plot(user_data['timestamp'], user_data['grid_export_kwh'], 'g--', label='Grid Export (kWh)')
+        plot_line(ax2, user_data['timestamp'], user_data['battery_level_kwh'], 'b-', label='Battery Level (kWh)',
+                  downsample_method=downsample)
+        plot_line(ax2, user_data['timestamp'], user_data['grid_import_kwh'], 'r--', label='Grid Import (kWh)',
+                  downsample_method=downsample)
+        plot_line(ax2, user_data['timestamp'], user_data['grid_export_kwh'], 'g--', label='Grid Export (kWh)',
+                  downsample_method=downsample)
         ax2.set_title(f'Battery and Grid Interactions for {user_id}')
         ax2.set_xlabel('Time')
         ax2.set_ylabel('Energy (kWh)')
@@ -208,26 +638,41 @@ class EnergyDataSimulator:
         plt.tight_layout()
         plt.show()
         
-    def plot_grid_summary(self):
-        """Plot summary of grid import/export across all users"""
-        # Generate data first if not already done
-        data = self.generate_data()
+    def plot_grid_summary(self, data=None, max_points=20_000, downsample='minmax'):
+        """
+        Plot summary of grid import/export across all users (from data if given, else the cached result).
         
-        # Aggregate by timestamp
-        grid_summary = data.groupby('timestamp').agg({
-            'grid_import_kwh': 'sum',
-            'grid_export_kwh': 'sum',
-            'consumption_kwh': 'sum',
-            'production_kwh': 'sum'
-        }).reset_index()
+        Like plot_user_data, runs longer than max_points intervals are plotted
+        from the fleet-wide rollups when available instead of aggregating rows,
+        and the lines are downsampled to the plot width with downsample.
+        """
+        rollups = self._zoomed_out_rollups(data, max_points)
+        level = rollups.choose_level(max_points=max_points) if rollups is not None else None
+        if level is not None:
+            # Fleet totals per bucket, as the mean total per interval
+            grid_summary = rollups.to_frame(level, how='mean').reset_index()
+        else:
+            data = self.data if data is None else as_frame(data)
+            
+            # Aggregate by timestamp
+            grid_summary = data.groupby('timestamp').agg({
+                'grid_import_kwh': 'sum',
+                'grid_export_kwh': 'sum',
+                'consumption_kwh': 'sum',
+                'production_kwh': 'sum'
+            }).reset_index()
         
         # Plotting
         fig, ax = plt.subplots(figsize=(12, 6))
         
-        ax.plot(grid_summary['timestamp'], grid_summary['grid_import_kwh'], 'r-', label='Total Grid Import (kWh)')
-        ax.plot(grid_summary['timestamp'], grid_summary['grid_export_kwh'], 'g-', label='Total Grid Export (kWh)')
-        ax.plot(grid_summary['timestamp'], grid_summary['consumption_kwh'], 'b--', label='Total Consumption (kWh)')
-        ax.plot(grid_summary['timestamp'], grid_summary['production_kwh'], 'y--', label='Total Production (kWh)')
+        plot_line(ax, grid_summary['timestamp'], grid_summary['grid_import_kwh'], 'r-', label='Total Grid Import (kWh)',
+                  downsample_method=downsample)
+        plot_line(ax, grid_summary['timestamp'], grid_summary['grid_export_kwh'], 'g-', label='Total Grid Export (kWh)',
+                  downsample_method=downsample)
+        plot_line(ax, grid_summary['timestamp'], grid_summary['consumption_kwh'], 'b--', label='Total Consumption (kWh)',
+                  downsample_method=downsample)
+        plot_line(ax, grid_summary['timestamp'], grid_summary['production_kwh'], 'y--', label='Total Production (kWh)',
+                  downsample_method=downsample)
         
         ax.set_title('Grid Summary - All Users')
         ax.set_xlabel('Time')
@@ -238,6 +683,73 @@ class EnergyDataSimulator:
         plt.tight_layout()
         plt.show()
 
+def _simulate_shard(profiles, timeline, seed, dtype, clouds=None, first=0, stop=None, names=MEASURES, out=None):
+    """Process pool entry point: simulate one shard of users (clouds: see EnergyDataSimulator._cloud_cover)"""
+    simulator = EnergyDataSimulator(num_users=0, dtype=dtype, seed=seed)
+    stop = len(timeline) if stop is None else stop
+    if out is None:
+        out = allocate_measures(len(profiles), stop - first, dtype, names)
+    return simulator._simulate_users(profiles, timeline, out=out, first=first, stop=stop, clouds=clouds)
+
+def _cached_simulation(num_users, days, interval, seed):
+    """Simulated data for the API parameters, only re-simulated on a cache miss"""
+    # The default start date moves with the calendar day, so the day is part of the key
+    key = (num_users, days, interval, seed, datetime.now().date())
+    
+    def simulate():
+        # float64 measures keep the JSON values exactly as rounded
+        simulator = EnergyDataSimulator(num_users=num_users, days=days, interval_minutes=interval,
+                                        dtype=np.float64, seed=seed)
+        return simulator.generate_data()
+    
+    return simulation_cache.get_or_compute(key, simulate)
+
+def _cached_totals(num_users, days, interval, seed):
+    """Fleet totals per timestamp for the API parameters, only re-simulated on a cache miss"""
+    key = ('totals', num_users, days, interval, seed, datetime.now().date())
+    
+    def simulate():
+        simulator = EnergyDataSimulator(num_users=num_users, days=days, interval_minutes=interval, seed=seed)
+        return simulator.generate_totals()
+    
+    return simulation_cache.get_or_compute(key, simulate)
+
+def _cached_rollups(num_users, days, interval, seed):
+    """Rollup pyramid for the API parameters, only re-simulated on a cache miss"""
+    key = ('rollups', num_users, days, interval, seed, datetime.now().date())
+    
+    def simulate():
+        simulator = EnergyDataSimulator(num_users=num_users, days=days, interval_minutes=interval, seed=seed)
+        return simulator.rollups()
+    
+    return simulation_cache.get_or_compute(key, simulate)
+
+def _unsupported_format():
+    """406 response for a ?format= this server cannot produce"""
+    message = f"Unsupported format, expected one of: {', '.join(available_formats())}"
+    return jsonify({"status": "error", "message": message}), 406
+
+# Query parameters /api/energy/data pushes down into EnergyDataSimulator.query
+QUERY_ARGS = ('user_id', 'start', 'end', 'columns', 'cursor', 'limit')
+
+def _is_query(request):
+    """Whether the request filters or paginates the data"""
+    return any(name in request.args for name in QUERY_ARGS)
+
+def _list_arg(request, name):
+    """Values of a repeatable, comma-separated query parameter (None if absent)"""
+    values = [value for arg in request.args.getlist(name) for value in arg.split(',') if value]
+    return values or None
+
+def _count_arg(request, name, default=None):
+    """Non-negative integer query parameter (default if absent); ValueError if it is anything else"""
+    value = request.args.get(name)
+    if value is None:
+        return default
+    if not value.strip().isdigit():
+        raise ValueError(f"{name} must be a non-negative integer, got {value!r}")
+    return int(value)
+
 # Flask API routes
 @app.route('/api/energy/data', methods=['GET'])
 def get_energy_data():
@@ -245,9 +757,44 @@ def get_energy_data():
     num_users = int(request.args.get('users', 10))
     days = int(request.args.get('days', 7))
     interval = int(request.args.get('interval', 60))
+    seed = int(request.args.get('seed', DEFAULT_SEED))
+    fmt = negotiate_format(request)
+    if fmt is None:
+        return _unsupported_format()
     
-    simulator = EnergyDataSimulator(num_users=num_users, days=days, interval_minutes=interval)
-    data = simulator.generate_data()
+    if _is_query(request):
+        # Filters and pagination are pushed into the simulator, so only the requested rows are simulated
+        simulator = EnergyDataSimulator(num_users=num_users, days=days, interval_minutes=interval,
+                                        dtype=np.float64, seed=seed)
+        try:
+            data, next_cursor = simulator.query(
+                user_ids=_list_arg(request, 'user_id'),
+                start=request.args.get('start'),
+                end=request.args.get('end'),
+                columns=_list_arg(request, 'columns'),
+                cursor=_count_arg(request, 'cursor', 0),
+                limit=_count_arg(request, 'limit')
+            )
+        except ValueError as e:
+            return jsonify({"status": "error", "message": str(e)}), 400
+        
+        if fmt != 'json':
+            response = frame_response(data, fmt)
+            if next_cursor is not None:
+                response.headers['X-Next-Cursor'] = str(next_cursor)
+            return response
+        return jsonify({"status": "success", "data": data.to_dict(orient='records'), "next_cursor": next_cursor})
+    
+    if fmt == 'ndjson':
+        # Stream rows as the simulation produces them instead of building the whole response
+        simulator = EnergyDataSimulator(num_users=num_users, days=days, interval_minutes=interval,
+                                        dtype=np.float64, seed=seed)
+        chunks = simulator.iter_chunks(block_intervals=1)
+        return Response(stream_with_context(ndjson_lines(chunks)), mimetype=NDJSON_MIMETYPE)
+    
+    data = _cached_simulation(num_users, days, interval, seed)
+    if fmt != 'json':
+        return frame_response(data, fmt)
     
     # Convert to dictionary for JSON serialization
     result = data.to_dict(orient='records')
@@ -259,19 +806,42 @@ def get_user_data(user_id):
     """API endpoint to get data for a specific user"""
     days = int(request.args.get('days', 7))
     interval = int(request.args.get('interval', 60))
+    seed = int(request.args.get('seed', DEFAULT_SEED))
+    fmt = negotiate_format(request)
+    if fmt is None:
+        return _unsupported_format()
     
-    simulator = EnergyDataSimulator(num_users=20, days=days, interval_minutes=interval)
-    data = simulator.generate_data()
+    # Only the requested user is simulated, so latency does not depend on the fleet size
+    def simulate():
+        simulator = EnergyDataSimulator(num_users=20, days=days, interval_minutes=interval,
+                                        dtype=np.float64, seed=seed)
+        return simulator.generate_user_data(user_id)
     
-    user_data = data[data['user_id'] == user_id]
+    key = ('user', user_id, days, interval, seed, datetime.now().date())
+    user_data = simulation_cache.get_or_compute(key, simulate)
     
-    if user_data.empty:
+    if user_data is None:
         return jsonify({"status": "error", "message": f"No data found for user {user_id}"}), 404
+    if fmt != 'json':
+        return frame_response(user_data, fmt)
     
     # Convert to dictionary for JSON serialization
     result = user_data.to_dict(orient='records')
+    response = {"status": "success", "data": result}
     
-    return jsonify({"status": "success", "data": result})
+    if trade_ledger is not None:
+        # The user's most recent trades, each with a Merkle proof that can be checked without the chain
+        try:
+            limit = _count_arg(request, 'settlement_limit', 100)
+        except ValueError as e:
+            return jsonify({"status": "error", "message": str(e)}), 400
+        try:
+            response["settlement"] = trade_ledger.user_proofs(user_id, limit=limit)
+        except (OSError, ValueError) as e:
+            # The user's data is still served when the ledger cannot be read (e.g. no writer has created it yet)
+            app.logger.warning(f"Trade ledger unavailable, serving {user_id} without settlement: {e}")
+    
+    return jsonify(response)
 
 @app.route('/api/energy/summary', methods=['GET'])
 def get_energy_summary():
@@ -279,19 +849,22 @@ def get_energy_summary():
     num_users = int(request.args.get('users', 10))
     days = int(request.args.get('days', 7))
     interval = int(request.args.get('interval', 60))
+    seed = int(request.args.get('seed', DEFAULT_SEED))
     
-    simulator = EnergyDataSimulator(num_users=num_users, days=days, interval_minutes=interval)
-    data = simulator.generate_data()
+    # Fleet totals per timestamp, so the summary never touches row data
+    totals = _cached_totals(num_users, days, interval, seed)
     
     # Calculate summary statistics
-    total_consumption = data['consumption_kwh'].sum()
-    total_production = data['production_kwh'].sum()
-    total_grid_import = data['grid_import_kwh'].sum()
-    total_grid_export = data['grid_export_kwh'].sum()
+    total_consumption = totals['consumption_kwh'].sum()
+    total_production = totals['production_kwh'].sum()
+    total_grid_import = totals['grid_import_kwh'].sum()
+    total_grid_export = totals['grid_export_kwh'].sum()
     
-    # Calculate peak times
-    consumption_by_hour = data.groupby(data['timestamp'].dt.hour)['consumption_kwh'].mean()
-    production_by_hour = data.groupby(data['timestamp'].dt.hour)['production_kwh'].mean()
+    # Calculate peak times (every timestamp holds all users, so the hour with the
+    # highest mean total is the hour with the highest mean per user)
+    by_hour = totals.groupby(totals.index.hour).mean()
+    consumption_by_hour = by_hour['consumption_kwh']
+    production_by_hour = by_hour['production_kwh']
     
     peak_consumption_hour = consumption_by_hour.idxmax()
     peak_production_hour = production_by_hour.idxmax()
@@ -309,8 +882,56 @@ def get_energy_summary():
     
     return jsonify({"status": "success", "summary": summary})
 
+@app.route('/api/energy/rollup', methods=['GET'])
+def get_energy_rollup():
+    """API endpoint to get zoomed-out data from the rollup pyramid (fleet-wide or one user)"""
+    num_users = int(request.args.get('users', 10))
+    days = int(request.args.get('days', 7))
+    interval = int(request.args.get('interval', 60))
+    seed = int(request.args.get('seed', DEFAULT_SEED))
+    user_id = request.args.get('user_id')
+    fmt = negotiate_format(request)
+    if fmt is None:
+        return _unsupported_format()
+    
+    rollups = _cached_rollups(num_users, days, interval, seed)
+    if user_id is not None and user_id not in rollups.user_ids:
+        return jsonify({"status": "error", "message": f"No data found for user {user_id}"}), 404
+    
+    # The coarsest level that satisfies the requested resolution (or point budget) is read
+    resolution = request.args.get('resolution')
+    start, end = request.args.get('start'), request.args.get('end')
+    how = 'sum' if request.args.get('how') == 'sum' else 'mean'
+    try:
+        level = rollups.choose_level(resolution, request.args.get('max_points', type=int), start, end,
+                                     per_user=user_id is not None)
+        if level is None:
+            raise ValueError(f"No rollup level is as fine as {resolution}, use /api/energy/data for the raw rows")
+        data = rollups.to_frame(level, user_id, start, end, how=how).reset_index()
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    
+    if fmt != 'json':
+        response = frame_response(data, fmt)
+        response.headers['X-Rollup-Level'] = level
+        return response
+    return jsonify({"status": "success", "level": level, "data": data.to_dict(orient='records')})
+
+@app.route('/api/energy/cache', methods=['GET'])
+def get_cache_stats():
+    """API endpoint to get hit/miss counters of the simulation cache"""
+    return jsonify({"status": "success", "cache": simulation_cache.stats()})
+
 # Main execution
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Energy data simulator and API server")
+    parser.add_argument('--ledger', default=None,
+                        help="Trade ledger directory (written by the V5-V7 simulators) whose settlement "
+                             "proofs /api/energy/user/<user_id> attaches")
+    args = parser.parse_args()
+    if args.ledger is not None:
+        trade_ledger = TradeLedger.load(args.ledger)
+    
     # Example usage without running the server
     simulator = EnergyDataSimulator(num_users=15, days=7, interval_minutes=60)
     data = simulator.generate_data()
@@ -319,10 +940,10 @@ if __name__ == "__main__":
     simulator.save_to_csv(data)
     
     # Plot one user's data
-    simulator.plot_user_data("user_001")
+    simulator.plot_user_data("user_001", data)
     
     # Plot grid summary
-    simulator.plot_grid_summary()
+    simulator.plot_grid_summary(data)
     
     # Uncomment to run the Flask server
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -1,11 +1,18 @@
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
-from datetime import datetime, timedelta
+from datetime import datetime
 import random
+import re
 import json
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request, stream_with_context
 from flask_httpauth import HTTPBasicAuth
+from energy_cache import SimulationCache
+from energy_engine import (CONSUMPTION_PATTERNS, STREAM_BATTERY, STREAM_PROFILE, RunningTotals,
+                           allocate_measures, as_frame, build_block_frame, build_frame, iter_fleet, peak_memory,
+                           random_streams, simulate_fleet, simulate_sharded, sun_intensity)
+from energy_formats import NDJSON_MIMETYPE, available_formats, frame_response, ndjson_lines, negotiate_format
+from energy_profiles import ProfileTable
 
 # Flask app setup
 app = Flask(__name__, static_url_path='', static_folder='static')
@@ -15,6 +22,12 @@ users = {
     "admin": "password123"
 }
 
+LOCATIONS = ["Urban", "Suburban", "Rural"]
+
+# Simulation results shared by the API routes, keyed on the request parameters
+simulation_cache = SimulationCache(max_entries=32, max_bytes=256 * 2**20, ttl_seconds=300)
+DEFAULT_SEED = 42
+
 @auth.get_password
 def get_password(username):
     if username in users:
@@ -32,7 +45,7 @@ def index():
 
 # Energy Data Simulator Class
 class EnergyDataSimulator:
-    def __init__(self, num_users=10, days=1, interval_minutes=60):  # Changed days=1
+    def __init__(self, num_users=10, days=1, interval_minutes=60, dtype=np.float32, seed=None, workers=1):  # Changed days=1
         """
         Initialize the energy data simulator.
         
@@ -40,17 +53,84 @@ class EnergyDataSimulator:
         - num_users: Number of users in the simulation
         - days: Number of days to simulate (now fixed to 1 day)
         - interval_minutes: Data recording interval in minutes
+        - dtype: NumPy dtype of the energy measure columns
+        - seed: Master seed every user's random stream is derived from (random if None)
+        - workers: Number of processes generate_data splits the users across
         """
         self.num_users = num_users
         self.days = days  # Now fixed to 1 day
         self.interval_minutes = interval_minutes  # Keep 60 minutes interval
-        self.user_profiles = self._generate_user_profiles()
+        self.dtype = dtype
+        self.seed = seed if seed is not None else random.getrandbits(63)
+        self.workers = workers
+        self.peak_memory_bytes = None
+        self._user_profiles = None
+        self._profiles_key = None
+        self._data = None
+        self._data_key = None
+    
+    @property
+    def user_profiles(self):
+        """Profiles of all users, generated on first access and again when num_users or seed change"""
+        if self._user_profiles is None or self._profiles_key != (self.num_users, self.seed):
+            self.user_profiles = self._generate_user_profiles()
+        return self._user_profiles
+    
+    @user_profiles.setter
+    def user_profiles(self, profiles):
+        self._user_profiles = None if profiles is None else self._profile_table(profiles)
+        self._profiles_key = (self.num_users, self.seed)
+        self._data = None
+    
+    @property
+    def data(self):
+        """
+        Result of generate_data() for the current parameters.
+        
+        Computed on first access and reused afterwards; changing a simulation
+        parameter (or the profiles) invalidates it.
+        """
+        start_date = self._default_start_date()
+        if self._data is None or self._data_key != self._data_cache_key(start_date):
+            self.generate_data(start_date)
+        return self._data
+    
+    def _timestamps(self, start_date):
+        """Timestamps of the simulated hours"""
+        # Generate 24 hours of data (1 day)
+        total_intervals = 24  # Hardcoded for 24 hours
+        return pd.date_range(start_date, periods=total_intervals, freq='h')
+    
+    def _default_start_date(self):
+        return datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    
+    def _data_cache_key(self, start_date):
+        """Everything the full-fleet result depends on"""
+        return (self.num_users, np.dtype(self.dtype), self.seed, start_date)
+    
+    def get_user_profile(self, user_id):
+        """
+        Resolve the profile of a single user by id (None if the id is not in the fleet).
+        
+        Profiles are derived from each user's own random stream, so this gives the
+        same profile as the full fleet without generating the other users.
+        """
+        for profile in self._special_user_profiles():
+            if profile["user_id"] == user_id:
+                return profile
+        
+        match = re.fullmatch(r'user_(\d+)', user_id)
+        if match is None:
+            return None
+        number = int(match.group(1))
+        if user_id != f"user_{number:03d}" or not 4 <= number <= self.num_users + 1:
+            return None
+        return self._generate_user_profiles([number])[0]
     
-    def _generate_user_profiles(self):
-        """Generate different user profiles with varying energy characteristics"""
+    def _special_user_profiles(self):
+        """Specialized users that are part of every fleet"""
         profiles = []
 
-        # Add specialized users first
         profiles.append({
             "user_id": "user_001",
             "user_type": "Prosumer (Solar+Grid)",
@@ -77,6 +157,17 @@ class EnergyDataSimulator:
             "weather_sensitivity": 0.8
         })
         
+        return profiles
+    
+    def _generate_user_profiles(self, numbers=None):
+        """Generate different user profiles with varying energy characteristics (as a ProfileTable)"""
+        if numbers is None:
+            numbers = np.arange(4, self.num_users + 2)  # Start from 4 since the specialized users come first
+            # Add specialized users first, as explicit overrides ahead of the generated users
+            specials = ProfileTable.from_records(self._special_user_profiles(),
+                                                 {"consumption_pattern": CONSUMPTION_PATTERNS})
+            return ProfileTable.concat([specials, self._generate_user_profiles(numbers)])
+        
         # User types and their characteristics
         user_types = [
             {"type": "Residential Small", "base_consumption": 8, "solar_capacity": 3, "battery_capacity": 5},
@@ -87,127 +178,159 @@ class EnergyDataSimulator:
             {"type": "Large Business", "base_consumption": 150, "solar_capacity": 40, "battery_capacity": 80}
         ]
         
-        for i in range(3, self.num_users + 1):  # Start from 3 since we added two users manually
-            # Randomly assign a user type
-            user_type = random.choice(user_types)
-            
-            # Add some randomness to the profile
-            variation = random.uniform(0.8, 1.2)
-            
-            profile = {
-                "user_id": f"user_{i+1:03d}",
-                "user_type": user_type["type"],
-                "base_consumption": user_type["base_consumption"] * variation,
-                "solar_capacity": user_type["solar_capacity"] * variation,
-                "battery_capacity": user_type["battery_capacity"] * variation,
-                "consumption_pattern": random.choice(["Day Worker", "Night Worker", "Home Office", "Weekend Active"]),
-                "location": random.choice(["Urban", "Suburban", "Rural"]),
-                "weather_sensitivity": random.uniform(0.5, 1.5),
-                "can_sell": False
-            }
-            
-            profiles.append(profile)
-            
-        return profiles
+        # Each user's profile comes from its own random stream, so it only depends on the seed and its number
+        type_draw, variation_draw, pattern_draw, location_draw, sensitivity_draw = random_streams(
+            self.seed, STREAM_PROFILE, numbers, range(5))
+        
+        # Randomly assign a user type
+        user_type = (type_draw * len(user_types)).astype(np.int16)
+        
+        # Add some randomness to the profile
+        variation = 0.8 + 0.4 * variation_draw
+        
+        def characteristic(name):
+            return np.array([t[name] for t in user_types], dtype=float)[user_type] * variation
+        
+        return ProfileTable(numbers, {
+            "user_type": user_type,
+            "base_consumption": characteristic("base_consumption"),
+            "solar_capacity": characteristic("solar_capacity"),
+            "battery_capacity": characteristic("battery_capacity"),
+            "can_sell": np.zeros(len(user_type), dtype=bool),
+            "consumption_pattern": (pattern_draw * len(CONSUMPTION_PATTERNS)).astype(np.int16),
+            "location": (location_draw * len(LOCATIONS)).astype(np.int16),
+            "weather_sensitivity": 0.5 + sensitivity_draw
+        }, categories={
+            "user_type": [t["type"] for t in user_types],
+            "consumption_pattern": CONSUMPTION_PATTERNS,
+            "location": LOCATIONS
+        })
     
-    def _calculate_hourly_consumption(self, profile, hour):
-        """Calculate consumption for a specific hour"""
-        base = profile["base_consumption"]
-        pattern = profile["consumption_pattern"]
-        
-        # Time-based multipliers
-        if pattern == "Day Worker":
-            return base * (1.5 if 7 <= hour <= 19 else 0.8)
-        elif pattern == "Night Worker":
-            return base * (1.5 if hour < 6 or hour >= 20 else 0.8)
-        else:  # Home Office
-            return base * (1.2 if 9 <= hour <= 17 else 1.0)
-        
-    def _calculate_hourly_production(self, profile, hour):
-        """Calculate solar production for a specific hour"""
-        if 6 <= hour <= 18:
-            return profile["solar_capacity"] * np.sin(np.pi * (hour - 6) / 12)
-        return 0.0
-
-    def _calculate_energy_flows(self, net_energy, current_battery, battery_capacity):
-        """Calculate energy flows between battery and grid."""
-        if net_energy > 0:
-            energy_to_battery = min(net_energy, battery_capacity - current_battery)
-            current_battery += energy_to_battery
-            grid_export = net_energy - energy_to_battery
-            grid_import = 0
-        else:
-            energy_from_battery = min(abs(net_energy), current_battery)
-            current_battery -= energy_from_battery
-            grid_import = abs(net_energy) - energy_from_battery
-            grid_export = 0
-        
-        # Ensure battery level is within bounds
-        current_battery = max(0, min(current_battery, battery_capacity))
-        
-        return current_battery, grid_import, grid_export
-        
-    def _simulate_hourly_user_data(self, user_profile, timestamps):
-        """Simulate hourly energy data for a single user"""
-        data = {
-            'timestamp': timestamps,
-            'user_id': user_profile["user_id"],
-            'consumption_kwh': [],
-            'production_kwh': [],
-            'battery_level_kwh': [],
-            'grid_import_kwh': [],
-            'grid_export_kwh': []
-        }
-        
-        current_battery = user_profile["battery_capacity"] * random.uniform(0.2, 0.8)
-        
-        for hour in range(24):
-            # Simplified hourly simulation (customize as needed)
-            consumption = self._calculate_hourly_consumption(user_profile, hour)
-            production = self._calculate_hourly_production(user_profile, hour)
+    def _profile_table(self, profiles):
+        """Profiles as a ProfileTable: the fleet's for None, lists of profile dicts are converted"""
+        if profiles is None:
+            return self.user_profiles
+        if isinstance(profiles, ProfileTable):
+            return profiles
+        return ProfileTable.from_records(profiles, {"consumption_pattern": CONSUMPTION_PATTERNS})
+    
+    def _pattern_factors(self, hours):
+        """Hourly consumption multipliers for every consumption pattern, shape (patterns, hours)"""
+        home_office = np.where((9 <= hours) & (hours <= 17), 1.2, 1.0)
+        return np.vstack([
+            np.where((7 <= hours) & (hours <= 19), 1.5, 0.8),    # Day Worker
+            np.where((hours < 6) | (hours >= 20), 1.5, 0.8),     # Night Worker
+            home_office,                                         # Home Office
+            home_office                                          # Weekend Active (same as Home Office)
+        ])
+        
+    def _simulate_hourly_users(self, profiles, hours, out=None):
+        """Simulate hourly energy data for a group of users with the vectorized engine"""
+        return simulate_fleet(*self._fleet_model(profiles, hours), len(hours), out=out, decimals=2)
+    
+    def _fleet_model(self, profiles, hours):
+        """Engine inputs for a group of users: (energy_block, battery_capacity, initial_battery)"""
+        keys = profiles.user_numbers.astype(np.uint64)
+        base_consumption = profiles.column("base_consumption", float)
+        solar_capacity = profiles.column("solar_capacity", float)
+        battery_capacity = profiles.column("battery_capacity", float)
+        pattern = profiles.codes("consumption_pattern", CONSUMPTION_PATTERNS)
+        
+        pattern_factors = self._pattern_factors(hours)
+        sun = sun_intensity(hours)
+        initial_battery = battery_capacity * (0.2 + 0.6 * random_streams(self.seed, STREAM_BATTERY, keys, [0])[0])
+        
+        def energy_block(start, stop):
+            consumption = base_consumption * pattern_factors[pattern, start:stop].T
+            production = solar_capacity * sun[start:stop, None]
+            return consumption, production
+        
+        return energy_block, battery_capacity, initial_battery
+        
+    def generate_data(self, start_date=None, report_memory=False, profiles=None):
+        """
+        Generate energy data for all users (or only the given profiles).
+        
+        The result is assembled once into preallocated columns (categorical
+        user_id, measures of the configured dtype). With report_memory the
+        peak memory of the run is printed and kept in self.peak_memory_bytes.
+        """
+        profiles = self._profile_table(profiles)
+        if start_date is None:
+            start_date = self._default_start_date()
             
-            # Battery and grid calculations
-            net_energy = production - consumption
-            current_battery, grid_import, grid_export = self._calculate_energy_flows(
-                net_energy, current_battery, user_profile["battery_capacity"]
-            )
+        with peak_memory(enabled=report_memory) as usage:
+            timestamps = self._timestamps(start_date)
+            total_intervals = len(timestamps)
             
-            # Append values
-            data['consumption_kwh'].append(round(consumption, 2))
-            data['production_kwh'].append(round(production, 2))
-            data['battery_level_kwh'].append(round(current_battery, 2))
-            data['grid_import_kwh'].append(round(grid_import, 2))
-            data['grid_export_kwh'].append(round(grid_export, 2))
+            # Users are independent, so they can be split across processes without changing the result
+            columns = allocate_measures(len(profiles), total_intervals, self.dtype)
+            simulate_sharded(_simulate_shard, profiles, (np.arange(total_intervals), self.seed, self.dtype),
+                             columns, total_intervals, workers=self.workers)
+            data = build_frame(timestamps, {'user_id': profiles.categorical('user_id')}, columns)
+        
+        if report_memory:
+            self.peak_memory_bytes = usage['peak_bytes']
+            print(f"Peak memory: {usage['peak_bytes'] / 2**20:.1f} MB")
+        
+        # Keep full-fleet results so plots reuse them instead of simulating again
+        if profiles is self._user_profiles:
+            self._data, self._data_key = data, self._data_cache_key(start_date)
         
-        return pd.DataFrame(data)
+        return data
+    
+    def iter_chunks(self, start_date=None, block_intervals=24, profiles=None):
+        """
+        Generate energy data one block of hours at a time.
         
-    def generate_data(self, start_date=None):
-        """Generate energy data for all users"""
+        Yields one DataFrame per block holding every user for those hours,
+        ordered by time, so memory is bounded by the block size.
+        """
+        profiles = self._profile_table(profiles)
         if start_date is None:
-            # Start at midnight of current day
-            start_date = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-            
-        # Generate 24 hours of data (1 day)
-        total_intervals = 24  # Hardcoded for 24 hours
-        timestamps = [start_date + timedelta(hours=i) for i in range(24)]
+            start_date = self._default_start_date()
         
-        all_user_data = []
+        timestamps = self._timestamps(start_date)
+        labels = {'user_id': profiles.categorical('user_id')}
+        blocks = iter_fleet(*self._fleet_model(profiles, np.arange(len(timestamps))), len(timestamps),
+                            block_intervals=block_intervals, decimals=2)
+        for start, stop, block in blocks:
+            yield build_block_frame(timestamps[start:stop], labels, block, self.dtype)
+    
+    def generate_totals(self, start_date=None, profiles=None, block_intervals=96):
+        """
+        Fleet totals of every measure per timestamp, without materializing any rows.
         
-        for profile in self.user_profiles:
-            user_df = self._simulate_hourly_user_data(profile, timestamps)
-            all_user_data.append(user_df)
+        The engine sums each block over the users while it simulates, so memory is
+        bounded by the block size and the result has one row per timestamp.
+        """
+        profiles = self._profile_table(profiles)
+        if start_date is None:
+            start_date = self._default_start_date()
         
-        return pd.concat(all_user_data, ignore_index=True)
+        timestamps = self._timestamps(start_date)
+        totals = RunningTotals(len(timestamps))
+        blocks = iter_fleet(*self._fleet_model(profiles, np.arange(len(timestamps))), len(timestamps),
+                            block_intervals=block_intervals, decimals=2)
+        for start, stop, block in blocks:
+            totals.add(start, stop, block)
+        return totals.to_frame(timestamps)
+    
+    def generate_user_data(self, user_id, start_date=None):
+        """Generate energy data for a single user, simulating only that user (None if unknown)"""
+        profile = self.get_user_profile(user_id)
+        if profile is None:
+            return None
+        return self.generate_data(start_date, profiles=[profile])
     
     def save_to_csv(self, dataframe, filename="energy_data_simulation.csv"):
         """Save the simulated data to a CSV file"""
         dataframe.to_csv(filename, index=False)
         print(f"Data saved to {filename}")
         
-    def plot_user_data(self, user_id):
-        """Plot energy data for a specific user"""
-        # Generate data first if not already done
-        data = self.generate_data()
+    def plot_user_data(self, user_id, data=None):
+        """Plot energy data for a specific user (from data if given, else the simulator's cached result)"""
+        data = self.data if data is None else as_frame(data)
         user_data = data[data['user_id'] == user_id]
         
         if user_data.empty:
@@ -239,10 +362,9 @@ class EnergyDataSimulator:
         plt.tight_layout()
         plt.show()
         
-    def plot_grid_summary(self):
-        """Plot summary of grid import/export across all users"""
-        # Generate data first if not already done
-        data = self.generate_data()
+    def plot_grid_summary(self, data=None):
+        """Plot summary of grid import/export across all users (from data if given, else the cached result)"""
+        data = self.data if data is None else as_frame(data)
         
         # Aggregate by timestamp
         grid_summary = data.groupby('timestamp').agg({
@@ -269,17 +391,60 @@ class EnergyDataSimulator:
         plt.tight_layout()
         plt.show()
 
+def _simulate_shard(profiles, hours, seed, dtype, out=None):
+    """Process pool entry point: simulate one shard of users"""
+    simulator = EnergyDataSimulator(num_users=0, dtype=dtype, seed=seed)
+    if out is None:
+        out = allocate_measures(len(profiles), len(hours), dtype)
+    return simulator._simulate_hourly_users(profiles, hours, out=out)
+
+def _cached_simulation(num_users, seed):
+    """Simulated data for the API parameters, only re-simulated on a cache miss"""
+    # Days and interval are fixed in this version; the simulated day moves with the calendar
+    key = (num_users, seed, datetime.now().date())
+    
+    def simulate():
+        # float64 measures keep the JSON values exactly as rounded
+        return EnergyDataSimulator(num_users=num_users, dtype=np.float64, seed=seed).generate_data()
+    
+    return simulation_cache.get_or_compute(key, simulate)
+
+def _cached_totals(num_users, seed):
+    """Fleet totals per hour for the API parameters, only re-simulated on a cache miss"""
+    key = ('totals', num_users, seed, datetime.now().date())
+    
+    def simulate():
+        return EnergyDataSimulator(num_users=num_users, seed=seed).generate_totals()
+    
+    return simulation_cache.get_or_compute(key, simulate)
+
+def _unsupported_format():
+    """406 response for a ?format= this server cannot produce"""
+    return jsonify({"error": f"Unsupported format, expected one of: {', '.join(available_formats())}"}), 406
+
 # Flask API routes
 @app.route('/api/energy/data', methods=['GET'])
 @auth.login_required
 def get_energy_data():
     """API endpoint to get hourly data for current day"""
     num_users = int(request.args.get('users', 10))
-    simulator = EnergyDataSimulator(num_users=num_users)
-    data = simulator.generate_data()
+    seed = int(request.args.get('seed', DEFAULT_SEED))
+    fmt = negotiate_format(request)
+    if fmt is None:
+        return _unsupported_format()
     
-    # Convert timestamps to string for JSON serialization
-    data['timestamp'] = data['timestamp'].astype(str)
+    if fmt == 'ndjson':
+        # Stream rows as the simulation produces them instead of building the whole response
+        simulator = EnergyDataSimulator(num_users=num_users, dtype=np.float64, seed=seed)
+        chunks = simulator.iter_chunks(block_intervals=1)
+        return Response(stream_with_context(ndjson_lines(chunks)), mimetype=NDJSON_MIMETYPE)
+    
+    data = _cached_simulation(num_users, seed)
+    if fmt != 'json':
+        return frame_response(data, fmt)
+    
+    # Convert timestamps to string for JSON serialization (the cached frame is left untouched)
+    data = data.assign(timestamp=data['timestamp'].astype(str))
     
     return jsonify(data.to_dict(orient='records'))
 
@@ -288,15 +453,26 @@ def get_energy_data():
 def get_user_data(user_id):
     """API endpoint to get data for a specific user"""
     num_users = int(request.args.get('users', 10))
-    simulator = EnergyDataSimulator(num_users=num_users)
-    data = simulator.generate_data()
-    user_data = data[data['user_id'] == user_id]
+    seed = int(request.args.get('seed', DEFAULT_SEED))
+    fmt = negotiate_format(request)
+    if fmt is None:
+        return _unsupported_format()
     
-    if user_data.empty:
+    # Only the requested user is simulated, so latency does not depend on the fleet size
+    def simulate():
+        simulator = EnergyDataSimulator(num_users=num_users, dtype=np.float64, seed=seed)
+        return simulator.generate_user_data(user_id)
+    
+    key = ('user', user_id, num_users, seed, datetime.now().date())
+    user_data = simulation_cache.get_or_compute(key, simulate)
+    
+    if user_data is None:
         return jsonify({"error": f"No data found for user {user_id}"}), 404
+    if fmt != 'json':
+        return frame_response(user_data, fmt)
     
     # Convert timestamps to string for JSON serialization
-    user_data['timestamp'] = user_data['timestamp'].astype(str)
+    user_data = user_data.assign(timestamp=user_data['timestamp'].astype(str))
     
     return jsonify(user_data.to_dict(orient='records'))
 
@@ -305,21 +481,27 @@ def get_user_data(user_id):
 def get_grid_summary():
     """API endpoint to get grid summary data"""
     num_users = int(request.args.get('users', 10))
-    simulator = EnergyDataSimulator(num_users=num_users)
-    data = simulator.generate_data()
+    seed = int(request.args.get('seed', DEFAULT_SEED))
+    fmt = negotiate_format(request)
+    if fmt is None:
+        return _unsupported_format()
     
-    # Aggregate by timestamp
-    grid_summary = data.groupby('timestamp').agg({
-        'grid_import_kwh': 'sum',
-        'grid_export_kwh': 'sum',
-        'consumption_kwh': 'sum',
-        'production_kwh': 'sum'
-    }).reset_index()
+    # Totals per timestamp are kept while simulating, so no row data is built
+    totals = _cached_totals(num_users, seed)
+    grid_summary = totals[['grid_import_kwh', 'grid_export_kwh', 'consumption_kwh', 'production_kwh']].reset_index()
+    if fmt != 'json':
+        return frame_response(grid_summary, fmt)
     
     # Convert timestamps to string for JSON serialization
     grid_summary['timestamp'] = grid_summary['timestamp'].astype(str)
     
     return jsonify(grid_summary.to_dict(orient='records'))
 
+@app.route('/api/energy/cache', methods=['GET'])
+@auth.login_required
+def get_cache_stats():
+    """API endpoint to get hit/miss counters of the simulation cache"""
+    return jsonify(simulation_cache.stats())
+
 if __name__ == "__main__":
     app.run(debug=True)
@@ -1,22 +1,31 @@
-import time
+import threading
 import random
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
 import matplotlib.pyplot as plt
+from energy_dashboard import LiveDashboard
+from energy_clock import clock_from_args
+from energy_market import OrderBook
 
 # Set interactive mode on
 plt.ion()
 
 # Constants
 SOLAR_HOURS = range(6, 19)
-SIMULATION_INTERVAL = 2  # Seconds per hour (demo)
+SIMULATION_INTERVAL = 2  # Seconds per hour (demo), the default accelerated pacing
 TOTAL_HOURS = 24
+FRAME_RATE = 10  # Dashboard frames per second, independent of the simulation speed
+
+# Pacing of the simulated hours: --clock realtime|accelerated|fast and --speedup N
+clock = clock_from_args(speedup=3600 / SIMULATION_INTERVAL,
+                        description="Live simulation of two users trading energy")
 
 # User data
 users = {
     "user_1": {
         "can_sell": True,
+        "max_price": 0.12,  # Lowest price per kWh user 1 sells at ($)
         "has_solar": True,
         "battery": 5,
         "battery_capacity": 10,
@@ -24,96 +33,99 @@ users = {
     },
     "user_2": {
         "can_sell": False,
+        "max_purchase_price": 0.15,  # Highest price per kWh user 2 pays ($)
         "has_solar": False,
         "battery": 0,
         "battery_capacity": 0,
     }
 }
 
-# Data storage for plotting
-hours = []
-u1_consumption, u1_production, u1_battery, u1_sold = [], [], [], []
-u2_consumption, u2_from_user1, u2_from_grid = [], [], []
+# Data storage for plotting, appended by the simulation thread and read by the dashboard
+history = {name: [] for name in ["hour", "u1_consumption", "u1_production", "u1_battery", "u1_sold",
+                                 "u2_consumption", "u2_from_user1", "u2_from_grid"]}
+history_lock = threading.Lock()
+
+# Dashboard layout: artists are created once from this and updated in place
+PANELS = [
+    {"title": "User 1 - Energy Overview", "xlabel": "Hour", "ylabel": "kWh", "lines": [
+        ("u1_consumption", 'r-', "User 1 - Consumption"),
+        ("u1_production", 'g-', "User 1 - Production"),
+        ("u1_battery", 'b-', "User 1 - Battery Level")
+    ]},
+    {"title": "User 2 - Energy Sources", "xlabel": "Hour", "ylabel": "kWh", "lines": [
+        ("u2_consumption", 'k-', "User 2 - Consumption"),
+        ("u2_from_user1", 'c-', "User 2 - From User 1"),
+        ("u2_from_grid", 'm-', "User 2 - From Grid")
+    ]}
+]
 
 # Simulation loop
-start_time = datetime.now().replace(minute=0, second=0, microsecond=0)
-
-for hour in range(TOTAL_HOURS):
-    now = start_time + timedelta(hours=hour)
-    hour_label = now.strftime("%H:%M")
-    hour_of_day = now.hour
-    print(f"⏳ Hour {hour_label}")
-
-    # --- User 1 ---
-    user1 = users["user_1"]
-    c1 = random.uniform(2.0, 4.0)
-    p1 = random.uniform(2.0, 5.0) if hour_of_day in SOLAR_HOURS else 0
-    net1 = p1 - c1
-
-    if net1 > 0:
-        space = user1["battery_capacity"] - user1["battery"]
-        to_battery = min(space, net1)
-        user1["battery"] += to_battery
-        to_sell = net1 - to_battery
-    else:
-        need = abs(net1)
-        from_battery = min(need, user1["battery"])
-        user1["battery"] -= from_battery
-        from_grid = need - from_battery
-        to_sell = 0
-
-    # --- User 2 ---
-    c2 = random.uniform(2.0, 4.0)
-    if to_sell >= c2:
-        from_user1 = c2
-        from_grid2 = 0
-        to_sell -= c2
-    else:
-        from_user1 = to_sell
+def run_simulation():
+    """Simulate TOTAL_HOURS hours, appending each one to history (runs in its own thread)"""
+    start_time = datetime.now().replace(minute=0, second=0, microsecond=0)
+
+    clock.start()
+    for hour in range(TOTAL_HOURS):
+        now = start_time + timedelta(hours=hour)
+        hour_label = now.strftime("%H:%M")
+        hour_of_day = now.hour
+        print(f"⏳ Hour {hour_label}")
+
+        # --- User 1 ---
+        user1 = users["user_1"]
+        c1 = random.uniform(2.0, 4.0)
+        p1 = random.uniform(2.0, 5.0) if hour_of_day in SOLAR_HOURS else 0
+        net1 = p1 - c1
+
+        if net1 > 0:
+            space = user1["battery_capacity"] - user1["battery"]
+            to_battery = min(space, net1)
+            user1["battery"] += to_battery
+            to_sell = net1 - to_battery
+        else:
+            need = abs(net1)
+            from_battery = min(need, user1["battery"])
+            user1["battery"] -= from_battery
+            from_grid = need - from_battery
+            to_sell = 0
+
+        # --- User 2 ---
+        c2 = random.uniform(2.0, 4.0)
+        # P2P market: user 1's surplus against user 2's demand, cleared by the order book
+        book = OrderBook()
+        book.add_asks(["user_1"], [to_sell], [users["user_1"]["max_price"]])
+        book.add_bids(["user_2"], [c2], [users["user_2"]["max_purchase_price"]])
+        from_user1 = book.clear()["quantity_kwh"].sum()
         from_grid2 = c2 - from_user1
-        to_sell = 0
-
-    # Append data for plotting
-    hours.append(hour)
-    u1_consumption.append(c1)
-    u1_production.append(p1)
-    u1_battery.append(user1["battery"])
-    u1_sold.append(to_sell)
-
-    u2_consumption.append(c2)
-    u2_from_user1.append(from_user1)
-    u2_from_grid.append(from_grid2)
-
-    # --- Plotting ---
-    plt.figure(1, figsize=(12, 8))
-    plt.clf()
-
-    # Subplot 1: User 1
-    plt.subplot(2, 1, 1)
-    plt.plot(hours, u1_consumption, 'r-', label="User 1 - Consumption")
-    plt.plot(hours, u1_production, 'g-', label="User 1 - Production")
-    plt.plot(hours, u1_battery, 'b-', label="User 1 - Battery Level")
-    plt.title("User 1 - Energy Overview")
-    plt.xlabel("Hour")
-    plt.ylabel("kWh")
-    plt.legend()
-    plt.grid(True)
-
-    # Subplot 2: User 2
-    plt.subplot(2, 1, 2)
-    plt.plot(hours, u2_consumption, 'k-', label="User 2 - Consumption")
-    plt.plot(hours, u2_from_user1, 'c-', label="User 2 - From User 1")
-    plt.plot(hours, u2_from_grid, 'm-', label="User 2 - From Grid")
-    plt.title("User 2 - Energy Sources")
-    plt.xlabel("Hour")
-    plt.ylabel("kWh")
-    plt.legend()
-    plt.grid(True)
-
-    plt.tight_layout()
-    plt.pause(0.1)  # Live update
-
-    time.sleep(SIMULATION_INTERVAL)
+        to_sell -= from_user1
+
+        # Append data for plotting
+        with history_lock:
+            history["hour"].append(hour)
+            history["u1_consumption"].append(c1)
+            history["u1_production"].append(p1)
+            history["u1_battery"].append(user1["battery"])
+            history["u1_sold"].append(to_sell)
+
+            history["u2_consumption"].append(c2)
+            history["u2_from_user1"].append(from_user1)
+            history["u2_from_grid"].append(from_grid2)
+
+        clock.tick()
+
+def snapshot():
+    """Copy of the history for one dashboard frame"""
+    with history_lock:
+        return {name: list(values) for name, values in history.items()}
+
+# --- Plotting ---
+# The simulation runs in its own thread, so rendering never slows it down; the
+# dashboard redraws only the lines (blitting) at a fixed frame rate
+simulation = threading.Thread(target=run_simulation, daemon=True)
+dashboard = LiveDashboard(PANELS, x="hour", fps=FRAME_RATE, xlim=(0, TOTAL_HOURS - 1))
+simulation.start()
+dashboard.run(snapshot, finished=lambda: not simulation.is_alive())
+dashboard.finish()
 
 plt.ioff()
 plt.show()
@@ -1,19 +1,25 @@
-import time
 import random
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
 import matplotlib.pyplot as plt
+from energy_clock import clock_from_args
+from energy_market import OrderBook
 
 # Constants
 SOLAR_HOURS = range(6, 19)
-SIMULATION_INTERVAL = 1  # Seconds per simulated hour
+SIMULATION_INTERVAL = 1  # Seconds per simulated hour, the default accelerated pacing
 TOTAL_HOURS = 24
 
+# Pacing of the simulated hours: --clock realtime|accelerated|fast and --speedup N
+clock = clock_from_args(speedup=3600 / SIMULATION_INTERVAL,
+                        description="Simulation of two users trading energy over a day")
+
 # User data
 users = {
     "user_1": {
         "can_sell": True,
+        "max_price": 0.12,  # Lowest price per kWh user 1 sells at ($)
         "has_solar": True,
         "battery": 5,
         "battery_capacity": 10,
@@ -21,6 +27,7 @@ users = {
     },
     "user_2": {
         "can_sell": False,
+        "max_purchase_price": 0.15,  # Highest price per kWh user 2 pays ($)
         "has_solar": False,
         "battery": 0,
         "battery_capacity": 0,
@@ -35,6 +42,7 @@ u2_consumption, u2_from_user1, u2_from_grid = [], [], []
 # Simulation loop
 start_time = datetime.now().replace(minute=0, second=0, microsecond=0)
 
+clock.start()
 for hour in range(TOTAL_HOURS):
     now = start_time + timedelta(hours=hour)
     hour_label = now.strftime("%H:%M")
@@ -61,14 +69,13 @@ for hour in range(TOTAL_HOURS):
 
     # --- User 2 ---
     c2 = random.uniform(2.0, 4.0)
-    if to_sell >= c2:
-        from_user1 = c2
-        from_grid2 = 0
-        to_sell -= c2
-    else:
-        from_user1 = to_sell
-        from_grid2 = c2 - from_user1
-        to_sell = 0
+    # P2P market: user 1's surplus against user 2's demand, cleared by the order book
+    book = OrderBook()
+    book.add_asks(["user_1"], [to_sell], [users["user_1"]["max_price"]])
+    book.add_bids(["user_2"], [c2], [users["user_2"]["max_purchase_price"]])
+    from_user1 = book.clear()["quantity_kwh"].sum()
+    from_grid2 = c2 - from_user1
+    to_sell -= from_user1
 
     # Append data
     hours.append(hour)
@@ -81,7 +88,7 @@ for hour in range(TOTAL_HOURS):
     u2_from_user1.append(from_user1)
     u2_from_grid.append(from_grid2)
 
-    time.sleep(SIMULATION_INTERVAL)
+    clock.tick()
 
 # ---------------------------------------------
 # ✅ Plotting after full day simulation
@@ -1,7 +1,10 @@
-import requests
-import time
+import argparse
 from datetime import datetime, timedelta
 import matplotlib.pyplot as plt
+from energy_clock import SimulationClock, add_clock_arguments
+from energy_ledger import add_ledger_arguments, ledger_from_args
+from energy_market import OrderBook
+from energy_weather import add_weather_arguments, weather_from_args
 import random
 
 # -----------------------
@@ -12,22 +15,34 @@ LAT = '26.9124'  # Jaipur latitude
 LON = '75.7873'  # Jaipur longitude
 SEASON = 'Summer'  # Options: Summer, Winter, Monsoon
 SIM_HOURS = 24
-SIM_INTERVAL = 1  # seconds per simulated hour
+SIM_INTERVAL = 1  # seconds per simulated hour, the default accelerated pacing
+
+# Pacing of the simulated hours (--clock, --speedup), the forecast source (--weather*)
+# and the trade ledger (--ledger, --block-*)
+parser = argparse.ArgumentParser(description="Weather-driven simulation of two users trading energy")
+add_clock_arguments(parser, speedup=3600 / SIM_INTERVAL)
+add_weather_arguments(parser)
+add_ledger_arguments(parser)
+args = parser.parse_args()
+clock = SimulationClock(args.clock, args.speedup)
+ledger = ledger_from_args(args)
 
 # -----------------------
 # USER SETUP
 # -----------------------
 users = {
-    "user_1": {
+    "user_001": {
         "can_sell": True,
+        "max_price": 0.12,  # Lowest price per kWh user 1 sells at ($)
         "has_solar": True,
         "battery": 5,
         "battery_capacity": 10,
         "solar_capacity": 5,
         "user_type": "Home Office"
     },
-    "user_2": {
+    "user_002": {
         "can_sell": False,
+        "max_purchase_price": 0.15,  # Highest price per kWh user 2 pays ($)
         "has_solar": False,
         "battery": 0,
         "battery_capacity": 0,
@@ -38,33 +53,8 @@ users = {
 # -----------------------
 # WEATHER FUNCTION
 # -----------------------
-# def get_weather_data():
-#     url = f'https://api.openweathermap.org/data/2.5/forecast?lat={LAT}&lon={LON}&appid={API_KEY}'
-#     response = requests.get(url)
-#     if response.status_code != 200:
-#         raise Exception("Weather API failed.")
-#     data = response.json()
-#     forecast = {}
-#     for item in data['list']:
-#         hour = datetime.utcfromtimestamp(item['dt']).hour
-#         cloud_pct = item['clouds']['all']
-#         forecast[hour] = cloud_pct
-#     return forecast
-def get_weather_data():
-    url = f'https://api.openweathermap.org/data/2.5/forecast?lat={LAT}&lon={LON}&appid={API_KEY}'
-    response = requests.get(url)
-    print("Status Code:", response.status_code)
-    print("Response:", response.text[:500])  # Print preview of JSON or error
-    if response.status_code != 200:
-        raise Exception("Weather API failed.")
-    data = response.json()
-    forecast = {}
-    for item in data['list']:
-        hour = datetime.utcfromtimestamp(item['dt']).hour
-        cloud_pct = item['clouds']['all']
-        forecast[hour] = cloud_pct
-    return forecast
-weather_forecast = get_weather_data()
+# Cached forecast (or the fallback) right away; a fresh one is fetched in the background
+weather_forecast = weather_from_args(args, LAT, LON, API_KEY)
 
 # -----------------------
 # SEASONAL + TIME PATTERN
@@ -115,13 +105,14 @@ start_time = datetime.now().replace(minute=0, second=0, microsecond=0)
 # -----------------------
 # SIMULATION LOOP
 # -----------------------
+clock.start()
 for hour in range(SIM_HOURS):
     now = start_time + timedelta(hours=hour)
     hr = now.hour
     print(f"⏳ Simulating Hour: {hr}:00")
 
     # --- USER 1 ---
-    u1 = users['user_1']
+    u1 = users['user_001']
     base_c1 = random.uniform(2.0, 3.5)
     f1 = get_hour_factor(hr, SEASON, u1['user_type'])
     c1 = base_c1 * f1
@@ -141,19 +132,20 @@ for hour in range(SIM_HOURS):
         to_sell = 0
 
     # --- USER 2 ---
-    u2 = users['user_2']
+    u2 = users['user_002']
     base_c2 = random.uniform(2.0, 3.5)
     f2 = get_hour_factor(hr, SEASON, u2['user_type'])
     c2 = base_c2 * f2
 
-    if to_sell >= c2:
-        from_user1 = c2
-        from_grid2 = 0
-        to_sell -= c2
-    else:
-        from_user1 = to_sell
-        from_grid2 = c2 - from_user1
-        to_sell = 0
+    # P2P market: user 1's surplus against user 2's demand, cleared by the order book
+    book = OrderBook()
+    book.add_asks(["user_001"], [to_sell], [users["user_001"]["max_price"]])
+    book.add_bids(["user_002"], [c2], [users["user_002"]["max_purchase_price"]])
+    trades = book.clear(timestamp=start_time + timedelta(hours=hour))
+    ledger.append(trades)
+    from_user1 = trades["quantity_kwh"].sum()
+    from_grid2 = c2 - from_user1
+    to_sell -= from_user1
 
     # --- LOG DATA ---
     hours.append(hr)
@@ -166,7 +158,7 @@ for hour in range(SIM_HOURS):
     u2_from_user1.append(round(from_user1, 2))
     u2_from_grid.append(round(from_grid2, 2))
 
-    time.sleep(SIM_INTERVAL)
+    clock.tick()
 
 # -----------------------
 # PLOTTING
@@ -196,4 +188,7 @@ plt.tight_layout()
 plt.savefig("realistic_energy_simulation.png")
 plt.show()
 
+# Seal the last trades and report the chain
+ledger.close()
+print(f"🔗 {len(ledger)} trades recorded in {len(ledger.blocks)} ledger blocks (head {ledger.head.hex()[:16]})")
 print("✅ Simulation completed. Graph saved as 'realistic_energy_simulation.png'.")
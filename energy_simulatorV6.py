@@ -1,7 +1,10 @@
-import requests
-import time
+import argparse
 from datetime import datetime, timedelta
 import matplotlib.pyplot as plt
+from energy_clock import SimulationClock, add_clock_arguments
+from energy_ledger import add_ledger_arguments, ledger_from_args
+from energy_market import OrderBook
+from energy_weather import add_weather_arguments, weather_from_args
 import random
 from math import sin, pi
 
@@ -13,41 +16,40 @@ LAT = '26.9124'  # Jaipur latitude
 LON = '75.7873'  # Jaipur longitude
 SEASON = 'Summer'  # Options: Summer, Winter, Monsoon
 SIM_HOURS = 24
-SIM_INTERVAL = 1  # seconds per simulated hour
+SIM_INTERVAL = 1  # seconds per simulated hour, the default accelerated pacing
+
+# Pacing of the simulated hours (--clock, --speedup), the forecast source (--weather*)
+# and the trade ledger (--ledger, --block-*)
+parser = argparse.ArgumentParser(description="Weather-driven simulation of two users trading energy")
+add_clock_arguments(parser, speedup=3600 / SIM_INTERVAL)
+add_weather_arguments(parser)
+add_ledger_arguments(parser)
+args = parser.parse_args()
+clock = SimulationClock(args.clock, args.speedup)
+ledger = ledger_from_args(args)
 
 # -----------------------------------
 # WEATHER DATA
 # -----------------------------------
-def get_weather_data():
-    url = f'https://api.openweathermap.org/data/2.5/forecast?lat={LAT}&lon={LON}&appid={API_KEY}'
-    res = requests.get(url)
-    if res.status_code != 200:
-        print("Weather API failed.")
-        return {hour: 50 for hour in range(24)}  # Default 50% cloud if API fails
-    data = res.json()
-    forecast = {}
-    for item in data['list']:
-        hour = datetime.utcfromtimestamp(item['dt']).hour
-        cloud_pct = item['clouds']['all']
-        forecast[hour] = cloud_pct
-    return forecast
-
-weather_forecast = get_weather_data()
+# Cached forecast (or the fallback) right away; a fresh one is fetched in the background
+weather_forecast = weather_from_args(args, LAT, LON, API_KEY)
 
 # -----------------------------------
 # USER PROFILES
 # -----------------------------------
 users = {
-    "user_1": {
+    "user_001": {
         "can_sell": True,
+        "max_price": 0.12,  # Lowest price per kWh user 1 sells at ($)
         "has_solar": True,
         "battery": 5,
         "battery_capacity": 10,
         "solar_capacity": 5,
         "user_type": "Home Office"
     },
-    "user_2": {
+    "user_002": {
         "can_sell": False,
+        "max_purchase_price": 0.15,  # Highest price per kWh user 2 pays ($)
         "has_solar": False,
         "battery": 0,
         "battery_capacity": 0,
@@ -93,12 +95,13 @@ u2_consumption, u2_from_user1, u2_from_grid = [], [], []
 
 start_time = datetime.now().replace(minute=0, second=0, microsecond=0)
 
+clock.start()
 for hour in range(SIM_HOURS):
     hr = (start_time + timedelta(hours=hour)).hour
     print(f"⏳ Hour {hr}:00")
 
     # --- USER 1 ---
-    u1 = users["user_1"]
+    u1 = users["user_001"]
     c1 = random.uniform(2.0, 3.5) * get_hour_factor(hr, SEASON, u1['user_type'])
     p1 = get_solar_production(hr, u1['solar_capacity'])
     net1 = p1 - c1
@@ -118,17 +121,18 @@ for hour in range(SIM_HOURS):
         from_grid = need - from_batt
 
     # --- USER 2 ---
-    u2 = users["user_2"]
+    u2 = users["user_002"]
     c2 = random.uniform(2.0, 3.5) * get_hour_factor(hr, SEASON, u2['user_type'])
 
-    if to_sell >= c2:
-        from_user1 = c2
-        from_grid2 = 0
-        to_sell -= c2
-    else:
-        from_user1 = to_sell
-        from_grid2 = c2 - from_user1
-        to_sell = 0
+    # P2P market: user 1's surplus against user 2's demand, cleared by the order book
+    book = OrderBook()
+    book.add_asks(["user_001"], [to_sell], [users["user_001"]["max_price"]])
+    book.add_bids(["user_002"], [c2], [users["user_002"]["max_purchase_price"]])
+    trades = book.clear(timestamp=start_time + timedelta(hours=hour))
+    ledger.append(trades)
+    from_user1 = trades["quantity_kwh"].sum()
+    from_grid2 = c2 - from_user1
+    to_sell -= from_user1
 
     # --- LOGGING ---
     hours.append(hr)
@@ -141,7 +145,7 @@ for hour in range(SIM_HOURS):
     u2_from_user1.append(round(from_user1, 2))
     u2_from_grid.append(round(from_grid2, 2))
 
-    time.sleep(SIM_INTERVAL)
+    clock.tick()
 
 # -----------------------------------
 # PLOTTING
@@ -177,4 +181,7 @@ plt.tight_layout()
 plt.savefig("realistic_energy_simulation.png")
 plt.show()
 
+# Seal the last trades and report the chain
+ledger.close()
+print(f"🔗 {len(ledger)} trades recorded in {len(ledger.blocks)} ledger blocks (head {ledger.head.hex()[:16]})")
 print("✅ Simulation complete. Graph saved as 'realistic_energy_simulation.png'")
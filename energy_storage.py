@@ -0,0 +1,317 @@
+import json
+import os
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from energy_engine import MEASURES, Rollups, user_key
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet storage needs pyarrow
+    pa = pq = None
+
+
+class ParquetStore:
+    def __init__(self, root, compression='zstd', row_group_size=128 * 1024, user_buckets=16):
+        """
+        Compressed columnar storage for simulation output, partitioned by day and user bucket.
+
+        Rows are written to root/day=YYYY-MM-DD/bucket=NN/part-<run>-<n>.parquet
+        (hive-style, so pyarrow, pandas and most query engines can read the
+        directory as one dataset). Every store writes new part files, so a
+        dataset can be appended to by later runs.
+
+        Parameters:
+        - root: Directory of the dataset (created if missing)
+        - compression: Parquet compression codec ('zstd', 'snappy', 'gzip', 'none', ...)
+        - row_group_size: Rows buffered per partition before a row group is written
+        - user_buckets: Number of buckets users are hashed into (by the number in their user_id)
+        """
+        if pq is None:
+            raise ImportError("ParquetStore needs pyarrow (pip install pyarrow)")
+        self.root = root
+        self.compression = compression
+        self.row_group_size = row_group_size
+        self.user_buckets = user_buckets
+        self.rows_written = 0
+        self._run = uuid.uuid4().hex[:8]
+        self._schema = None
+        self._writers = {}  # (day, bucket) -> ParquetWriter
+        self._buffers = {}  # (day, bucket) -> (row count, list of tables not yet written)
+        os.makedirs(root, exist_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def append(self, chunk):
+        """
+        Append a DataFrame of simulation rows (e.g. one block from iter_chunks).
+
+        Chunks are expected in time order, as the simulator streams them:
+        partitions of days before the chunk's first day are finished and closed.
+        """
+        if len(chunk) == 0:
+            return
+        table = self._to_table(chunk)
+
+        # Partition key of every row: day code * buckets + user bucket
+        day_codes, days = pd.factorize(chunk['timestamp'].dt.normalize(), sort=True)
+        user_ids = pd.Categorical(chunk['user_id'])
+        bucket_of_user = np.array([user_key(u) % self.user_buckets for u in user_ids.categories], dtype=np.int64)
+        keys = day_codes * self.user_buckets + bucket_of_user[user_ids.codes]
+
+        order = np.argsort(keys, kind='stable')
+        bounds = np.flatnonzero(np.diff(keys[order])) + 1
+        for rows in np.split(order, bounds):
+            day_code, bucket = divmod(int(keys[rows[0]]), self.user_buckets)
+            self._buffer((days[day_code].strftime('%Y-%m-%d'), bucket), table.take(rows))
+
+        # Earlier days will not receive more rows
+        first_day = days[0].strftime('%Y-%m-%d')
+        for partition in [p for p in self._writers.keys() | self._buffers.keys() if p[0] < first_day]:
+            self._finish(partition)
+        self.rows_written += len(chunk)
+
+    def close(self):
+        """Write the remaining buffered rows and close every open file"""
+        for partition in list(self._writers.keys() | self._buffers.keys()):
+            self._finish(partition)
+
+    def read(self, columns=None, filters=None):
+        """
+        Read the dataset back into a DataFrame.
+
+        filters are pyarrow filters, which can prune whole partitions, e.g.
+        [('day', '=', '2024-01-01'), ('user_id', 'in', ['user_001'])].
+        The day/bucket partition columns are only included when listed in columns.
+        """
+        table = pq.read_table(self.root, columns=columns, filters=filters, partitioning='hive')
+        data = table.to_pandas()
+        listed = columns or []
+        return data.drop(columns=[name for name in ('day', 'bucket') if name in data and name not in listed])
+
+    def _to_table(self, chunk):
+        """Arrow table of a chunk with the dataset schema (labels as plain strings)"""
+        table = pa.Table.from_pandas(chunk, preserve_index=False)
+        if self._schema is None:
+            self._schema = pa.schema([
+                pa.field(field.name, field.type.value_type) if pa.types.is_dictionary(field.type) else field
+                for field in table.schema
+            ]).remove_metadata()
+        return table.cast(self._schema)
+
+    def _buffer(self, partition, table):
+        """Buffer rows of a partition and write every full row group of exactly row_group_size rows"""
+        rows, tables = self._buffers.get(partition, (0, []))
+        tables.append(table)
+        rows += len(table)
+        if rows >= self.row_group_size:
+            buffered = pa.concat_tables(tables)
+            full = rows - rows % self.row_group_size
+            self._write(partition, buffered.slice(0, full))
+            # The remainder waits for the next chunk, so only the last row group of a file can be short
+            rows = rows - full
+            tables = [buffered.slice(full)] if rows else []
+        self._buffers[partition] = (rows, tables)
+
+    def _write(self, partition, table):
+        writer = self._writers.get(partition)
+        if writer is None:
+            day, bucket = partition
+            directory = os.path.join(self.root, f"day={day}", f"bucket={bucket:02d}")
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f"part-{self._run}-{len(os.listdir(directory)):05d}.parquet")
+            writer = pq.ParquetWriter(path, self._schema, compression=self.compression)
+            self._writers[partition] = writer
+        writer.write_table(table, row_group_size=self.row_group_size)
+
+    def _finish(self, partition):
+        _, tables = self._buffers.pop(partition, (0, []))
+        if tables:
+            self._write(partition, pa.concat_tables(tables))
+        writer = self._writers.pop(partition, None)
+        if writer is not None:
+            writer.close()
+
+
+class SimulationStore:
+    def __init__(self, path, mode='r'):
+        """
+        On-disk simulation run stored as fixed-width memory-mapped columns.
+
+        Layout of the path directory:
+        - index.json: users, their types, measure names and the row count
+        - offsets.npy: row range of every user (user i owns rows offsets[i]:offsets[i + 1])
+        - timestamp.npy and one <measure>.npy per measure, rows grouped by user
+          and sorted by time within each user
+        - rollups.npz: rollup pyramid of the run (optional, see Rollups)
+
+        Opening only maps the files, so it takes the same time for any size of
+        run. Single-user reads are slices of the maps (zero-copy) and time
+        windows are found by binary search on the user's timestamps.
+
+        Use SimulationStore.create/write to make a store and open it by path
+        afterwards.
+        """
+        with open(os.path.join(path, 'index.json')) as f:
+            index = json.load(f)
+        self.path = path
+        self.users = index['users']
+        self.user_types = index['user_types']
+        self.measures = index['measures']
+        self.offsets = np.load(os.path.join(path, 'offsets.npy'))
+        self.columns = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mode)
+                        for name in ['timestamp', *self.measures]}
+        self._positions = None
+        self._rollups = None
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    @classmethod
+    def create(cls, path, user_ids, user_types, offsets, timestamp_dtype='datetime64[us]',
+               dtype=np.float32, measures=MEASURES):
+        """
+        Create an empty store with room for the given row ranges and open it for writing.
+
+        offsets holds len(user_ids) + 1 row boundaries (see the class docstring).
+        Fill the columns with write_block or by assigning to store.columns.
+        """
+        os.makedirs(path, exist_ok=True)
+        offsets = np.asarray(offsets, dtype=np.int64)
+        with open(os.path.join(path, 'index.json'), 'w') as f:
+            json.dump({'users': list(user_ids), 'user_types': list(user_types), 'measures': list(measures),
+                       'rows': int(offsets[-1])}, f)
+        np.save(os.path.join(path, 'offsets.npy'), offsets)
+
+        rows = int(offsets[-1])
+        for name, column_dtype in [('timestamp', timestamp_dtype), *((name, dtype) for name in measures)]:
+            np.lib.format.open_memmap(os.path.join(path, f"{name}.npy"), mode='w+',
+                                      dtype=column_dtype, shape=(rows,)).flush()
+        return cls(path, mode='r+')
+
+    @classmethod
+    def write(cls, path, data):
+        """
+        Store a simulation DataFrame (e.g. from generate_data) and return the store opened for reading.
+
+        Rows are grouped by user (in order of first appearance) and sorted by
+        time within each user before they are written.
+        """
+        user_ids = pd.Categorical(data['user_id'], categories=pd.unique(data['user_id']))
+        order = np.lexsort((data['timestamp'].to_numpy(), user_ids.codes))
+        counts = np.bincount(user_ids.codes, minlength=len(user_ids.categories))
+        first_rows = order[np.concatenate(([0], np.cumsum(counts)[:-1]))] if len(order) else []
+        user_types = data['user_type'].to_numpy()[first_rows] if 'user_type' in data else [''] * len(counts)
+        measures = [name for name in MEASURES if name in data]
+
+        store = cls.create(path, [str(u) for u in user_ids.categories], [str(t) for t in user_types],
+                           np.concatenate(([0], np.cumsum(counts))), data['timestamp'].to_numpy().dtype,
+                           data[measures[0]].dtype if measures else np.float32, measures)
+        for name in store.columns:
+            store.columns[name][:] = data[name].to_numpy()[order]
+        store.flush()
+        return cls(path)
+
+    def write_block(self, start, stop, timestamps, block):
+        """
+        Write intervals start:stop of every user from one block yielded by iter_fleet.
+
+        Requires the fleet layout, where every user owns the same number of rows.
+        """
+        intervals = np.diff(self.offsets)
+        if len(intervals) and (intervals != intervals[0]).any():
+            raise ValueError("write_block needs the same number of rows for every user")
+        num_users = len(self.users)
+        self.columns['timestamp'].reshape(num_users, -1)[:, start:stop] = np.asarray(timestamps)
+        for name in self.measures:
+            self.columns[name].reshape(num_users, -1)[:, start:stop] = block[name].T
+
+    @property
+    def rollups(self):
+        """Rollup pyramid stored with the run (None if there is none), loaded on first use"""
+        path = os.path.join(self.path, 'rollups.npz')
+        if self._rollups is None and os.path.exists(path):
+            self._rollups = Rollups.load(path)
+        return self._rollups
+
+    def flush(self):
+        """Write pending changes of the memory maps to disk"""
+        for column in self.columns.values():
+            if isinstance(column, np.memmap):
+                column.flush()
+
+    def user_rows(self, user_id, start=None, end=None):
+        """
+        Row range of a user, narrowed to the time window [start, end) by binary search.
+
+        Returns a slice (None if the user is not in the store).
+        """
+        position = self._position(user_id)
+        if position is None:
+            return None
+        return self._rows(position, start, end)
+
+    def read_user(self, user_id, start=None, end=None, columns=None):
+        """
+        One user's rows in the time window [start, end) as a DataFrame (None if unknown).
+
+        The timestamp and measure columns are views of the memory maps, so
+        nothing is copied until the values are used.
+        """
+        position = self._position(user_id)
+        if position is None:
+            return None
+        rows = self._rows(position, start, end)
+        length = rows.stop - rows.start
+
+        frame = {'timestamp': self.columns['timestamp'][rows],
+                 'user_id': pd.Categorical.from_codes(np.zeros(length, dtype=np.int8), [user_id]),
+                 'user_type': pd.Categorical.from_codes(np.zeros(length, dtype=np.int8),
+                                                        [self.user_types[position]])}
+        for name in (self.measures if columns is None else columns):
+            frame[name] = self.columns[name][rows]
+        return pd.DataFrame(frame, copy=False)
+
+    def read_window(self, start=None, end=None, columns=None):
+        """Rows of every user in the time window [start, end), grouped by user like generate_data"""
+        slices = [self._rows(position, start, end) for position in range(len(self.users))]
+        codes = np.repeat(np.arange(len(self.users)), [rows.stop - rows.start for rows in slices])
+        user_types = pd.Categorical(self.user_types)
+
+        frame = {'timestamp': self._gather('timestamp', slices),
+                 'user_id': pd.Categorical.from_codes(codes, self.users),
+                 'user_type': pd.Categorical.from_codes(user_types.codes[codes], user_types.categories)}
+        for name in (self.measures if columns is None else columns):
+            frame[name] = self._gather(name, slices)
+        return pd.DataFrame(frame, copy=False)
+
+    def to_frame(self):
+        """The whole run as one DataFrame (reads every row)"""
+        return self.read_window()
+
+    def _position(self, user_id):
+        """Index of a user in the store (None if unknown); the lookup table is built on first use"""
+        if self._positions is None:
+            self._positions = {user: i for i, user in enumerate(self.users)}
+        return self._positions.get(user_id)
+
+    def _rows(self, position, start=None, end=None):
+        """Row slice of the user at position within the time window [start, end)"""
+        first, last = int(self.offsets[position]), int(self.offsets[position + 1])
+        timestamps = self.columns['timestamp'][first:last]
+        lo = 0 if start is None else int(np.searchsorted(timestamps, np.datetime64(pd.Timestamp(start))))
+        hi = len(timestamps) if end is None else int(np.searchsorted(timestamps, np.datetime64(pd.Timestamp(end))))
+        return slice(first + lo, first + max(lo, hi))
+
+    def _gather(self, name, slices):
+        column = self.columns[name]
+        if not slices:
+            return column[:0].copy()
+        return np.concatenate([column[rows] for rows in slices])
@@ -0,0 +1,453 @@
+import argparse
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from math import pi, sin
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+try:
+    import requests
+except ImportError:  # Only the OpenWeatherMap backend needs requests
+    requests = None
+
+# Where forecasts come from: the OpenWeatherMap API (or a stub server speaking it), or a local fixture
+WEATHER_BACKENDS = ('openweathermap', 'fixture')
+# What to use until a fresh forecast arrives: an expired cached forecast if there is one, or the default cloud cover
+FALLBACK_POLICIES = ('stale', 'default')
+OPENWEATHERMAP_URL = 'https://api.openweathermap.org'
+DEFAULT_CLOUD_PCT = 50
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'energy_simulator', 'weather')
+
+
+def parse_forecast(data):
+    """Hour of day (UTC) -> cloud cover in % of an OpenWeatherMap 5 day / 3 hour forecast (later entries win)"""
+    forecast = {}
+    for item in data['list']:
+        hour = datetime.fromtimestamp(item['dt'], timezone.utc).hour
+        forecast[hour] = item['clouds']['all']
+    return forecast
+
+
+def parse_series(data):
+    """(times in epoch seconds, cloud cover in %) of an OpenWeatherMap forecast, sorted by time"""
+    times = np.array([item['dt'] for item in data['list']], dtype=np.int64)
+    clouds = np.array([item['clouds']['all'] for item in data['list']], dtype=float)
+    order = np.argsort(times, kind='stable')
+    return times[order], clouds[order]
+
+
+def cache_key(backend, lat, lon):
+    """Cache key of a location's forecast from a backend (shared by WeatherProvider and WeatherStore)"""
+    return f'{backend.source}|{float(lat):.4f}|{float(lon):.4f}'
+
+
+def stub_forecast(lat, lon, start=None, days=5):
+    """
+    A made-up forecast in the OpenWeatherMap format, for offline runs and tests.
+
+    Cloud cover follows a daily cycle with noise seeded by the location, so the
+    same site always gets the same forecast and nearby sites differ.
+
+    Parameters:
+    - lat, lon: Location of the forecast
+    - start: First forecast time (now if None), rounded down to 3 hours
+    - days: Number of days covered, in 3 hour steps like the real API
+    """
+    start = start or datetime.now(timezone.utc)
+    first = int(start.timestamp()) // 10800 * 10800
+    rng = random.Random(f"{float(lat):.4f},{float(lon):.4f}")
+    base = rng.uniform(20, 60)
+    items = []
+    for step in range(days * 8):
+        dt = first + step * 10800
+        hour = datetime.fromtimestamp(dt, timezone.utc).hour
+        clouds = base + 25 * sin(2 * pi * (hour - 9) / 24) + rng.uniform(-15, 15)
+        items.append({"dt": dt, "clouds": {"all": int(min(max(clouds, 0), 100))}})
+    return {"cod": "200", "cnt": len(items), "list": items,
+            "city": {"coord": {"lat": float(lat), "lon": float(lon)}}}
+
+
+class OpenWeatherMapBackend:
+    def __init__(self, api_key, url=OPENWEATHERMAP_URL, timeout=3.0, pool_size=8):
+        """
+        Forecasts from the OpenWeatherMap 5 day / 3 hour forecast API.
+
+        Requests go through one pooled session, so fetching many sites reuses
+        a few kept-alive connections instead of connecting for every site.
+
+        Parameters:
+        - api_key: OpenWeatherMap API key
+        - url: Base URL of the API (point it at serve_stub() to run without the internet)
+        - timeout: Seconds to wait for the connection and for the response
+        - pool_size: Connections kept open to the API (one per concurrent fetch)
+        """
+        if requests is None:
+            raise ImportError("OpenWeatherMapBackend needs requests (pip install requests)")
+        self.api_key = api_key
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    @property
+    def source(self):
+        return self.url
+
+    def fetch(self, lat, lon):
+        """Raw forecast JSON for a location (raises on network errors, timeouts and HTTP errors)"""
+        res = self.session.get(f'{self.url}/data/2.5/forecast', params={'lat': lat, 'lon': lon, 'appid': self.api_key},
+                           timeout=self.timeout)
+        if res.status_code != 200:
+            raise RuntimeError(f"HTTP {res.status_code} {res.reason}")
+        return res.json()
+
+
+class FixtureBackend:
+    def __init__(self, path=None):
+        """
+        Forecasts from a local JSON file in the OpenWeatherMap format.
+
+        Parameters:
+        - path: Fixture file (a saved API response); None generates stub_forecast() data
+        """
+        self.path = path
+
+    @property
+    def source(self):
+        return self.path or 'stub'
+
+    def fetch(self, lat, lon):
+        if self.path is None:
+            return stub_forecast(lat, lon)
+        with open(self.path, encoding='utf-8') as f:
+            return json.load(f)
+
+
+class WeatherCache:
+    def __init__(self, directory=DEFAULT_CACHE_DIR, ttl_seconds=3 * 3600):
+        """
+        Forecasts cached on disk, one JSON file per backend and location.
+
+        Parameters:
+        - directory: Directory of the cache files (created on the first save)
+        - ttl_seconds: Seconds a cached forecast counts as fresh (older ones are
+          only used as a fallback)
+        """
+        self.directory = directory
+        self.ttl_seconds = ttl_seconds
+
+    def path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode('utf-8')).hexdigest()[:16] + '.json')
+
+    def load(self, key):
+        """(fetched_at epoch seconds, raw forecast) cached under key, or None"""
+        try:
+            with open(self.path(key), encoding='utf-8') as f:
+                entry = json.load(f)
+            return entry['fetched_at'], entry['data']
+        except (OSError, ValueError, KeyError):  # Missing or unreadable (e.g. half-written) entries are misses
+            return None
+
+    def save(self, key, data, fetched_at=None):
+        """Cache a raw forecast under key; the file is replaced atomically, so readers never see a partial entry"""
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(key)
+        tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'key': key, 'fetched_at': time.time() if fetched_at is None else fetched_at, 'data': data}, f)
+        os.replace(tmp, path)
+
+    def is_fresh(self, fetched_at):
+        return time.time() - fetched_at < self.ttl_seconds
+
+
+class WeatherProvider:
+    def __init__(self, lat, lon, backend, cache=None, fallback='stale', default_cloud=DEFAULT_CLOUD_PCT):
+        """
+        Cloud cover forecast for one location that never blocks the caller on the network.
+
+        The constructor only reads the disk cache: a fresh cached forecast is used
+        as is, otherwise the fallback policy decides what is served while
+        refresh() fetches a new one on a background thread. Lookups then pick up
+        the fresh forecast as soon as it arrives, so a run that starts before the
+        fetch finishes switches from the fallback to the fresh values part way.
+
+        Parameters:
+        - lat, lon: Location of the forecast
+        - backend: OpenWeatherMapBackend or FixtureBackend
+        - cache: WeatherCache (None disables caching, so every run fetches)
+        - fallback: 'stale' (an expired cached forecast, else the default) or
+          'default' (default_cloud for every hour)
+        - default_cloud: Cloud cover in % used for hours without a forecast
+        """
+        if fallback not in FALLBACK_POLICIES:
+            raise ValueError(f"Unknown fallback policy: {fallback} (expected one of {', '.join(FALLBACK_POLICIES)})")
+        self.lat = lat
+        self.lon = lon
+        self.backend = backend
+        self.cache = cache
+        self.fallback = fallback
+        self.default_cloud = default_cloud
+        self.key = cache_key(backend, lat, lon)
+        self.error = None
+        self._forecast = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+        entry = cache.load(self.key) if cache is not None else None
+        if entry is not None and cache.is_fresh(entry[0]):
+            self._set(entry[1], 'cache')
+        elif entry is not None and fallback == 'stale':
+            self._set(entry[1], 'stale cache')
+        else:
+            self.source = 'default'
+
+    @property
+    def is_fresh(self):
+        return self.source in ('cache', 'backend')
+
+    def refresh(self, force=False):
+        """
+        Fetch a new forecast on a daemon thread unless the current one is fresh.
+
+        Returns immediately; use wait() to block until the fetch is done. Failures
+        are reported once and leave the fallback forecast in place.
+        """
+        with self._lock:
+            if (self.is_fresh and not force) or (self._thread is not None and self._thread.is_alive()):
+                return
+            self._thread = threading.Thread(target=self._fetch, name='weather-refresh', daemon=True)
+            self._thread.start()
+
+    def wait(self, timeout=None):
+        """Wait for a running refresh; True if no fetch is pending afterwards"""
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+            return not thread.is_alive()
+        return True
+
+    def get(self, hour, default=None):
+        """Cloud cover in % forecast for an hour of the day (default, or default_cloud, if there is none)"""
+        with self._lock:
+            return self._forecast.get(hour, self.default_cloud if default is None else default)
+
+    def forecast(self):
+        """The current forecast as a dict of hour of day -> cloud cover in %"""
+        with self._lock:
+            return dict(self._forecast)
+
+    def _fetch(self):
+        try:
+            data = self.backend.fetch(self.lat, self.lon)
+            parse_forecast(data)  # Reject malformed responses before they reach the cache
+            if self.cache is not None:
+                self.cache.save(self.key, data)
+        except Exception as e:  # Network errors, timeouts, HTTP errors and bad JSON all mean: keep the fallback
+            self.error = e
+            print(f"⚠️ Weather API failed ({e}). Using {self.source} cloud values.")
+            return
+        self._set(data, 'backend')
+
+    def _set(self, data, source):
+        forecast = parse_forecast(data)
+        with self._lock:
+            self._forecast = forecast
+            self.source = source
+
+
+class WeatherStore:
+    def __init__(self, sites, backend, cache=None, default_cloud=DEFAULT_CLOUD_PCT, workers=8):
+        """
+        Cloud cover series of many sites, indexed by (site, timestamp).
+
+        Every site keeps its whole multi-day forecast as a time series, and
+        cloud_cover() interpolates all of them onto a simulation's interval grid
+        at once, so any number of users share the series of a handful of sites.
+
+        Parameters:
+        - sites: dict of site name -> (lat, lon)
+        - backend: OpenWeatherMapBackend or FixtureBackend
+        - cache: WeatherCache (fresh entries are used without a request, expired
+          ones only when fetching the site fails)
+        - default_cloud: Cloud cover in % of sites without any forecast
+        - workers: Number of sites fetched concurrently
+        """
+        self.sites = {name: (lat, lon) for name, (lat, lon) in sites.items()}
+        self.backend = backend
+        self.cache = cache
+        self.default_cloud = default_cloud
+        self.workers = workers
+        self.series = {}  # site -> (times in epoch seconds, cloud cover in %), sorted by time
+        self.sources = {}  # site -> 'cache', 'stale cache', 'backend' or 'default'
+        self.errors = {}  # site -> exception of its last failed fetch
+
+    def fetch(self, force=False):
+        """
+        Load every site from the cache and fetch the missing or expired ones in one batch.
+
+        The batch runs workers requests at a time over the backend's pooled
+        session, so it takes about one request timeout per workers sites at
+        worst. Sites whose fetch fails keep their stale cached series, or the
+        default cloud cover. Returns the source of every site.
+        """
+        pending = []
+        for name, (lat, lon) in self.sites.items():
+            entry = self.cache.load(cache_key(self.backend, lat, lon)) if self.cache is not None else None
+            if entry is not None:
+                self.series[name] = parse_series(entry[1])
+                self.sources[name] = 'cache' if self.cache.is_fresh(entry[0]) else 'stale cache'
+            else:
+                self.sources[name] = 'default'
+            if force or self.sources[name] != 'cache':
+                pending.append(name)
+
+        if pending:
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(pending))) as pool:
+                for name, (data, error) in zip(pending, pool.map(self._fetch_site, pending)):
+                    if error is not None:
+                        self.errors[name] = error
+                        continue
+                    self.series[name] = parse_series(data)
+                    self.sources[name] = 'backend'
+                    self.errors.pop(name, None)
+            failed = [name for name in pending if name in self.errors]
+            if failed:
+                print(f"⚠️ Weather API failed for {len(failed)} of {len(self.sites)} sites "
+                      f"({self.errors[failed[0]]}). Using cached or default cloud values there.")
+        return dict(self.sources)
+
+    def cloud_cover(self, timestamps, sites=None):
+        """
+        Cloud cover in % of sites at timestamps, as an array of shape (sites, timestamps).
+
+        Inside a site's forecast the 3-hourly values are interpolated linearly;
+        outside it (e.g. a simulation of past days) the forecast's average
+        cycle over the hours of the day is used. Naive timestamps are taken as
+        UTC, like the forecast times. Sites are fetched on first use.
+
+        Parameters:
+        - timestamps: Timestamps of the simulation intervals (DatetimeIndex or datetime64 array)
+        - sites: Site names, in the order of the result rows (all sites if None)
+        """
+        if not self.sources:
+            self.fetch()
+        sites = list(self.sites) if sites is None else list(sites)
+        seconds = np.asarray(timestamps, dtype='datetime64[s]').astype(np.int64)
+        hours = (seconds % 86400) / 3600
+        out = np.full((len(sites), len(seconds)), float(self.default_cloud))
+
+        for row, name in enumerate(sites):
+            if name not in self.series:
+                continue
+            times, clouds = self.series[name]
+            inside = (seconds >= times[0]) & (seconds <= times[-1])
+            out[row, inside] = np.interp(seconds[inside], times, clouds)
+            if not inside.all():
+                # Average value per forecast hour of the day, interpolated around the clock
+                sample_hours, slot = np.unique((times % 86400) / 3600, return_inverse=True)
+                daily = np.bincount(slot, weights=clouds) / np.bincount(slot)
+                out[row, ~inside] = np.interp(hours[~inside], sample_hours, daily, period=24)
+        return out
+
+    def _fetch_site(self, name):
+        """(raw forecast, None) or (None, exception) for one site; successful fetches are cached"""
+        lat, lon = self.sites[name]
+        try:
+            data = self.backend.fetch(lat, lon)
+            parse_series(data)  # Reject malformed responses before they reach the cache
+            if self.cache is not None:
+                self.cache.save(cache_key(self.backend, lat, lon), data)
+            return data, None
+        except Exception as e:  # Network errors, timeouts, HTTP errors and bad JSON all mean: keep the fallback
+            return None, e
+
+
+def add_weather_arguments(parser):
+    """Add the --weather* options to an argparse parser"""
+    parser.add_argument('--weather', choices=WEATHER_BACKENDS, default='openweathermap',
+                        help="Forecast backend (default: %(default)s)")
+    parser.add_argument('--weather-url', default=OPENWEATHERMAP_URL,
+                        help="Base URL of the forecast API, e.g. a local stub server (default: %(default)s)")
+    parser.add_argument('--weather-fixture', default=None,
+                        help="JSON forecast file for the fixture backend (default: generated stub data)")
+    parser.add_argument('--weather-timeout', type=float, default=3.0,
+                        help="Seconds to wait for the forecast API (default: %(default)s)")
+    parser.add_argument('--weather-cache', default=DEFAULT_CACHE_DIR,
+                        help="Forecast cache directory, 'none' to disable (default: %(default)s)")
+    parser.add_argument('--weather-ttl', type=float, default=3 * 3600,
+                        help="Seconds a cached forecast stays fresh (default: %(default)s)")
+    parser.add_argument('--weather-fallback', choices=FALLBACK_POLICIES, default='stale',
+                        help="Forecast used until a fresh one arrives (default: %(default)s)")
+
+
+def weather_from_args(args, lat, lon, api_key):
+    """WeatherProvider configured from parsed --weather* options, with its refresh already started"""
+    if args.weather == 'fixture':
+        backend = FixtureBackend(args.weather_fixture)
+    else:
+        backend = OpenWeatherMapBackend(api_key, args.weather_url, args.weather_timeout)
+    cache = None if args.weather_cache == 'none' else WeatherCache(args.weather_cache, args.weather_ttl)
+    provider = WeatherProvider(lat, lon, backend, cache, args.weather_fallback)
+    provider.refresh()
+    return provider
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Keep-alive, so pooled sessions reuse their connections
+    fixture = None
+    latency = 0.0
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        if url.path != '/data/2.5/forecast' or 'lat' not in query or 'lon' not in query:
+            self.send_error(404)
+            return
+        body = json.dumps(FixtureBackend(self.fixture).fetch(query['lat'][0], query['lon'][0])).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_stub(host='127.0.0.1', port=8765, fixture=None, latency=0.0):
+    """
+    HTTP server answering /data/2.5/forecast like OpenWeatherMap, from a fixture or stub_forecast().
+
+    latency delays every response by that many seconds, to mimic the round
+    trip to the real API.
+
+    Returns the server (serve_forever() runs it; port 0 picks a free port,
+    see server.server_address).
+    """
+    handler = type('StubHandler', (_StubHandler,), {'fixture': fixture, 'latency': latency})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the OpenWeatherMap forecast API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--fixture', default=None, help="JSON forecast file to serve (default: generated stub data)")
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds every response is delayed by")
+    args = parser.parse_args()
+    server = serve_stub(args.host, args.port, args.fixture, args.latency)
+    print(f"Serving forecasts on http://{args.host}:{server.server_address[1]} "
+          f"(run the simulators with --weather-url http://{args.host}:{server.server_address[1]})")
+    server.serve_forever()
@@ -9,10 +9,10 @@ def main():
     simulator.save_to_csv(data)
     
     # Plot data for a specific user
-    simulator.plot_user_data("user_001")
+    simulator.plot_user_data("user_001", data)
     
     # Plot grid summary for all users
-    simulator.plot_grid_summary()
+    simulator.plot_grid_summary(data)
 
 if __name__ == "__main__":
     main()
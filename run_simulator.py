@@ -10,8 +10,8 @@ print("Energy data saved to energy_data_simulation.csv")
 
 # Show visualization for user_001
 print("Showing visualization for user_001...")
-simulator.plot_user_data("user_001")
+simulator.plot_user_data("user_001", data)
 
 # Show grid summary visualization 
 print("Showing grid summary...")
-simulator.plot_grid_summary()
+simulator.plot_grid_summary(data)
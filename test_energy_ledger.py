@@ -0,0 +1,29 @@
+import pandas as pd
+
+from energy_ledger import GENESIS_HASH, TradeLedger, verify_proof
+
+
+def _trades(count):
+    """Trades table of count 1 kWh trades between a few users"""
+    return pd.DataFrame({
+        'seller_id': [f"user_{i % 3 + 1:03d}" for i in range(count)],
+        'buyer_id': [f"user_{i % 5 + 4:03d}" for i in range(count)],
+        'quantity_kwh': 1.0,
+        'price': 0.12
+    })
+
+
+def test_load_follows_a_ledger_directory_created_after_it(tmp_path):
+    path = str(tmp_path / "ledger")
+    reader = TradeLedger.load(path)
+    assert len(reader.blocks) == 0
+    assert reader.head == GENESIS_HASH
+    assert reader.user_proofs('user_001') == []
+
+    with TradeLedger(path, block_size=4) as writer:
+        writer.append(_trades(10))
+    assert len(reader.blocks) == 3
+    assert reader.head == writer.head
+    proofs = reader.user_proofs('user_001')
+    assert len(proofs) == 4
+    assert all(verify_proof(proof) for proof in proofs)